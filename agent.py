@@ -1,9 +1,167 @@
 import re
+import json
+import copy
 import time
+import logging
+import functools
 from typing import List
+from dataclasses import dataclass
 import config
 import prompts_constants
-from utils import retry
+from utils import retry, is_transient_error, circuit_breaker_for
+from rate_limiter import limiter_for, estimate_input_tokens
+from llm_cache import get_llm_cache
+from providers import get_provider, TokenUsage
+from budget import get_cost_ledger, get_token_estimator, prompt_token_budget, compact_history, usage_cost, USAGE_FIELDS
+
+
+def provider_retry(provider_name):
+    """
+    Retry decorator of provider calls: only rate limits, 5xx and network errors are retried, with jittered
+    exponential backoff, and an outage of one provider opens its circuit breaker instead of hammering it
+    from every game.
+    :param provider_name: Returns the provider called, given the arguments of the decorated function.
+    """
+    return retry(retries=6, delay=2, backoff=2, max_delay=60, jitter=True, retry_on=is_transient_error,
+                 breaker=lambda *args, **kwargs: circuit_breaker_for(provider_name(*args, **kwargs)))
+
+
+llm_retry = provider_retry(lambda agent, *args, **kwargs: agent.llm_name)
+
+
+async def call_provider_async(provider, request: dict, stop_condition=None) -> tuple:
+    """
+    Sends a request with the async client of provider, streamed if config.STREAM_RESPONSES, in which case
+    the stream is closed as soon as stop_condition holds for the text so far. Returns (text, TokenUsage,
+    time of the first streamed token or None, stopped early); a stream stopped early has no usage (None).
+    """
+    if not config.STREAM_RESPONSES:
+        output_text, usage = provider.parse(await provider.create_async(request))
+        return output_text, usage, None, False
+    stream = provider.stream_async(request)
+    output_text, usage, first_token_time, stopped_early = "", None, None, False
+    try:
+        async for text, chunk_usage in stream:
+            if text and first_token_time is None:
+                first_token_time = time.monotonic()
+            output_text += text
+            usage = chunk_usage or usage
+            if stop_condition is not None and stop_condition(output_text):
+                stopped_early = True
+                break
+    finally:
+        await stream.aclose()
+    return output_text, usage, first_token_time, stopped_early
+
+
+NO_ONE = "no one"
+
+
+@dataclass
+class LLMRequest:
+    """
+    A provider call an agent waits for, yielded by its action steps (see Agent.action_steps) and
+    answered with the response text.
+    :param request_id: Identifies the call within its game, e.g. "player_3.12" for the 13th call of player_3.
+    :param llm_name: Provider the request is built for, see providers.get_provider.
+    :param action: Kind of call, a key of config.ACTION_SETTINGS.
+    :param request: Provider request, see Provider.build_request.
+    :param estimated_tokens: Predicted prompt tokens, for the rate limiters.
+    :param stop_condition: Predicate on the streamed text telling when the answer is complete, if any.
+    """
+    request_id: str
+    llm_name: str
+    action: str
+    request: dict
+    estimated_tokens: int
+    stop_condition: object = None
+
+
+class InvalidDecisionError(ValueError):
+    """Raised for a vote, kill, investigation or don guess that names no legal target."""
+
+    def __init__(self, response: str, legal_targets: list):
+        super().__init__(f"No legal target in {response[:100]!r}, expected one of: {', '.join(legal_targets)}.")
+        self.response = response
+        self.legal_targets = legal_targets
+
+
+def decision_schema(legal_targets: list) -> dict:
+    """JSON schema of a decision: one of the legal targets, then a short reason."""
+    return {
+        "type": "object",
+        "properties": {
+            "target": {"type": "string", "enum": legal_targets},
+            "reason": {"type": "string"},
+        },
+        "required": ["target", "reason"],
+        "additionalProperties": False,
+    }
+
+
+def _normalize_target(text: str):
+    match = re.search(r"\bplayer[_ ]?(\d+)\b|\b(no one)\b", text, re.IGNORECASE)
+    if match is None:
+        return None
+    return f"player_{int(match.group(1))}" if match.group(1) is not None else NO_ONE
+
+
+def parse_decision(response: str, legal_targets: list) -> tuple:
+    """
+    Returns (target, reason) of a decision. Structured outputs are JSON (possibly cut short by
+    STREAM_EARLY_STOP); a plain text answer is read strictly: its first line must name 'player_#'
+    or 'no one', as the prompts ask. Raises InvalidDecisionError unless the target is legal.
+    """
+    target, reason = None, None
+    try:
+        decision = json.loads(response)
+    except ValueError:
+        decision = None
+    if isinstance(decision, dict):
+        target, reason = decision.get("target"), decision.get("reason")
+    elif re.search(r'"target"\s*:', response):
+        target_match = re.search(r'"target"\s*:\s*"([^"]*)"', response)
+        reason_match = re.search(r'"reason"\s*:\s*"((?:[^"\\]|\\.)*)"', response)
+        target = target_match.group(1) if target_match else None
+        reason = reason_match.group(1) if reason_match else None
+    else:
+        lines = response.strip().split("\n", 1)
+        target = lines[0]
+        reason = lines[1].strip() if len(lines) > 1 else None
+
+    target = _normalize_target(target) if isinstance(target, str) else None
+    if target not in legal_targets:
+        raise InvalidDecisionError(response, legal_targets)
+    return target, reason.strip() if isinstance(reason, str) and reason.strip() else "No reason provided"
+
+
+def target_index(target: str) -> int:
+    """Player index of a decision target, -1 for no one."""
+    return -1 if target == NO_ONE else int(target.replace("player_", ""))
+
+
+def noted_player(note: str) -> int:
+    """The player an investigation or don guess note is about, in either event encoding."""
+    return int(re.search(r"p(?:layer_)?(\d+)", note).group(1))
+
+
+def target_line_complete(text: str) -> bool:
+    """True once the target of a vote, kill, investigation or don guess answer has been received."""
+    if re.search(r'"target"\s*:\s*"[^"]*"', text):
+        return True
+    first_line, newline, _ = text.partition("\n")
+    return bool(newline) and _normalize_target(first_line) is not None
+
+
+# "stateless": every call sends the system prompt and the whole game history. "session": every agent keeps
+# its conversation and each call only adds the events since its last turn, see Agent._session_turn.
+PROMPT_MODES = ["stateless", "session"]
+
+USAGE_COUNTERS = ["input_tokens_used", "cached_input_tokens_used", "cache_write_input_tokens_used",
+                  "output_tokens_used", "thinking_tokens_used"]
+# Per-call records of an agent, started over with the token counters when a game is forked.
+CALL_RECORDS = ["opinion_speech_generation_durations", "call_timings", "invalid_decisions", "fallback_decisions",
+                "call_costs"]
 
 
 class Agent:
@@ -13,6 +171,8 @@ class Agent:
         self.role = player_role
         self.status = "alive"
         self.input_tokens_used = 0
+        self.cached_input_tokens_used = 0
+        self.cache_write_input_tokens_used = 0
         self.output_tokens_used = 0
         self.thinking_tokens_used = 0
         self.votes = []
@@ -23,6 +183,23 @@ class Agent:
         self.mafia_kill_targets = []
         self.don_guesses = []
         self.opinion_speech_generation_durations = []
+        self.last_call_duration = 0.0
+        self.last_call_timing = {}
+        self.call_timings = []
+        self.invalid_decisions = []
+        self.fallback_decisions = []
+        # Set by the game before every phase, for the cost ledger entries.
+        self.game_id = None
+        self.phase = None
+        self.call_costs = []
+        # Set by the game, see game_events.EVENT_ENCODINGS and PROMPT_MODES.
+        self.event_encoding = "prose"
+        self.prompt_mode = "stateless"
+        # The conversation of the "session" prompt mode: earlier turns as {"role", "content"} messages,
+        # and the system prompt and game history they were built from.
+        self.session = []
+        self.session_system = ""
+        self.session_history = ""
 
         if self.role in ["mafia", "don"]:
             self.mafia_players = [f"player_{i}" for i in mafia_player_indices]
@@ -39,80 +216,317 @@ class Agent:
             "llm_name": self.llm_name
         }
 
-    @retry(retries=4, delay=10)
-    def _call_llm(self, system_prompt: str, user_prompt: str) -> str:
-        if self.llm_name == "openai":
-            llm_response = config.OPENAI_CLIENT.chat.completions.create(
-                model=config.OPENAI_MODEL,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ],
-            )
-            output_text = llm_response.choices[0].message.content.strip()
-            self.input_tokens_used += llm_response.usage.prompt_tokens
-            self.output_tokens_used += (
-                        llm_response.usage.completion_tokens - llm_response.usage.completion_tokens_details.reasoning_tokens)
-            self.thinking_tokens_used += llm_response.usage.completion_tokens_details.reasoning_tokens
-
-        elif self.llm_name == "gemini":
-            prompt = system_prompt + "\n\n" + user_prompt
-            llm_response = config.GEMINI_CLIENT.models.generate_content(
-                model=config.GEMINI_MODEL,
-                contents=prompt,
-            )
-            output_text = llm_response.text.strip() if hasattr(llm_response, "text") else ""
-            self.input_tokens_used += llm_response.usage_metadata.prompt_token_count
-            self.output_tokens_used += llm_response.usage_metadata.candidates_token_count
-            self.thinking_tokens_used += llm_response.usage_metadata.thoughts_token_count
-
-        elif self.llm_name == "deepseek":
-            llm_response = config.DEEPSEEK_CLIENT.chat.completions.create(
-                model=config.DEEPSEEK_MODEL,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ],
-                temperature=0.3,
-            )
-            output_text = llm_response.choices[0].message.content.strip()
-            self.input_tokens_used += llm_response.usage.prompt_tokens
-            self.output_tokens_used += (
-                        llm_response.usage.completion_tokens - llm_response.usage.completion_tokens_details.reasoning_tokens)
-            self.thinking_tokens_used += llm_response.usage.completion_tokens_details.reasoning_tokens
-
-        elif self.llm_name == "claude":
-            llm_response = config.CLAUDE_CLIENT.messages.create(
-                model=config.CLAUDE_MODEL,
-                system=system_prompt,
-                messages=[
-                    {"role": "user", "content": user_prompt}
-                ],
-                max_tokens=6000,
-                thinking={
-                    "type": "enabled",
-                    "budget_tokens": 5000
-                }
-            )
-            output_text = llm_response.content[1].text.strip() if hasattr(llm_response, "content") else ""
-            self.input_tokens_used += llm_response.usage.input_tokens
-            self.output_tokens_used += llm_response.usage.output_tokens
-
-        elif self.llm_name == "grok":
-            llm_response = config.GROK_CLIENT.chat.completions.create(
-                model=config.GROK_MODEL,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ],
-                temperature=0.3
-            )
-            output_text = llm_response.choices[0].message.content.strip()
-            self.input_tokens_used += llm_response.usage.prompt_tokens
-            self.output_tokens_used += llm_response.usage.completion_tokens
-            self.thinking_tokens_used += llm_response.usage.completion_tokens_details.reasoning_tokens
+    def to_state(self) -> dict:
+        """Everything the agent remembers (plain JSON data), for the game checkpoints."""
+        return copy.deepcopy(self.__dict__)
+
+    @classmethod
+    def from_state(cls, state: dict):
+        """Rebuilds an agent from to_state(). Fields missing from older states keep their initial values."""
+        agent = cls(state["llm_name"], state["player_name"], state["role"], [])
+        agent.__dict__.update(copy.deepcopy(state))
+        return agent
+
+    @property
+    def provider(self):
+        return get_provider(self.llm_name)
+
+    def _request_kwargs(self, system_prompt: str, user_prompt: str, history: str = "", schema: dict = None,
+                        messages: list = None, action: str = None) -> dict:
+        """
+        Provider request for the prompts, history being the cacheable start of user_prompt and messages
+        the earlier turns of the session, if any, with the generation settings of action.
+        """
+        if not config.STRUCTURED_OUTPUTS:
+            schema = None
+        request = self.provider.build_request(system_prompt, user_prompt, history, schema, messages)
+        settings = config.ACTION_SETTINGS.get(action)
+        if settings:
+            request = self.provider.apply_settings(request, settings)
+        return request
+
+    def _usage_snapshot(self) -> dict:
+        return {counter: getattr(self, counter) for counter in USAGE_COUNTERS}
+
+    def _cache_lookup(self, request: dict):
+        """Returns (cache, key, recorded response or None) for a request, (None, None, None) if caching is off."""
+        cache = get_llm_cache()
+        if cache is None:
+            return None, None, None
+        key = cache.key(self.llm_name, request)
+        return cache, key, cache.lookup(key)
+
+    def _replay(self, recorded: dict) -> str:
+        for counter, tokens in recorded["usage"].items():
+            setattr(self, counter, getattr(self, counter) + tokens)
+        self.last_call_duration = recorded["duration"]
+        self.last_call_timing = {"streamed": False, "replayed": True, "stopped_early": False,
+                                 "time_to_first_token": None, "total_time": recorded["duration"]}
+        return recorded["response"]
+
+    def _cache_store(self, cache, key: str, output_text: str, usage_before: dict):
+        if cache is None:
+            return
+        usage = {counter: getattr(self, counter) - tokens for counter, tokens in usage_before.items()}
+        cache.store(key, self.llm_name, output_text, usage, self.last_call_duration)
+
+    def _record_call_timing(self, action: str, usage_before: dict):
+        """
+        Appends the timing of the last call to call_timings. Times come from the successful provider
+        request, without rate limiter queueing and retries; tokens_per_second counts output and thinking
+        tokens over the total time.
+        """
+        generated_tokens = (self.output_tokens_used - usage_before["output_tokens_used"]
+                            + self.thinking_tokens_used - usage_before["thinking_tokens_used"])
+        total_time = self.last_call_timing["total_time"]
+        self.call_timings.append({
+            "action": action,
+            **self.last_call_timing,
+            "generated_tokens": generated_tokens,
+            "tokens_per_second": generated_tokens / total_time if total_time else None,
+        })
+
+    def _session_turn(self, system_prompt: str, user_prompt: str, history: str) -> tuple:
+        """
+        In the "session" prompt mode, turns a prompt into the next turn of the agent's conversation: the
+        earlier turns are sent unchanged, a prefix the providers cache, and the new turn only has the game
+        events since the agent's last turn and the instructions. A session whose history no longer
+        continues (rolling history policy) or that would pass prompt_token_budget starts over with the
+        full prompt. Returns (earlier turns, user prompt of this turn, cacheable history of this turn).
+        """
+        if self.prompt_mode != "session" or not history or not user_prompt.startswith(history):
+            return [], user_prompt, history
+        if self.session and system_prompt == self.session_system and history.startswith(self.session_history):
+            new_events = history[len(self.session_history):]
+            turn = (f"New events since your last turn:{new_events}" if new_events
+                    else "No new events since your last turn.") + user_prompt[len(history):]
+            session_tokens = get_token_estimator().estimate(
+                self.llm_name, system_prompt, turn, *(message["content"] for message in self.session))
+            if session_tokens <= prompt_token_budget(self.llm_name):
+                return list(self.session), turn, ""
+        self.session = []
+        return [], user_prompt, history
+
+    def _record_session_turn(self, system_prompt: str, history: str, user_prompt: str, output_text: str):
+        if self.prompt_mode != "session" or not history:
+            return
+        self.session += [{"role": "user", "content": user_prompt}, {"role": "assistant", "content": output_text}]
+        self.session_system = system_prompt
+        self.session_history = history
+
+    def _preflight(self, system_prompt: str, user_prompt: str, history: str, messages: list = None) -> tuple:
+        """
+        Estimates the prompt tokens of a call before it is made. A prompt over prompt_token_budget loses
+        its oldest game history. Returns (user_prompt, history, estimated tokens).
+        """
+        estimator = get_token_estimator()
+        session_prompts = [message["content"] for message in messages or []]
+        predicted_tokens = estimator.estimate(self.llm_name, system_prompt, user_prompt, *session_prompts)
+        budget = prompt_token_budget(self.llm_name)
+        if predicted_tokens > budget and history and user_prompt.startswith(history):
+            excess_characters = (len(system_prompt) + len(user_prompt)) * (1 - budget / predicted_tokens)
+            history, compacted_prompt = compact_history(history, user_prompt, int(len(user_prompt) - excess_characters))
+            if compacted_prompt != user_prompt:
+                user_prompt = compacted_prompt
+                compacted_tokens = estimator.estimate(self.llm_name, system_prompt, user_prompt)
+                logging.warning(f"{self.player_name} ({self.llm_name}): prompt of ~{predicted_tokens} tokens is over "
+                                f"the budget of {budget:.0f}, sending ~{compacted_tokens} tokens without the oldest "
+                                f"history.")
+                predicted_tokens = compacted_tokens
+        if predicted_tokens > budget:
+            logging.warning(f"{self.player_name} ({self.llm_name}): prompt of ~{predicted_tokens} tokens is over "
+                            f"the budget of {budget:.0f}.")
+        return user_prompt, history, predicted_tokens
+
+    def _record_call_cost(self, action: str, usage_before: dict, predicted_tokens: int):
+        """
+        Prices the last call and records it in call_costs and the cost ledger, see _preflight. A call
+        replayed from the LLM cache spent nothing and costs 0.
+        """
+        usage = {field: getattr(self, counter) - usage_before[counter]
+                 for field, counter in zip(USAGE_FIELDS, USAGE_COUNTERS)}
+        entry = {
+            "game": self.game_id,
+            "phase": self.phase,
+            "action": action,
+            "provider": self.llm_name,
+            "replayed": self.last_call_timing["replayed"],
+            "predicted_input_tokens": predicted_tokens,
+            **usage,
+            "cost": 0.0 if self.last_call_timing["replayed"] else usage_cost(self.llm_name, usage),
+        }
+        self.call_costs.append(entry)
+        get_cost_ledger().record(entry)
+        if not self.last_call_timing["stopped_early"]:
+            actual_tokens = usage["input_tokens"] + usage["cached_input_tokens"] + usage["cache_write_input_tokens"]
+            get_token_estimator().observe(self.llm_name, predicted_tokens, actual_tokens)
+
+    @staticmethod
+    def _stop_condition(action: str):
+        if config.STREAM_EARLY_STOP and action in ["vote", "kill", "investigate", "don_guess"]:
+            return target_line_complete
+        return None
+
+    # The actions are written as generators that yield the LLMRequests they need and receive the response
+    # texts back, so the same prompts and parsing serve the blocking calls of Agent, the coroutines of
+    # AsyncAgent and the step API of the game (MafiaGame.pending_requests), where a scheduler makes the calls.
+
+    def action_steps(self, method: str, *args, **kwargs):
+        """The steps of an action method (e.g. "vote_day") called with args, see LLMRequest."""
+        return getattr(self, f"_{method}_steps")(*args, **kwargs)
+
+    def _run_steps(self, steps):
+        try:
+            llm_request = next(steps)
+            while True:
+                start_time = time.monotonic()
+                output_text = self._call_provider(llm_request.request, llm_request.estimated_tokens,
+                                                  llm_request.stop_condition)
+                self.last_call_duration = time.monotonic() - start_time
+                llm_request = steps.send(output_text)
+        except StopIteration as stop:
+            return stop.value
+
+    def accept_response(self, llm_request: LLMRequest, output_text: str, usage: TokenUsage = None,
+                        duration: float = 0.0, call_timing: dict = None) -> str:
+        """
+        Accounts a response to one of the agent's LLMRequests that was obtained by someone else (the
+        scheduler of the step API) and returns the text to send to the waiting steps. A response without
+        usage is estimated from the prompt and the text.
+        :param call_timing: "streamed", "stopped_early" and "time_to_first_token" of the call, as measured
+            by the scheduler; a call not streamed by default.
+        """
+        self.last_call_timing = {"streamed": False, "replayed": False, "stopped_early": False,
+                                 "time_to_first_token": None, **(call_timing or {}), "total_time": duration}
+        self.last_call_duration = duration
+        return self._consume_response(output_text, usage, None, llm_request.estimated_tokens)
+
+    def _call_llm_steps(self, system_prompt: str, user_prompt: str, history: str = "", action: str = None,
+                        schema: dict = None):
+        full_history = history
+        messages, user_prompt, history = self._session_turn(system_prompt, user_prompt, history)
+        user_prompt, history, predicted_tokens = self._preflight(system_prompt, user_prompt, history, messages)
+        request = self._request_kwargs(system_prompt, user_prompt, history, schema, messages, action)
+        cache, key, recorded = self._cache_lookup(request)
+        usage_before = self._usage_snapshot()
+        if recorded is not None:
+            output_text = self._replay(recorded)
+        else:
+            # Until it is recorded, the call holds its estimated prompt cost in the ledger, so tournament
+            # admission (budget.TournamentBudget) sees the spend of the calls in flight.
+            reserved_cost = usage_cost(self.llm_name, {"input_tokens": predicted_tokens})
+            get_cost_ledger().reserve(self.llm_name, reserved_cost)
+            try:
+                output_text = yield LLMRequest(f"{self.player_name}.{len(self.call_timings)}", self.llm_name,
+                                               action, request, predicted_tokens, self._stop_condition(action))
+            finally:
+                get_cost_ledger().release(self.llm_name, reserved_cost)
+            self._cache_store(cache, key, output_text, usage_before)
+        self._record_call_timing(action, usage_before)
+        self._record_call_cost(action, usage_before, predicted_tokens)
+        self._record_session_turn(system_prompt, full_history, user_prompt, output_text)
         return output_text
 
+    @llm_retry
+    def _call_provider(self, request: dict, estimated_tokens: int, stop_condition=None) -> str:
+        limiter = limiter_for(self.llm_name)
+        with limiter.limit(estimated_tokens):
+            start_time = time.monotonic()
+            if config.STREAM_RESPONSES:
+                stream = self.provider.stream(request)
+                output_text, usage, first_token_time, stopped_early = "", None, None, False
+                try:
+                    for text, chunk_usage in stream:
+                        if text and first_token_time is None:
+                            first_token_time = time.monotonic()
+                        output_text += text
+                        usage = chunk_usage or usage
+                        if stop_condition is not None and stop_condition(output_text):
+                            stopped_early = True
+                            break
+                finally:
+                    stream.close()
+            else:
+                output_text, usage = self.provider.parse(self.provider.create(request))
+                first_token_time, stopped_early = None, False
+            self._set_call_timing(start_time, first_token_time, stopped_early)
+        return self._consume_response(output_text, usage, limiter, estimated_tokens)
+
+    def _set_call_timing(self, start_time: float, first_token_time: float, stopped_early: bool):
+        self.last_call_timing = {
+            "streamed": config.STREAM_RESPONSES,
+            "replayed": False,
+            "stopped_early": stopped_early,
+            "time_to_first_token": first_token_time - start_time if first_token_time is not None else None,
+            "total_time": time.monotonic() - start_time,
+        }
+
+    def _consume_response(self, output_text: str, usage: TokenUsage, limiter, estimated_tokens: int) -> str:
+        """
+        Adds the token usage of a provider response to the agent totals and returns its text.
+        Input tokens are split into uncached, cache reads and (Claude only) cache writes.
+        A stream that was stopped early reports no usage, so it is estimated from the prompt and the text.
+        limiter is None for responses of the step API, whose scheduler settles its own limiters.
+        """
+        if usage is None:
+            usage = TokenUsage(input_tokens=estimated_tokens, output_tokens=estimate_input_tokens(output_text))
+        self.input_tokens_used += usage.input_tokens
+        self.cached_input_tokens_used += usage.cached_input_tokens
+        self.cache_write_input_tokens_used += usage.cache_write_input_tokens
+        self.output_tokens_used += usage.output_tokens
+        self.thinking_tokens_used += usage.thinking_tokens
+        if limiter is not None:
+            limiter.settle(estimated_tokens,
+                           usage.input_tokens + usage.cached_input_tokens + usage.cache_write_input_tokens)
+        return output_text.strip()
+
+    # A decision naming no legal target is asked again with a correction note appended to the prompt
+    # (the prompt prefix stays cacheable), up to DECISION_REASKS times, then a default is logged and used.
+
+    def _invalid_decision(self, action: str, error: InvalidDecisionError, attempt: int) -> str:
+        """Records an invalid answer and returns the correction note for the next attempt."""
+        self.invalid_decisions.append({"action": action, "attempt": attempt, "response": error.response})
+        first_line = error.response.strip().split("\n", 1)[0][:100]
+        return (
+            f"\n\nYour previous answer could not be used: '{first_line}' does not name an allowed choice.\n"
+            f"Answer again, starting with exactly one of: {', '.join(error.legal_targets)}."
+        )
+
+    def _default_target(self, action: str, legal_targets: list) -> str:
+        if action == "vote":
+            return NO_ONE
+        if action == "kill":
+            preferred = [t for t in legal_targets if t != self.player_name and t not in self.mafia_players]
+        elif action == "investigate":
+            investigated = {noted_player(note) for note in self.investigations}
+            preferred = [t for t in legal_targets if target_index(t) not in investigated]
+        else:
+            guessed = {noted_player(guess) for guess in self.don_guesses}
+            preferred = [t for t in legal_targets if target_index(t) not in guessed]
+        return (preferred or legal_targets)[0]
+
+    def _fallback_decision(self, action: str, legal_targets: list, parse):
+        target = self._default_target(action, legal_targets)
+        attempts = config.DECISION_REASKS + 1
+        logging.warning(f"{self.player_name} ({self.llm_name}) gave {attempts} invalid {action} answers, "
+                        f"using the default {target}.")
+        self.fallback_decisions.append({"action": action, "target": target, "attempts": attempts})
+        reason = f"Default {action}: no valid answer after {attempts} attempts."
+        return parse(json.dumps({"target": target, "reason": reason}), legal_targets)
+
+    def _decide_steps(self, action: str, system_prompt: str, user_prompt: str, history: str, legal_targets: list,
+                      parse):
+        """Asks the LLM for a decision and returns parse(response, legal_targets), see _invalid_decision."""
+        correction = ""
+        for attempt in range(config.DECISION_REASKS + 1):
+            response = yield from self._call_llm_steps(system_prompt, user_prompt + correction, history, action,
+                                                       decision_schema(legal_targets))
+            try:
+                return parse(response, legal_targets)
+            except InvalidDecisionError as error:
+                correction = self._invalid_decision(action, error, attempt)
+        return self._fallback_decision(action, legal_targets, parse)
+
     def _build_system_prompt(self):
         rules = prompts_constants.SYSTEM_PROMPTS["rules"]
         role_prompt = prompts_constants.SYSTEM_PROMPTS.get(self.role, "")
@@ -122,18 +536,31 @@ class Agent:
             mafia_list = ", ".join(self.mafia_players)
             mafia_prompt += f"\nYou are part of the Mafia. The Don is {self.don}. The other mafia players are: {mafia_list}."
 
-        return f"{rules}\n\n{role_prompt}\n\nYou are {self.player_name}. Your role is {self.role}.{mafia_prompt}"
+        legend = prompts_constants.COMPACT_EVENT_LEGEND if self.event_encoding == "compact" else ""
+        return f"{rules}{legend}\n\n{role_prompt}\n\nYou are {self.player_name}. Your role is {self.role}.{mafia_prompt}"
 
-    def speak_opinion(self, game_log: str) -> str:
-        system_prompt = self._build_system_prompt()
+    @staticmethod
+    def _history(game_log: str) -> str:
+        """The cacheable start of every user prompt, see _request_kwargs."""
+        return f"Here is what happened in the game so far:\n{game_log}"
+
+    def _investigation_history(self) -> str:
         investigation_history = ""
         if self.role == "detective" and self.investigations:
             investigation_history = "Here is your investigation history:\n" + "\n".join(self.investigations) + "\n"
         if self.role in ["mafia","don"] and self.don_guesses:
             investigation_history = "Here the insight from don's investigation until now:\n " + "\n".join(self.don_guesses) + "\n"
+        return investigation_history
 
-        user_prompt = (
-            f"Here is what happened in the game so far:\n{game_log}\n\n"
+    # Every action is a _*_steps generator built from the prompt builders and response parsers below:
+    # it yields an LLMRequest for each LLM call and is sent the response text, so the synchronous
+    # Agent (_run_steps), the AsyncAgent (_run_steps_async) and the step API of the game share
+    # everything except how the LLM call itself is made.
+
+    def _opinion_prompt(self, game_log: str) -> str:
+        investigation_history = self._investigation_history()
+        return (
+            f"{self._history(game_log)}\n\n"
             f"As {self.player_name} (role: {self.role}), please express your thoughts and suspicions about who could be Mafia. "
             f"{investigation_history}"
             "Use the information from the game of how a player died to assess how many Mafia could still be alive.\n"
@@ -142,26 +569,20 @@ class Agent:
             "Consider your role and any relevant interactions you've had. Your reason should be logical and persuasive.\n"
             "Return only your statement. The statement should be brief and not exceed 3-4 sentences in length to keep it concise.\n"
         )
-        start_time = time.time()
-        statement = self._call_llm(system_prompt, user_prompt)
-        end_time = time.time()
-        self.opinion_speech_generation_durations.append(end_time - start_time)
+
+    def _record_opinion(self, statement: str, duration: float) -> str:
+        self.opinion_speech_generation_durations.append(duration)
         self.statements.append({
             "player_id": self.player_name,
             "statement": statement
         })
         return statement
 
-    def vote_day(self, game_log: str, nominees: list[int], past_votes: str = "") -> tuple:
+    def _vote_prompt(self, game_log: str, nominees: list[int], past_votes: str = "") -> str:
         nominee_names = [f"player_{i}" for i in nominees]
-        system_prompt = self._build_system_prompt()
-        investigation_history = ""
-        if self.role == "detective" and self.investigations:
-            investigation_history = "Here is your investigation history:\n" + "\n".join(self.investigations) + "\n"
-        if self.role in ["mafia","don"] and self.don_guesses:
-            investigation_history = "Here the insight from don's investigation until now:\n " + "\n".join(self.don_guesses) + "\n"
+        investigation_history = self._investigation_history()
         user_prompt = (
-            f"Here is what happened in the game so far:\n{game_log}\n\n"
+            f"{self._history(game_log)}\n\n"
             f"The following players are nominated for elimination: {', '.join(nominee_names)}.\n"
             f"Past votes and reasons:\n{past_votes}\n\n"
             "Choose who you want to eliminate or vote for no one.\n"
@@ -182,19 +603,16 @@ class Agent:
         short vote reasoning...
         
         YOU MUST RESPOND WITH THE EXAMPLE FORMAT, IF YOUR RESPONSE IS NOT ACCORDING TO THE EXAMPLE THEN YOU WILL FAIL YOUR TASK"""
+        return user_prompt
+
+    def _vote_targets(self, nominees: list[int]) -> list:
+        return [f"player_{i}" for i in nominees] + [NO_ONE]
 
-        response = self._call_llm(system_prompt, user_prompt)
+    def _parse_vote(self, response: str, legal_targets: list) -> tuple:
         print(self.player_name)
         print(response)
 
-        lines = response.split("\n", 1)
-
-        vote_choice = int(re.search(r'\d+', lines[0]).group()) if re.search(r'\d+', lines[0]) else None
-        if vote_choice:
-            vote_choice = f"player_{vote_choice}"
-        else:
-            vote_choice = "no one"
-        reason = lines[1].strip() if len(lines) > 1 else "No reason provided"
+        vote_choice, reason = parse_decision(response, legal_targets)
 
         self.votes.append({
             "player_id": self.player_name,
@@ -202,19 +620,22 @@ class Agent:
             "reason": reason
         })
 
-        if vote_choice.lower() == "no one":
-            return -1, reason
+        return target_index(vote_choice), reason
 
-        voted_player = int(vote_choice.replace("player_", "").strip())
-        return voted_player, reason
+    def _investigations_so_far(self) -> str:
+        if self.event_encoding == "compact":
+            return ", ".join(self.investigations) + "\n" if self.investigations else "none\n"
+        return str(self.investigations)
 
-    def investigate(self, game_log: str, alive_players: list[int], current_night: int = 1) -> int:
+    def _investigation_targets(self, alive_players: list[int]) -> list:
+        return [f"player_{p}" for p in alive_players if f"player_{p}" != self.player_name]
+
+    def _investigate_prompt(self, game_log: str, alive_players: list[int], current_night: int = 1) -> str:
         possible_targets = [p for p in alive_players if f"player_{p}" != self.player_name]
-        system_prompt = self._build_system_prompt()
         user_prompt = (
-            f"Here is what happened in the game so far:\n{game_log}\n\n"
+            f"{self._history(game_log)}\n\n"
             "You are the Detective. Choose one player to investigate tonight.\n"
-            f"The investigation you did so far: \n{self.investigations}"
+            f"The investigation you did so far: \n{self._investigations_so_far()}"
             f"Alive players: {', '.join(f'player_{i}' for i in possible_targets)}\n"
             f"You are {self.player_name}, do not investigate yourself as you know you are the detective."
         )
@@ -235,12 +656,11 @@ class Agent:
             player_#
             
             YOU MUST RESPOND WITH THE EXAMPLE FORMAT, IF YOUR RESPONSE IS NOT ACCORDING TO THE EXAMPLE THEN YOU WILL FAIL YOUR TASK"""
+        return user_prompt
 
-        response = self._call_llm(system_prompt, user_prompt)
-
-        lines = response.split("\n", 1)
-        investigated_player = int(re.search(r'\d+', lines[0]).group()) if re.search(r'\d+', lines[0]) else None
-        internal_reason = lines[1].strip() if len(lines) > 1 else "No reason provided"
+    def _parse_investigation(self, response: str, legal_targets: list, current_night: int = 1) -> int:
+        target, internal_reason = parse_decision(response, legal_targets)
+        investigated_player = target_index(target)
 
         if current_night > 1:  # Only store reasoning starting from Day 2
             self.detective_thinking.append({
@@ -251,12 +671,15 @@ class Agent:
 
         return investigated_player
 
-    def don_guess_detective(self, game_log: str, alive_players: list[int], current_night: int = 1) -> tuple:
+    def _don_guess_targets(self, alive_players: list[int]) -> list:
+        return [f"player_{p}" for p in alive_players
+                if f"player_{p}" != self.player_name and f"player_{p}" not in self.mafia_players]
+
+    def _don_guess_prompt(self, game_log: str, alive_players: list[int], current_night: int = 1) -> str:
         possible_targets = [p for p in alive_players if
                             f"player_{p}" != self.player_name and f"player_{p}" not in self.mafia_players]
-        system_prompt = self._build_system_prompt()
         user_prompt = (
-            f"Here is what happened in the game so far:\n{game_log}\n\n"
+            f"{self._history(game_log)}\n\n"
             "You are the **Mafia Don**. Tonight, you may try to identify who the Detective is.\n"
             f"The following players are alive and not part of the Mafia: {', '.join(f'player_{i}' for i in possible_targets)}\n"
             "Your task is to guess which one might be the Detective, if you haven't guessed already."
@@ -283,17 +706,20 @@ class Agent:
             player_#
             
             YOU MUST RESPOND WITH THE EXAMPLE FORMAT."""
+        return user_prompt
 
-        response = self._call_llm(system_prompt, user_prompt)
-        lines = response.strip().split("\n", 1)
-        guessed_player = int(re.search(r'\d+', lines[0]).group()) if re.search(r'\d+', lines[0]) else None
-        reason = lines[1].strip() if len(lines) > 1 else "No reason provided"
-        return guessed_player, reason
+    def _parse_don_guess(self, response: str, legal_targets: list) -> tuple:
+        target, reason = parse_decision(response, legal_targets)
+        return target_index(target), reason
 
-    def decide_kill(self, game_log: str, candidates: list[int], mafia_votes: list[tuple] = None) -> int:
+    def _mafia_vote_summary(self, mafia_votes: list[tuple]) -> str:
+        if self.event_encoding == "compact":
+            return "Mafia votes: " + " ".join(f"p{voter}>p{target}" for voter, target in mafia_votes)
+        return "Mafia votes:\n" + "\n".join([f"player_{voter} voted for player_{target}" for voter, target in mafia_votes])
+
+    def _kill_prompt(self, game_log: str, candidates: list[int], mafia_votes: list[tuple] = None) -> str:
         possible_targets = [f"player_{i}" for i in candidates]
-        system_prompt = self._build_system_prompt()
-        user_prompt = f"""Here is what happened in the game so far:\n{game_log}
+        user_prompt = f"""{self._history(game_log)}
         
         
         As part of the mafia, you must choose who to kill tonight.
@@ -308,7 +734,7 @@ class Agent:
             Use this information to help you decide whom to eliminate tonight."""
 
         if mafia_votes:
-            vote_summary = "Mafia votes:\n" + "\n".join([f"player_{voter} voted for player_{target}" for voter, target in mafia_votes])
+            vote_summary = self._mafia_vote_summary(mafia_votes)
             user_prompt += f"\n\n{vote_summary}\n\nDon, based on these votes, please decide the final target. You are free to choose a player not in the other Mafia votes"
 
         user_prompt += """
@@ -322,12 +748,12 @@ class Agent:
         vote reasoning...
         
         YOU MUST RESPOND WITH THE EXAMPLE FORMAT."""
+        return user_prompt
 
-        response = self._call_llm(system_prompt, user_prompt)
+    def _parse_kill(self, response: str, legal_targets: list) -> int:
         print("\n" + response + "\n")
-        lines = response.split("\n", 1)
-        voted_player = int(re.search(r'\d+', lines[0]).group()) if re.search(r'\d+', lines[0]) else None
-        internal_reason = lines[1].strip() if len(lines) > 1 else "No reason provided"
+        target, internal_reason = parse_decision(response, legal_targets)
+        voted_player = target_index(target)
 
         self.mafia_thinking.append({
             "player_id": self.player_name,
@@ -338,12 +764,9 @@ class Agent:
         self.mafia_kill_targets.append(f"player_{voted_player}")
         return voted_player
 
-
-    def final_words(self, game_log: str, cause_of_death: str) -> str:
-        system_prompt = self._build_system_prompt()
-
+    def _final_words_prompt(self, game_log: str, cause_of_death: str) -> str:
         user_prompt = (
-            f"Here is what happened in the game so far:\n{game_log}\n\n"
+            f"{self._history(game_log)}\n\n"
             f"You are {self.player_name}. You have just been eliminated from the game.\n"
             f"You were a **{self.role}** and you were {'voted out by the town during the day' if cause_of_death == 'vote' else 'killed by the mafia during the night'}.\n"
             f"You don't have to say anything if you're a civilian who died during the first night."
@@ -380,6 +803,108 @@ class Agent:
             "\nReturn your final words in 2–4 sentences. Be sincere, persuasive, emotional, or cryptic as you wish.\n"
             "Do not restate your role or how you died. Just speak your mind.\n"
         )
+        return user_prompt
+
+    def _speak_opinion_steps(self, game_log: str):
+        system_prompt = self._build_system_prompt()
+        user_prompt = self._opinion_prompt(game_log)
+        statement = yield from self._call_llm_steps(system_prompt, user_prompt, self._history(game_log), "opinion")
+        return self._record_opinion(statement, self.last_call_duration)
+
+    def _vote_day_steps(self, game_log: str, nominees: list[int], past_votes: str = ""):
+        system_prompt = self._build_system_prompt()
+        user_prompt = self._vote_prompt(game_log, nominees, past_votes)
+        return (yield from self._decide_steps("vote", system_prompt, user_prompt, self._history(game_log),
+                                              self._vote_targets(nominees), self._parse_vote))
+
+    def _investigate_steps(self, game_log: str, alive_players: list[int], current_night: int = 1):
+        system_prompt = self._build_system_prompt()
+        user_prompt = self._investigate_prompt(game_log, alive_players, current_night)
+        return (yield from self._decide_steps("investigate", system_prompt, user_prompt, self._history(game_log),
+                                              self._investigation_targets(alive_players),
+                                              functools.partial(self._parse_investigation,
+                                                                current_night=current_night)))
+
+    def _don_guess_detective_steps(self, game_log: str, alive_players: list[int], current_night: int = 1):
+        system_prompt = self._build_system_prompt()
+        user_prompt = self._don_guess_prompt(game_log, alive_players, current_night)
+        return (yield from self._decide_steps("don_guess", system_prompt, user_prompt, self._history(game_log),
+                                              self._don_guess_targets(alive_players), self._parse_don_guess))
+
+    def _decide_kill_steps(self, game_log: str, candidates: list[int], mafia_votes: list[tuple] = None):
+        system_prompt = self._build_system_prompt()
+        user_prompt = self._kill_prompt(game_log, candidates, mafia_votes)
+        return (yield from self._decide_steps("kill", system_prompt, user_prompt, self._history(game_log),
+                                              [f"player_{i}" for i in candidates], self._parse_kill))
+
+    def _final_words_steps(self, game_log: str, cause_of_death: str):
+        system_prompt = self._build_system_prompt()
+        user_prompt = self._final_words_prompt(game_log, cause_of_death)
+        final_statement = yield from self._call_llm_steps(system_prompt, user_prompt, self._history(game_log),
+                                                          "final_words")
+        return final_statement.strip()
+
+    def speak_opinion(self, game_log: str) -> str:
+        return self._run_steps(self._speak_opinion_steps(game_log))
+
+    def vote_day(self, game_log: str, nominees: list[int], past_votes: str = "") -> tuple:
+        return self._run_steps(self._vote_day_steps(game_log, nominees, past_votes))
+
+    def investigate(self, game_log: str, alive_players: list[int], current_night: int = 1) -> int:
+        return self._run_steps(self._investigate_steps(game_log, alive_players, current_night))
+
+    def don_guess_detective(self, game_log: str, alive_players: list[int], current_night: int = 1) -> tuple:
+        return self._run_steps(self._don_guess_detective_steps(game_log, alive_players, current_night))
 
-        final_statement = self._call_llm(system_prompt, user_prompt)
-        return final_statement.strip()
\ No newline at end of file
+    def decide_kill(self, game_log: str, candidates: list[int], mafia_votes: list[tuple] = None) -> int:
+        return self._run_steps(self._decide_kill_steps(game_log, candidates, mafia_votes))
+
+    def final_words(self, game_log: str, cause_of_death: str) -> str:
+        return self._run_steps(self._final_words_steps(game_log, cause_of_death))
+
+
+class AsyncAgent(Agent):
+    """
+    Agent whose actions are coroutines awaiting the async provider clients, so that many games
+    can share one event loop. Prompts, parsing and the action steps are inherited unchanged from Agent.
+    """
+
+    async def _run_steps_async(self, steps):
+        try:
+            llm_request = next(steps)
+            while True:
+                start_time = time.monotonic()
+                output_text = await self._call_provider(llm_request.request, llm_request.estimated_tokens,
+                                                        llm_request.stop_condition)
+                self.last_call_duration = time.monotonic() - start_time
+                llm_request = steps.send(output_text)
+        except StopIteration as stop:
+            return stop.value
+
+    @llm_retry
+    async def _call_provider(self, request: dict, estimated_tokens: int, stop_condition=None) -> str:
+        limiter = limiter_for(self.llm_name)
+        async with limiter.limit_async(estimated_tokens):
+            start_time = time.monotonic()
+            output_text, usage, first_token_time, stopped_early = await call_provider_async(self.provider, request,
+                                                                                            stop_condition)
+            self._set_call_timing(start_time, first_token_time, stopped_early)
+        return self._consume_response(output_text, usage, limiter, estimated_tokens)
+
+    async def speak_opinion(self, game_log: str) -> str:
+        return await self._run_steps_async(self._speak_opinion_steps(game_log))
+
+    async def vote_day(self, game_log: str, nominees: list[int], past_votes: str = "") -> tuple:
+        return await self._run_steps_async(self._vote_day_steps(game_log, nominees, past_votes))
+
+    async def investigate(self, game_log: str, alive_players: list[int], current_night: int = 1) -> int:
+        return await self._run_steps_async(self._investigate_steps(game_log, alive_players, current_night))
+
+    async def don_guess_detective(self, game_log: str, alive_players: list[int], current_night: int = 1) -> tuple:
+        return await self._run_steps_async(self._don_guess_detective_steps(game_log, alive_players, current_night))
+
+    async def decide_kill(self, game_log: str, candidates: list[int], mafia_votes: list[tuple] = None) -> int:
+        return await self._run_steps_async(self._decide_kill_steps(game_log, candidates, mafia_votes))
+
+    async def final_words(self, game_log: str, cause_of_death: str) -> str:
+        return await self._run_steps_async(self._final_words_steps(game_log, cause_of_death))
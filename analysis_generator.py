@@ -1,107 +1,194 @@
+import os
+import sys
+import argparse
+import subprocess
+
 from analysis_wins_votes_times import calculate_win_rates_same, calculate_win_rates_different
 from analysis_wins_votes_times import llms_deception_detection
-from analysis_sentiment_readability import sentiment_analysis_dict, compact_sent_analysis_results
-from analysis_sentiment_readability import readability_analysis_dict, compact_readability_analysis_results
-from analysis_sentiment_readability import fog_smog_readability_analysis_dict, compact_fog_smog_readability_analysis_results
-from analysis_sentiment_readability import textblob_analysis_dict, compact_textblob_analysis_dict
-from analysis_sentiment_readability import nrc_emotion_aggregation_dict
-from analysis_wins_votes_times import mafia_vs_civilian_response_times
-
-
-# generates win rate data for different llm types
-folder_name_different = "generated_data_different"
-json_name = "analysis_data/win_rates_different.json"
-calculate_win_rates_different(folder_name_different, json_name)
-
-# generates win rate data for same llm types
-folder_name_same = "generated_data_same"
-json_name = "analysis_data/win_rates_same.json"
-calculate_win_rates_same(folder_name_same, json_name)
-
-
-# generates deception and detection rates for different llm types
-folder_name = "generated_data_different"
-output_file = "analysis_data/deception_detection_different.json"
-llms_deception_detection(folder_name, output_file)
-
-# generates deception and detection rates for same llm types
-folder_name = "generated_data_same"
-output_file = "analysis_data/deception_detection_same.json"
-llms_deception_detection(folder_name, output_file)
-
-
-# generates sentiment analysis results for different llm types
-folder_name = "generated_data_different"
-output_file = "sentiment_analysis_different.json"
-sent_analysis_dict = sentiment_analysis_dict(folder_name, output_file)
-output_file = "compact_sentiment_analysis_different.json"
-compact_sent_analysis_results(sent_analysis_dict, output_file)
-
-# generates sentiment analysis results for same llm types
-folder_name = "generated_data_same"
-output_file = "sentiment_readability_analysis_data/sentiment_analysis_same.json"
-sent_analysis_dict = sentiment_analysis_dict(folder_name, output_file)
-output_file = "understandable_sentiment_readability/compact_sentiment_analysis_same.json"
-compact_sent_analysis_results(sent_analysis_dict, output_file)
-
-
-# generates readability analysis results for different llm types
-folder_name = "generated_data_different"
-output_file = "sentiment_readability_analysis_data/readability_analysis_different.json"
-readability_analysis_dic = readability_analysis_dict(folder_name, output_file)
-output_file = "understandable_sentiment_readability/compact_readability_analysis_different.json"
-compact_readability_analysis_results(readability_analysis_dic, output_file)
-
-# generates readability analysis results for same llm types
-folder_name = "generated_data_same"
-output_file = "sentiment_readability_analysis_data/readability_analysis_same.json"
-readability_analysis_dic = readability_analysis_dict(folder_name, output_file)
-output_file = "understandable_sentiment_readability/compact_readability_analysis_same.json"
-compact_readability_analysis_results(readability_analysis_dic, output_file)
-
-
-# generates fog smog analysis results for different llm types
-folder_name = "generated_data_different"
-output_file = "sentiment_readability_analysis_data/fog_smog_readability_analysis_different.json"
-readability_fog_smog_analysis_dic = fog_smog_readability_analysis_dict(folder_name, output_file)
-output_file = "understandable_sentiment_readability/compact_fog_smog_readability_analysis_different.json"
-compact_fog_smog_readability_analysis_results(readability_fog_smog_analysis_dic, output_file)
-
-# generates fog smog analysis results for same llm types
-folder_name = "generated_data_same"
-output_file = "sentiment_readability_analysis_data/fog_smog_other_readability_analysis_same.json"
-readability_fog_smog_analysis_dic = fog_smog_readability_analysis_dict(folder_name, output_file)
-output_file = "understandable_sentiment_readability/compact_fog_smog_readability_analysis_same.json"
-compact_fog_smog_readability_analysis_results(readability_fog_smog_analysis_dic, output_file)
-
-
-# generates textblob analysis results for different llm types
-folder_name = "generated_data_different"
-output_file = "sentiment_readability_analysis_data/blob_analysis_different.json"
-blob_analysis = textblob_analysis_dict(folder_name, output_file)
-output_file = "understandable_sentiment_readability/compact_blob_analysis_different.json"
-compact_textblob_analysis_dict(blob_analysis, output_file)
-
-# generates textblob analysis results for same llm types
-folder_name = "generated_data_same"
-output_file = "sentiment_readability_analysis_data/blob_analysis_same.json"
-blob_analysis = textblob_analysis_dict(folder_name, output_file)
-output_file = "understandable_sentiment_readability/compact_blob_analysis_same.json"
-compact_textblob_analysis_dict(blob_analysis, output_file)
-
-
-# generates emotion lexicon analysis results for different llm types
-folder_name = "generated_data_different"
-output_file = "understandable_sentiment_readability/emotions_analysis_different.json"
-emotions_analysis = nrc_emotion_aggregation_dict(folder_name, output_file)
-
-
-# generates time analysis results for different llm types
-folder_name = "generated_data_different"
-output_file = "analysis_data/time_analysis_different.json"
-mafia_vs_civilian_response_times(folder_name, output_file)
-
-# generates time analysis results for same llm types
-folder_name = "generated_data_same"
-output_file = "analysis_data/time_analysis_same.json"
-mafia_vs_civilian_response_times(folder_name, output_file)
\ No newline at end of file
+from analysis_wins_votes_times import mafia_vs_civilian_response_times, action_stats
+
+# Every step is a function, and the NLP steps import analysis_sentiment_readability themselves,
+# so regenerating e.g. only the win rates never loads transformers/PyTorch.
+
+
+def win_rates():
+    # generates win rate data for different llm types
+    folder_name_different = "generated_data_different"
+    json_name = "analysis_data/win_rates_different.json"
+    calculate_win_rates_different(folder_name_different, json_name)
+
+    # generates win rate data for same llm types
+    folder_name_same = "generated_data_same"
+    json_name = "analysis_data/win_rates_same.json"
+    calculate_win_rates_same(folder_name_same, json_name)
+
+
+def deception_detection():
+    # generates deception and detection rates for different llm types
+    folder_name = "generated_data_different"
+    output_file = "analysis_data/deception_detection_different.json"
+    llms_deception_detection(folder_name, output_file)
+
+    # generates deception and detection rates for same llm types
+    folder_name = "generated_data_same"
+    output_file = "analysis_data/deception_detection_same.json"
+    llms_deception_detection(folder_name, output_file)
+
+
+def sentiment():
+    from analysis_sentiment_readability import sentiment_analysis_dict, compact_sent_analysis_results
+
+    # generates sentiment analysis results for different llm types
+    folder_name = "generated_data_different"
+    output_file = "sentiment_analysis_different.json"
+    sent_analysis_dict = sentiment_analysis_dict(folder_name, output_file)
+    output_file = "compact_sentiment_analysis_different.json"
+    compact_sent_analysis_results(sent_analysis_dict, output_file)
+
+    # generates sentiment analysis results for same llm types
+    folder_name = "generated_data_same"
+    output_file = "sentiment_readability_analysis_data/sentiment_analysis_same.json"
+    sent_analysis_dict = sentiment_analysis_dict(folder_name, output_file)
+    output_file = "understandable_sentiment_readability/compact_sentiment_analysis_same.json"
+    compact_sent_analysis_results(sent_analysis_dict, output_file)
+
+
+def readability():
+    from analysis_sentiment_readability import readability_analysis_dict, compact_readability_analysis_results
+
+    # generates readability analysis results for different llm types
+    folder_name = "generated_data_different"
+    output_file = "sentiment_readability_analysis_data/readability_analysis_different.json"
+    readability_analysis_dic = readability_analysis_dict(folder_name, output_file)
+    output_file = "understandable_sentiment_readability/compact_readability_analysis_different.json"
+    compact_readability_analysis_results(readability_analysis_dic, output_file)
+
+    # generates readability analysis results for same llm types
+    folder_name = "generated_data_same"
+    output_file = "sentiment_readability_analysis_data/readability_analysis_same.json"
+    readability_analysis_dic = readability_analysis_dict(folder_name, output_file)
+    output_file = "understandable_sentiment_readability/compact_readability_analysis_same.json"
+    compact_readability_analysis_results(readability_analysis_dic, output_file)
+
+
+def fog_smog():
+    from analysis_sentiment_readability import fog_smog_readability_analysis_dict
+    from analysis_sentiment_readability import compact_fog_smog_readability_analysis_results
+
+    # generates fog smog analysis results for different llm types
+    folder_name = "generated_data_different"
+    output_file = "sentiment_readability_analysis_data/fog_smog_readability_analysis_different.json"
+    readability_fog_smog_analysis_dic = fog_smog_readability_analysis_dict(folder_name, output_file)
+    output_file = "understandable_sentiment_readability/compact_fog_smog_readability_analysis_different.json"
+    compact_fog_smog_readability_analysis_results(readability_fog_smog_analysis_dic, output_file)
+
+    # generates fog smog analysis results for same llm types
+    folder_name = "generated_data_same"
+    output_file = "sentiment_readability_analysis_data/fog_smog_other_readability_analysis_same.json"
+    readability_fog_smog_analysis_dic = fog_smog_readability_analysis_dict(folder_name, output_file)
+    output_file = "understandable_sentiment_readability/compact_fog_smog_readability_analysis_same.json"
+    compact_fog_smog_readability_analysis_results(readability_fog_smog_analysis_dic, output_file)
+
+
+def textblob():
+    from analysis_sentiment_readability import textblob_analysis_dict, compact_textblob_analysis_dict
+
+    # generates textblob analysis results for different llm types
+    folder_name = "generated_data_different"
+    output_file = "sentiment_readability_analysis_data/blob_analysis_different.json"
+    blob_analysis = textblob_analysis_dict(folder_name, output_file)
+    output_file = "understandable_sentiment_readability/compact_blob_analysis_different.json"
+    compact_textblob_analysis_dict(blob_analysis, output_file)
+
+    # generates textblob analysis results for same llm types
+    folder_name = "generated_data_same"
+    output_file = "sentiment_readability_analysis_data/blob_analysis_same.json"
+    blob_analysis = textblob_analysis_dict(folder_name, output_file)
+    output_file = "understandable_sentiment_readability/compact_blob_analysis_same.json"
+    compact_textblob_analysis_dict(blob_analysis, output_file)
+
+
+def emotions():
+    from analysis_sentiment_readability import nrc_emotion_aggregation_dict
+
+    # generates emotion lexicon analysis results for different llm types
+    folder_name = "generated_data_different"
+    output_file = "understandable_sentiment_readability/emotions_analysis_different.json"
+    nrc_emotion_aggregation_dict(folder_name, output_file)
+
+
+def response_times():
+    # generates time analysis results for different llm types
+    folder_name = "generated_data_different"
+    output_file = "analysis_data/time_analysis_different.json"
+    mafia_vs_civilian_response_times(folder_name, output_file)
+
+    # generates time analysis results for same llm types
+    folder_name = "generated_data_same"
+    output_file = "analysis_data/time_analysis_same.json"
+    mafia_vs_civilian_response_times(folder_name, output_file)
+
+
+def action_costs():
+    # generates latency and token results per action type for different llm types
+    folder_name = "generated_data_different"
+    output_file = "analysis_data/action_stats_different.json"
+    action_stats(folder_name, output_file)
+
+    # generates latency and token results per action type for same llm types
+    folder_name = "generated_data_same"
+    output_file = "analysis_data/action_stats_same.json"
+    action_stats(folder_name, output_file)
+
+
+STEPS = {
+    "win_rates": win_rates,
+    "deception_detection": deception_detection,
+    "sentiment": sentiment,
+    "readability": readability,
+    "fog_smog": fog_smog,
+    "textblob": textblob,
+    "emotions": emotions,
+    "response_times": response_times,
+    "action_costs": action_costs,
+}
+
+HEAVY_MODULES = ["torch", "transformers", "textblob", "textstat", "nrclex", "matplotlib", "scipy", "statsmodels"]
+STARTUP_BUDGET_SECONDS = 0.5
+
+
+def check_startup(budget: float = STARTUP_BUDGET_SECONDS) -> float:
+    """
+    Imports this module in a fresh interpreter and checks that it takes less than budget seconds
+    and loads none of HEAVY_MODULES. Returns the measured import time.
+    """
+    code = (
+        "import sys, time\n"
+        "start = time.perf_counter()\n"
+        "import analysis_generator\n"
+        "elapsed = time.perf_counter() - start\n"
+        f"loaded = [m for m in {HEAVY_MODULES!r} if m in sys.modules]\n"
+        "print(elapsed, *loaded)\n"
+    )
+    output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__))).stdout.split()
+    elapsed, loaded = float(output[0]), output[1:]
+    assert not loaded, f"analysis_generator imports heavy modules at startup: {', '.join(loaded)}"
+    assert elapsed < budget, f"analysis_generator takes {elapsed:.2f}s to import, the budget is {budget:.2f}s"
+    return elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Regenerates the analysis data from the generated games.")
+    parser.add_argument("steps", nargs="*", help=f"Steps to run, all of them by default: {', '.join(STEPS)}.")
+    parser.add_argument("--check-startup", action="store_true", help="Only check the import time budget.")
+    args = parser.parse_args()
+    unknown_steps = [step for step in args.steps if step not in STEPS]
+    if unknown_steps:
+        parser.error(f"unknown steps: {', '.join(unknown_steps)}")
+
+    if args.check_startup:
+        print(f"analysis_generator imports in {check_startup():.3f}s")
+    else:
+        for step in args.steps or STEPS:
+            STEPS[step]()
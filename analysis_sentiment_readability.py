@@ -1,45 +1,55 @@
-from transformers import pipeline
-import textstat
-import config
-from textblob import TextBlob
+import functools
 import statistics
 import os
 import json
-from nrclex import NRCLex
+import config
+from game_store import game_files, read_games
+
+# The NLP libraries are imported by the helpers below on first use, so importing this module (or
+# running only the steps of analysis_generator.py that do not need them) never loads PyTorch.
+
+
+@functools.lru_cache(maxsize=None)
+def _sentiment_pipeline():
+    from transformers import pipeline
+    return pipeline(task='sentiment-analysis', model=config.HUGGINGFACE_MODEL)
 
 
 def sentiment_analyzer(text: str) -> list:
-    sa = pipeline(task='sentiment-analysis', model=config.HUGGINGFACE_MODEL)
+    sa = _sentiment_pipeline()
     return sa(text)
 
 
 def sentiment_textblob(text: str) -> int:
+    from textblob import TextBlob
     return TextBlob(text).sentiment.polarity
 
 
 def readability_metrics(text: str) -> list:
+    import textstat
     reading_ease = textstat.flesch_reading_ease(text)
     grade_level = textstat.flesch_kincaid_grade(text)
     return [reading_ease, grade_level]
 
 
 def readability_metrics_fog_smog(text: str) -> list:
+    import textstat
     gunning_fog = textstat.gunning_fog(text)
     smog_index = textstat.smog_index(text)
     return [gunning_fog, smog_index]
 
 
 def nrclex(text: str):
+    from nrclex import NRCLex
     return NRCLex(text).top_emotions
 
 
 def sentiment_analysis_dict(folder_name: str, json_name: str) -> dict:
-    json_paths = [os.path.join(folder_name, fname) for fname in os.listdir(folder_name) if fname.endswith('.json')]
+    json_paths = game_files(folder_name)
 
     all_games = []
     for path in json_paths:
-        with open(path, 'r') as file:
-            all_games.extend(json.load(file))
+        all_games.extend(read_games(path))
 
     llms_used = list({player['llm_name'] for game in all_games for player in game['game_details']['players']})
     results = {llm_name: {"as_civilian": [], "as_mafia": []} for llm_name in llms_used}
@@ -112,12 +122,11 @@ def compact_sent_analysis_results(sentiment_data: dict, json_name: str) -> dict:
 
 
 def readability_analysis_dict(folder_name: str, json_name: str) -> dict:
-    json_paths = [os.path.join(folder_name, fname) for fname in os.listdir(folder_name) if fname.endswith('.json')]
+    json_paths = game_files(folder_name)
 
     all_games = []
     for path in json_paths:
-        with open(path, 'r') as file:
-            all_games.extend(json.load(file))
+        all_games.extend(read_games(path))
 
     llms_used = list({player['llm_name'] for game in all_games for player in game['game_details']['players']})
     results = {llm_name: {"as_civilian": [], "as_mafia": []} for llm_name in llms_used}
@@ -180,12 +189,11 @@ def compact_readability_analysis_results(readability_data: dict, json_name: str)
 
 
 def fog_smog_readability_analysis_dict(folder_name: str, json_name: str) -> dict:
-    json_paths = [os.path.join(folder_name, fname) for fname in os.listdir(folder_name) if fname.endswith('.json')]
+    json_paths = game_files(folder_name)
 
     all_games = []
     for path in json_paths:
-        with open(path, 'r') as file:
-            all_games.extend(json.load(file))
+        all_games.extend(read_games(path))
 
     llms_used = list({player['llm_name'] for game in all_games for player in game['game_details']['players']})
     results = {llm_name: {"as_civilian": [], "as_mafia": []} for llm_name in llms_used}
@@ -233,12 +241,11 @@ def compact_fog_smog_readability_analysis_results(readability_data: dict, json_n
 
 
 def textblob_analysis_dict(folder_name: str, json_name: str) -> dict:
-    json_paths = [os.path.join(folder_name, fname) for fname in os.listdir(folder_name) if fname.endswith('.json')]
+    json_paths = game_files(folder_name)
 
     all_games = []
     for path in json_paths:
-        with open(path, 'r') as file:
-            all_games.extend(json.load(file))
+        all_games.extend(read_games(path))
 
     llms_used = list({player['llm_name'] for game in all_games for player in game['game_details']['players']})
     results = {llm_name: {"as_civilian": [], "as_mafia": []} for llm_name in llms_used}
@@ -284,11 +291,10 @@ def compact_textblob_analysis_dict(readability_data: dict, json_name: str) -> di
 
 
 def nrc_emotion_aggregation_dict(folder_name: str, json_name: str) -> dict:
-    json_paths = [os.path.join(folder_name, fname) for fname in os.listdir(folder_name) if fname.endswith('.json')]
+    json_paths = game_files(folder_name)
     all_games = []
     for path in json_paths:
-        with open(path, 'r') as file:
-            all_games.extend(json.load(file))
+        all_games.extend(read_games(path))
     llms_used = list({player['llm_name'] for game in all_games for player in game['game_details']['players']})
     results = {
         llm: {
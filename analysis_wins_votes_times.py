@@ -1,14 +1,12 @@
 import json
 import os
+from game_store import game_files, read_games
 from typing import Dict
 from statistics import mean, stdev
 
 
 def calculate_win_rates_different(folder_name, json_name):
-    json_paths = []
-    for json_file in os.listdir(folder_name):
-        full_path = os.path.join(folder_name, json_file)
-        json_paths.append(full_path)
+    json_paths = game_files(folder_name)
 
     win_counts_mafia = 0
     win_counts_civilian = 0
@@ -29,8 +27,7 @@ def calculate_win_rates_different(folder_name, json_name):
     total_games = 0
 
     for path in json_paths:
-        with open(path, 'r') as file:
-            games = json.load(file)
+        games = list(read_games(path))
         total_games += len(games)
 
         for game in games:
@@ -97,14 +94,9 @@ def calculate_win_rates_same(folder_name, json_name):
     mafia_losses = {}
     llm_total_games = {}
 
-    json_files = [f for f in os.listdir(folder_name) if f.endswith('.json')]
-
-    for file_name in json_files:
-        llm_name = file_name.split('_')[0]
-        file_path = os.path.join(folder_name, file_name)
-
-        with open(file_path, 'r') as file:
-            games = json.load(file)
+    for file_path in game_files(folder_name):
+        llm_name = os.path.basename(file_path).split('_')[0]
+        games = read_games(file_path)
 
         if llm_name not in mafia_wins:
             mafia_wins[llm_name] = 0
@@ -139,12 +131,11 @@ def calculate_win_rates_same(folder_name, json_name):
 
 
 def llms_deception_detection(folder_name: str, json_name: str) -> dict:
-    json_paths = [os.path.join(folder_name, fname) for fname in os.listdir(folder_name) if fname.endswith('.json')]
+    json_paths = game_files(folder_name)
 
     all_games = []
     for path in json_paths:
-        with open(path, 'r') as file:
-            all_games.extend(json.load(file))
+        all_games.extend(read_games(path))
 
     llms_used = list({player['llm_name'] for game in all_games for player in game['game_details']['players']})
 
@@ -198,24 +189,20 @@ def llms_deception_detection(folder_name: str, json_name: str) -> dict:
 
 def mafia_vs_civilian_response_times(folder_name: str, output_json: str) -> Dict:
     llm_durations = {}
-    for file_name in os.listdir(folder_name):
-        if file_name.endswith('.json'):
-            full_path = os.path.join(folder_name, file_name)
-            with open(full_path, 'r') as file:
-                games = json.load(file)
-            for game in games:
-                for player in game['game_details']['players']:
-                    llm = player['llm_name']
-                    role = player['role']
-                    durations = player.get('opinion_speech_generation_durations', [])
-
-                    if llm not in llm_durations:
-                        llm_durations[llm] = {'mafia': [], 'civilian': []}
-
-                    if role in ['mafia', 'don']:
-                        llm_durations[llm]['mafia'].extend(durations)
-                    elif role in ['civilian', 'detective']:
-                        llm_durations[llm]['civilian'].extend(durations)
+    for full_path in game_files(folder_name):
+        for game in read_games(full_path):
+            for player in game['game_details']['players']:
+                llm = player['llm_name']
+                role = player['role']
+                durations = player.get('opinion_speech_generation_durations', [])
+
+                if llm not in llm_durations:
+                    llm_durations[llm] = {'mafia': [], 'civilian': []}
+
+                if role in ['mafia', 'don']:
+                    llm_durations[llm]['mafia'].extend(durations)
+                elif role in ['civilian', 'detective']:
+                    llm_durations[llm]['civilian'].extend(durations)
 
     result = {}
     for llm, role_durations in llm_durations.items():
@@ -233,3 +220,34 @@ def mafia_vs_civilian_response_times(folder_name: str, output_json: str) -> Dict
     with open(output_json, 'w') as f:
         json.dump(result, f, indent=4)
     return result
+
+
+def action_stats(folder_name: str, output_json: str) -> Dict:
+    """
+    Average latency and tokens per call of every LLM and action type, from the action_stats of the
+    games (games generated before they were recorded are skipped).
+    """
+    totals = {}
+    for full_path in game_files(folder_name):
+        for game in read_games(full_path):
+            for llm, llm_stats in game.get('action_stats', {}).items():
+                for action, stats in llm_stats.items():
+                    action_totals = totals.setdefault(llm, {}).setdefault(action, {})
+                    for field, value in stats.items():
+                        action_totals[field] = action_totals.get(field, 0) + value
+
+    result = {}
+    for llm, llm_totals in totals.items():
+        result[llm] = {}
+        for action, action_totals in llm_totals.items():
+            calls = action_totals['calls']
+            result[llm][action] = {
+                "calls": calls,
+                "avg_response_time": round(action_totals['total_time'] / calls, 3),
+                **{f"avg_{field}": round(value / calls, 1) for field, value in action_totals.items()
+                   if field not in ['calls', 'total_time']}
+            }
+
+    with open(output_json, 'w') as f:
+        json.dump(result, f, indent=4)
+    return result
@@ -0,0 +1,174 @@
+import io
+import os
+import json
+import time
+import contextlib
+from statistics import mean
+
+from agent import Agent, PROMPT_MODES
+from game import MafiaGame
+from game_store import game_files, read_games
+from budget import get_token_estimator
+from providers import TokenUsage
+from rate_limiter import ProviderRateLimiter
+
+# Replays recorded games in every prompt mode and compares the input tokens of their calls. The recorded
+# answers stand in for the LLMs, so both modes play exactly the same game, and every agent's provider is
+# taken to cache the longest prefix its request shares with the agent's previous request (an upper bound
+# of what the provider prompt caches serve).
+
+DATA_FOLDERS = ["generated_data_same", "generated_data_different"]
+DECISIONS = ["vote", "kill", "investigate", "don_guess"]
+_UNLIMITED = ProviderRateLimiter()
+
+
+def recorded_answers(game_data: dict) -> dict:
+    """The answers of a recorded game by (player_id, action, phase), e.g. ("player_3", "vote", "day2")."""
+    answers = {}
+    details = game_data["game_details"]
+    for entry in details["game_log"]:
+        if "night" in entry:
+            phase = f"night{entry['night']}"
+            for mafia_reason in entry.get("mafia_reasons", []):
+                answers[(mafia_reason["player_id"], "kill", phase)] = f"{mafia_reason['vote']}\n{mafia_reason['reason']}"
+            for detective, investigation in (entry.get("detective_investigation") or {}).items():
+                answers[(detective, "investigate", phase)] = investigation["investigated"]
+        else:
+            phase = f"day{entry['day']}"
+            for event in entry["events"]:
+                if "statement" in event:
+                    answers[(event["player_id"], "opinion", phase)] = event["statement"]
+                elif "vote" in event:
+                    answers[(event["player_id"], "vote", phase)] = f"{event['vote']}\n{event['reason']}"
+        final_words = entry.get("final_words") or {}
+        if final_words.get("words"):
+            answers[(final_words["player_id"], "final_words", phase)] = final_words["words"]
+    for guess in details.get("don_guesses", []):
+        answers[(guess["don_id"], "don_guess", f"night{guess['night']}")] = \
+            f"{guess['guessed_player']}\n{guess['reason'] or ''}"
+    return answers
+
+
+def request_text(request) -> str:
+    """The prompt text of a provider request, system prompt first, without the model and settings."""
+    if isinstance(request, str):
+        return request
+    if isinstance(request, list):
+        return "".join(request_text(item) for item in request)
+    if isinstance(request, dict):
+        return "".join(request_text(request[key]) for key in
+                       ["system", "config", "system_instruction", "messages", "contents", "content", "parts", "text"]
+                       if key in request)
+    return ""
+
+
+class ReplayAgent(Agent):
+    """
+    Agent answering from a recorded game (see recorded_answers) instead of calling its LLM. A recorded
+    decision that is not legal in the replay, e.g. because an earlier tie went the other way, is replaced
+    by the default target.
+    """
+
+    answers = {}
+
+    def _decide_steps(self, action: str, system_prompt: str, user_prompt: str, history: str, legal_targets: list,
+                      parse):
+        self.legal_targets = legal_targets
+        return (yield from super()._decide_steps(action, system_prompt, user_prompt, history, legal_targets, parse))
+
+    def _call_llm_steps(self, system_prompt: str, user_prompt: str, history: str = "", action: str = None,
+                        schema: dict = None):
+        self.replay_action = action
+        return (yield from super()._call_llm_steps(system_prompt, user_prompt, history, action, schema))
+
+    def _recorded_answer(self) -> str:
+        answer = self.answers.get((self.player_name, self.replay_action, self.phase))
+        if self.replay_action in DECISIONS:
+            if answer is None or answer.split("\n", 1)[0].strip() not in self.legal_targets:
+                answer = f"{self._default_target(self.replay_action, self.legal_targets)}\nNo recorded answer."
+        return answer or "I have nothing to add."
+
+    def _call_provider(self, request: dict, estimated_tokens: int, stop_condition=None) -> str:
+        start_time = time.monotonic()
+        answer = self._recorded_answer()
+        estimator = get_token_estimator()
+        text = request_text(request)
+        cached_characters = len(os.path.commonprefix([text, getattr(self, "last_request_text", "")]))
+        self.last_request_text = text
+        input_tokens = estimator.estimate(self.llm_name, text)
+        cached_tokens = input_tokens * cached_characters // len(text)
+        usage = TokenUsage(input_tokens=input_tokens - cached_tokens, cached_input_tokens=cached_tokens,
+                           output_tokens=estimator.estimate(self.llm_name, answer))
+        self._set_call_timing(start_time, None, False)
+        return self._consume_response(answer, usage, _UNLIMITED, estimated_tokens)
+
+
+def replay_game(game_data: dict, prompt_mode: str, seed: int = 0) -> list:
+    """
+    Replays a recorded game with ReplayAgent players in prompt_mode.
+    :return: The call_costs entries of all calls of the replay.
+    """
+    players = game_data["game_details"]["players"]
+    roles = [player["role"] for player in players]
+    mafia_indices = [i for i, role in enumerate(roles) if role == "mafia"]
+    don_index = roles.index("don")
+    answers = recorded_answers(game_data)
+
+    game = MafiaGame("replay", ReplayAgent, seed=seed, prompt_mode=prompt_mode)
+    game.roles = roles
+    game.players = []
+    for player, role in zip(players, roles):
+        agent = ReplayAgent(player["llm_name"], player["player_id"], role,
+                            mafia_indices if role in ["mafia", "don"] else [], don_index)
+        agent.answers = answers
+        game.players.append(agent)
+    game.game_data["game_details"]["players"] = []
+    game._initialize_players()
+    with contextlib.redirect_stdout(io.StringIO()):
+        game.run()
+    return [call for player in game.players for call in player.call_costs]
+
+
+def _input_tokens_per_call(calls: list) -> dict:
+    return {
+        "input_tokens_per_call": round(mean(call["input_tokens"] + call["cached_input_tokens"] for call in calls), 1),
+        "uncached_input_tokens_per_call": round(mean(call["input_tokens"] for call in calls), 1),
+    }
+
+
+def benchmark_prompt_modes(folder_names: list = None, max_games: int = 20, output_json: str = None) -> dict:
+    """
+    Replays up to max_games recorded games in every prompt mode. Per mode it reports the calls and the
+    input tokens and uncached (incremental) input tokens per call, overall and per round of the game,
+    which shows how the calls grow with the game log.
+    """
+    games = []
+    for folder_name in folder_names or DATA_FOLDERS:
+        for path in sorted(game_files(folder_name)):
+            games.extend(read_games(path))
+    games = games[:max_games]
+
+    result = {}
+    for prompt_mode in PROMPT_MODES:
+        calls = [call for game_data in games for call in replay_game(game_data, prompt_mode)]
+        rounds = {}
+        for call in calls:
+            rounds.setdefault(int(call["phase"].lstrip("daynight")), []).append(call)
+        result[prompt_mode] = {"games": len(games), "calls": len(calls), **_input_tokens_per_call(calls),
+                               "by_round": {round_number: _input_tokens_per_call(round_calls)
+                                            for round_number, round_calls in sorted(rounds.items())}}
+
+    if output_json:
+        with open(output_json, "w") as f:
+            json.dump(result, f, indent=4)
+    return result
+
+
+if __name__ == "__main__":
+    results = benchmark_prompt_modes()
+    for prompt_mode, stats in results.items():
+        print(f"{prompt_mode}: {stats['calls']} calls in {stats['games']} games, "
+              f"{stats['input_tokens_per_call']} input tokens per call, {stats['uncached_input_tokens_per_call']} uncached")
+        for round_number, round_stats in stats["by_round"].items():
+            print(f"  round {round_number}: {round_stats['input_tokens_per_call']} input tokens per call, "
+                  f"{round_stats['uncached_input_tokens_per_call']} uncached")
@@ -0,0 +1,229 @@
+import logging
+import threading
+
+import config
+
+# Costs are tracked per call: the agents price every call as it completes and record it in the
+# process-wide CostLedger, a TokenEstimator predicts the prompt size of every call before it is made,
+# and a TournamentBudget decides whether a tournament can afford to start another game.
+
+USAGE_FIELDS = ["input_tokens", "cached_input_tokens", "cache_write_input_tokens", "output_tokens", "thinking_tokens"]
+PRICE_FIELDS = {"input_tokens": "input", "cached_input_tokens": "cached_input", "cache_write_input_tokens": "cache_write",
+                "output_tokens": "output", "thinking_tokens": "thinking"}
+
+
+def token_prices(llm_name: str):
+    """USD per token of each kind of token of llm_name, None for an LLM without prices."""
+    prices = config.TOKEN_PRICES.get(llm_name)
+    if prices is None:
+        return None
+    return {kind: price / 1000000 for kind, price in prices.items()}
+
+
+def usage_cost(llm_name: str, usage: dict) -> float:
+    """Cost in USD of a usage given as {field of USAGE_FIELDS: tokens}."""
+    prices = token_prices(llm_name)
+    if prices is None:
+        return 0.0
+    return sum(usage.get(field, 0) * prices[kind] for field, kind in PRICE_FIELDS.items())
+
+
+class CostLedger:
+    """
+    Live record of every LLM call of the process: game, phase, action, provider, tokens and cost.
+    Calls in flight hold a reservation of their pre-flight estimated prompt cost until they are recorded.
+    Shared by all agents, whether they call from threads or from an event loop.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = []
+        self.provider_costs = {}
+        self.reserved_costs = {}
+
+    def record(self, entry: dict):
+        """Records a call; a call replayed from the LLM cache costs nothing."""
+        with self.lock:
+            self.entries.append(entry)
+            self.provider_costs[entry["provider"]] = self.provider_costs.get(entry["provider"], 0.0) + entry["cost"]
+
+    def reserve(self, llm_name: str, cost: float):
+        with self.lock:
+            self.reserved_costs[llm_name] = self.reserved_costs.get(llm_name, 0.0) + cost
+
+    def release(self, llm_name: str, cost: float):
+        with self.lock:
+            self.reserved_costs[llm_name] = self.reserved_costs.get(llm_name, 0.0) - cost
+
+    def reserved(self, llm_name: str) -> float:
+        """Estimated cost of the calls of a provider in flight."""
+        with self.lock:
+            return max(0.0, self.reserved_costs.get(llm_name, 0.0))
+
+    def cost(self, llm_name: str = None) -> float:
+        """Spend so far, of one provider or of all of them."""
+        with self.lock:
+            if llm_name is not None:
+                return self.provider_costs.get(llm_name, 0.0)
+            return sum(self.provider_costs.values())
+
+
+_COST_LEDGER = CostLedger()
+
+
+def get_cost_ledger() -> CostLedger:
+    return _COST_LEDGER
+
+
+class TokenEstimator:
+    """
+    Offline estimate of the tokens of a prompt: its characters over CHARS_PER_TOKEN of the provider,
+    scaled by a per-provider correction that follows the token counts the provider reported for the
+    earlier estimates.
+    """
+
+    CORRECTION_RATE = 0.1
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.corrections = {}
+
+    def estimate(self, llm_name: str, *prompts: str) -> int:
+        characters = sum(len(prompt) for prompt in prompts)
+        chars_per_token = config.CHARS_PER_TOKEN.get(llm_name, 4.0)
+        return int(characters / chars_per_token * self.corrections.get(llm_name, 1.0)) + 1
+
+    def observe(self, llm_name: str, predicted_tokens: int, actual_tokens: int):
+        """Moves the correction of llm_name towards the one that would have predicted actual_tokens."""
+        if predicted_tokens <= 0 or actual_tokens <= 0:
+            return
+        with self.lock:
+            correction = self.corrections.get(llm_name, 1.0)
+            target = correction * actual_tokens / predicted_tokens
+            self.corrections[llm_name] = correction + (target - correction) * self.CORRECTION_RATE
+
+
+_TOKEN_ESTIMATOR = TokenEstimator()
+
+
+def get_token_estimator() -> TokenEstimator:
+    return _TOKEN_ESTIMATOR
+
+
+def prompt_token_budget(llm_name: str) -> float:
+    """Most prompt tokens a call of llm_name may use: CONTEXT_TOKEN_BUDGET, or less under CALL_COST_BUDGET."""
+    budget = config.CONTEXT_TOKEN_BUDGET
+    prices = token_prices(llm_name)
+    if config.CALL_COST_BUDGET is not None and prices and prices["input"] > 0:
+        budget = min(budget, config.CALL_COST_BUDGET / prices["input"])
+    return budget
+
+
+def compact_history(history: str, user_prompt: str, max_length: int) -> tuple:
+    """
+    Leaves out the oldest lines of history, the start of user_prompt, until user_prompt is at most
+    max_length characters long (or the history is gone). Returns the new (history, user_prompt).
+    """
+    task = user_prompt[len(history):]
+    header, _, log = history.partition("\n")
+    lines = log.split("\n")
+    length = len(user_prompt) + 50
+    omitted = 0
+    while omitted < len(lines) and length > max_length:
+        length -= len(lines[omitted]) + 1
+        omitted += 1
+    compacted = f"{header}\n[{omitted} earlier lines of the game left out]\n" + "\n".join(lines[omitted:])
+    if omitted == 0 or len(compacted) >= len(history):
+        return history, user_prompt
+    return compacted, compacted + task
+
+
+class TournamentBudget:
+    """
+    Admission control of a tournament. The projected spend is the cost of the finished games, plus
+    their average cost for every running game (never less than the live spend of the process, which
+    includes the running games of thread and async tournaments and the pre-flight estimates of their
+    calls in flight). A game is only started if the
+    projected spend with it stays within the tournament cap and the caps of each of its providers;
+    a provider over its cap is paused, i.e. none of its games are started any more.
+    """
+
+    def __init__(self, limit: float = None, provider_limits: dict = None):
+        self.limit = limit
+        self.provider_limits = provider_limits or {}
+        self.lock = threading.Lock()
+        self.finished_costs = {}
+        self.finished_games = {}
+        self.running_games = {}
+        self.paused = set()
+        self.skipped = 0
+        self.ledger_start = {llm_name: get_cost_ledger().cost(llm_name) for llm_name in config.TOKEN_PRICES}
+
+    def _average_cost(self, llm_name: str) -> float:
+        games = self.finished_games.get(llm_name, 0)
+        return self.finished_costs.get(llm_name, 0.0) / games if games else 0.0
+
+    def projected_cost(self, llm_name: str) -> float:
+        ledger = get_cost_ledger()
+        live_cost = ledger.cost(llm_name) - self.ledger_start.get(llm_name, 0.0) + ledger.reserved(llm_name)
+        expected_cost = (self.finished_costs.get(llm_name, 0.0)
+                         + self.running_games.get(llm_name, 0) * self._average_cost(llm_name))
+        return max(live_cost, expected_cost)
+
+    def admit(self, llm_names: set) -> bool:
+        """Registers a game of llm_names as running and returns True if the budget allows starting it."""
+        with self.lock:
+            paused = [llm_name for llm_name in llm_names if llm_name in self.paused]
+            for llm_name in llm_names:
+                limit = self.provider_limits.get(llm_name)
+                if llm_name not in self.paused and limit is not None and \
+                        self.projected_cost(llm_name) + self._average_cost(llm_name) > limit:
+                    self.paused.add(llm_name)
+                    paused.append(llm_name)
+                    logging.warning(f"Pausing {llm_name}: projected spend ${self.projected_cost(llm_name):.4f} "
+                                    f"would pass its budget of ${limit:.4f}.")
+            if paused:
+                self.skipped += 1
+                return False
+            if self.limit is not None:
+                all_llms = set(self.finished_costs) | set(self.running_games) | set(llm_names)
+                projected = sum(self.projected_cost(llm_name) for llm_name in all_llms)
+                if projected + sum(self._average_cost(llm_name) for llm_name in llm_names) > self.limit:
+                    if not self.skipped:
+                        logging.warning(f"Tournament budget of ${self.limit:.4f} reached (projected spend "
+                                        f"${projected:.4f}), no more games are started.")
+                    self.skipped += 1
+                    return False
+            for llm_name in llm_names:
+                self.running_games[llm_name] = self.running_games.get(llm_name, 0) + 1
+            return True
+
+    def finished(self, llm_names: set, game_data: dict = None):
+        """Records the end of a running game, with its costs unless it failed (game_data None)."""
+        with self.lock:
+            costs = game_costs(game_data) if game_data is not None else {}
+            for llm_name in llm_names:
+                self.running_games[llm_name] -= 1
+                if llm_name in costs:
+                    self.finished_costs[llm_name] = self.finished_costs.get(llm_name, 0.0) + costs[llm_name]
+                    self.finished_games[llm_name] = self.finished_games.get(llm_name, 0) + 1
+
+    def spent(self) -> float:
+        with self.lock:
+            return sum(self.finished_costs.values())
+
+
+def game_costs(game_data: dict) -> dict:
+    """
+    Cost in USD of each provider of a finished game, from the call_costs of its players (calls replayed
+    from the LLM cache cost nothing), or from its token prices for games recorded without call_costs.
+    """
+    players = game_data.get("game_details", {}).get("players", [])
+    if not any("call_costs" in player for player in players):
+        return {llm_name: costs["input_cost"] + costs["full_output_cost"]
+                for llm_name, costs in game_data.get("token_prices", {}).items() if llm_name != "total_costs"}
+    costs = {}
+    for player in players:
+        for entry in player.get("call_costs", []):
+            costs[entry["provider"]] = costs.get(entry["provider"], 0.0) + entry["cost"]
+    return costs
@@ -0,0 +1,30 @@
+import os
+import gzip
+import json
+
+CHECKPOINT_VERSION = 1
+
+
+def write_checkpoint(path: str, checkpoint: dict):
+    """
+    Writes a checkpoint as gzipped compact JSON. The file is written next to its destination and then
+    renamed over it, so a crash while writing leaves the previous checkpoint intact.
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    temporary_path = f"{path}.tmp"
+    with gzip.open(temporary_path, "wt", encoding="utf-8") as file:
+        json.dump(checkpoint, file, separators=(",", ":"))
+    os.replace(temporary_path, path)
+
+
+def read_checkpoint(path: str):
+    """Returns the checkpoint stored at path, None if there is none."""
+    if path is None or not os.path.exists(path):
+        return None
+    with gzip.open(path, "rt", encoding="utf-8") as file:
+        checkpoint = json.load(file)
+    assert checkpoint.get("version") == CHECKPOINT_VERSION, \
+        f"Checkpoint {path} has version {checkpoint.get('version')}, expected {CHECKPOINT_VERSION}."
+    return checkpoint
@@ -1,35 +1,121 @@
 import os
 from dotenv import load_dotenv
-from openai import OpenAI
-from google import genai
-import anthropic
 
 load_dotenv()
 
+# Provider clients are built on first use by the adapters in providers.py.
+
 # === OpenAI ===
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-OPENAI_CLIENT = OpenAI(api_key=OPENAI_API_KEY)
 OPENAI_MODEL = "o4-mini"
 
 # === Gemini ===
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-GEMINI_CLIENT = genai.Client(api_key=GEMINI_API_KEY)
 GEMINI_MODEL = "gemini-2.5-flash-preview-04-17"
 
 # === DeepSeek ===
 DEEPSEEK_API_KEY = os.getenv("DEEPSEEK_API_KEY")
-DEEPSEEK_CLIENT = OpenAI(api_key=DEEPSEEK_API_KEY, base_url="https://api.deepseek.com")
 DEEPSEEK_MODEL = "deepseek-reasoner"
 
 # === Claude ===
 CLAUDE_API_KEY = os.getenv("CLAUDE_API_KEY")
-CLAUDE_CLIENT = anthropic.Anthropic(api_key=CLAUDE_API_KEY)
 CLAUDE_MODEL = "claude-3-7-sonnet-20250219"
 
 # === Grok ===
 GROK_API_KEY = os.getenv("GROK_API_KEY")
-GROK_CLIENT = OpenAI(api_key=GROK_API_KEY, base_url="https://api.x.ai/v1")
 GROK_MODEL = "grok-3-mini-beta"
 
+# === Rate limits ===
+# Shared by every agent of the process (see rate_limiter.py). Calls above the limits wait in a queue.
+# Set these to the limits of your account tier; providers without an entry are not limited.
+RATE_LIMITS = {
+    "openai": {"requests_per_minute": 500, "input_tokens_per_minute": 200000, "max_in_flight": 50},
+    "gemini": {"requests_per_minute": 1000, "input_tokens_per_minute": 1000000, "max_in_flight": 50},
+    "deepseek": {"requests_per_minute": 600, "input_tokens_per_minute": 1000000, "max_in_flight": 50},
+    "claude": {"requests_per_minute": 50, "input_tokens_per_minute": 40000, "max_in_flight": 10},
+    "grok": {"requests_per_minute": 480, "input_tokens_per_minute": 500000, "max_in_flight": 50},
+}
+
+# === LLM response cache ===
+# "off", "record" (store every provider response) or "replay" (answer every request from the store,
+# without network calls). See llm_cache.py.
+LLM_CACHE_MODE = os.getenv("LLM_CACHE_MODE", "off")
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", "llm_cache.sqlite")
+
+# === Structured outputs ===
+# Votes, kills, investigations and don guesses ask for JSON restricted to the legal targets, through
+# each provider's structured output or tool support (see providers.py). Replies without it go
+# through a strict text parser.
+STRUCTURED_OUTPUTS = os.getenv("STRUCTURED_OUTPUTS", "true").lower() == "true"
+# A decision without a legal target is asked again this many times, with a correction note, before
+# a default is used (no one for votes, the first legal target otherwise) and logged in the game data.
+DECISION_REASKS = 2
+
+# === Generation settings per action ===
+# How much each kind of call may think and write, mapped onto each provider's parameters (see
+# Provider.apply_settings): "reasoning_effort" for OpenAI and Grok, "thinking_budget" tokens for Claude
+# and Gemini, "max_output_tokens" for the answer itself and "stop" sequences where supported. The output
+# caps leave room for thinking_budget tokens of reasoning; DeepSeek's reasoning cannot be bounded, so it
+# gets no cap. The actions are "opinion" (day speech), "vote", "kill", "don_guess", "investigate" and
+# "final_words"; an action without an entry uses the provider defaults.
+ACTION_SETTINGS = {
+    "opinion": {"reasoning_effort": "medium", "thinking_budget": 4096, "max_output_tokens": 512, "stop": None},
+    "final_words": {"reasoning_effort": "low", "thinking_budget": 2048, "max_output_tokens": 512, "stop": None},
+    "vote": {"reasoning_effort": "low", "thinking_budget": 2048, "max_output_tokens": 256, "stop": None},
+    "kill": {"reasoning_effort": "low", "thinking_budget": 2048, "max_output_tokens": 256, "stop": None},
+    "don_guess": {"reasoning_effort": "low", "thinking_budget": 2048, "max_output_tokens": 256, "stop": None},
+    "investigate": {"reasoning_effort": "low", "thinking_budget": 2048, "max_output_tokens": 256, "stop": None},
+}
+
+# === Streaming ===
+# Read responses through the streaming APIs, so that every call records its time to first token.
+# STREAM_EARLY_STOP also stops reading votes, kills, investigations and don guesses as soon as the
+# line with the chosen player is complete; the reason after it is then not recorded.
+STREAM_RESPONSES = os.getenv("STREAM_RESPONSES", "false").lower() == "true"
+STREAM_EARLY_STOP = os.getenv("STREAM_EARLY_STOP", "false").lower() == "true"
+
+# === Game history ===
+# "full": every prompt shows the whole game log. "rolling": only the current day and the night before
+# it are shown verbatim, the earlier rounds are replaced by a digest of deaths, vote tallies and each
+# player's last stated suspicion (see MafiaGame._prompt_log), so prompts stop growing with the game.
+HISTORY_POLICY = os.getenv("HISTORY_POLICY", "full")
+# "prose": events, votes and investigations are written out in sentences. "compact": terse event codes
+# with one vote row per day (e.g. "D1 votes: p1>p3 p2>-"), explained once by a legend in the system prompt.
+EVENT_ENCODING = os.getenv("EVENT_ENCODING", "prose")
+# "stateless": every call sends the system prompt and the whole history. "session": every agent keeps its
+# conversation for the game and each call only adds the events since its last turn (see Agent._session_turn).
+PROMPT_MODE = os.getenv("PROMPT_MODE", "stateless")
+
+# === Costs and budgets ===
+# USD per million tokens. "input" is the price of uncached input, "cached_input" of cache reads and
+# "cache_write" of Claude cache writes. Every call is priced as it completes (see budget.py).
+TOKEN_PRICES = {
+    "gemini": {"input": 0.15, "cached_input": 0.0375, "cache_write": 0.15, "output": 0.6, "thinking": 3.5},
+    "openai": {"input": 1.1, "cached_input": 0.275, "cache_write": 1.1, "output": 4.4, "thinking": 4.4},
+    "claude": {"input": 3, "cached_input": 0.3, "cache_write": 3.75, "output": 15, "thinking": 15},
+    "grok": {"input": 0.3, "cached_input": 0.075, "cache_write": 0.3, "output": 0.5, "thinking": 0.5},
+    "deepseek": {"input": 0.55, "cached_input": 0.14, "cache_write": 0.55, "output": 2.19, "thinking": 2.19},
+    "mock": {"input": 0, "cached_input": 0, "cache_write": 0, "output": 0, "thinking": 0},
+}
+# Characters per token of each provider's tokenizer, for the offline prompt size estimate made before
+# every call. The estimates are corrected by the token counts the providers report.
+CHARS_PER_TOKEN = {"openai": 4.0, "gemini": 4.0, "deepseek": 3.8, "claude": 3.5, "grok": 4.0, "mock": 4.0}
+# A prompt estimated above CONTEXT_TOKEN_BUDGET tokens, or above CALL_COST_BUDGET USD of uncached input,
+# is sent with its oldest game history left out, and a warning is logged.
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "100000"))
+CALL_COST_BUDGET = float(os.getenv("CALL_COST_BUDGET")) if os.getenv("CALL_COST_BUDGET") else None
+# Spend caps of a tournament in USD, None for no cap: no new game is started once the projected spend
+# of the tournament, or of one provider (e.g. {"claude": 20.0}), would pass its cap.
+TOURNAMENT_BUDGET = float(os.getenv("TOURNAMENT_BUDGET")) if os.getenv("TOURNAMENT_BUDGET") else None
+PROVIDER_BUDGETS = {}
+
+# === Mock (offline) ===
+# Local provider for load tests without network, selected with the llm_name "mock". Latencies are
+# sampled from the recorded speech durations of MOCK_LATENCY_PROFILE (None: all LLMs).
+MOCK_MODEL = "mock"
+MOCK_LATENCY_PROFILE = None
+MOCK_LATENCY_SCALE = float(os.getenv("MOCK_LATENCY_SCALE", "1.0"))
+MOCK_FAULT_RATES = {"rate_limit": 0.0, "timeout": 0.0, "malformed": 0.0}
+
 # === HuggingFace ===
 HUGGINGFACE_MODEL = 'lxyuan/distilbert-base-multilingual-cased-sentiments-student'
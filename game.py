@@ -1,32 +1,128 @@
+import time
 import random
 import json
+import asyncio
+import inspect
+from dataclasses import dataclass, field
 
 from utils import retry
-from agent import Agent
+from agent import Agent, LLMRequest, USAGE_COUNTERS, CALL_RECORDS, PROMPT_MODES
+from game_events import GameEvent, GameEventLog, EVENT_ENCODINGS, history_digest
+from checkpoint import CHECKPOINT_VERSION, write_checkpoint, read_checkpoint
+from budget import token_prices, USAGE_FIELDS
+from providers import TokenUsage
+import config
+
+
+@dataclass
+class AgentAction:
+    """A pending call of an agent method, yielded by the phase generators and performed by a driver."""
+    player: int
+    method: str
+    args: tuple = ()
+    kwargs: dict = field(default_factory=dict)
+
+
+# Night actions and the actions whose results they need. The Don's guess feeds the mafia kill
+# prompts, the Don decides after seeing the other mafia votes, and the detective depends on nobody.
+NIGHT_ACTION_DEPENDENCIES = {
+    "don_guess": [],
+    "investigate": [],
+    "mafia_vote": ["don_guess"],
+    "don_kill": ["mafia_vote"],
+}
+
+
+def dependency_waves(dependencies: dict, present: set) -> list[list[str]]:
+    """
+    Groups the present nodes of a dependency graph into waves that can run concurrently.
+    Absent nodes are skipped, their dependents inherit their dependencies.
+    """
+    levels = {}
+
+    def level(node):
+        if node not in levels:
+            deepest = max((level(dep) for dep in dependencies[node]), default=-1)
+            levels[node] = deepest + 1 if node in present else deepest
+        return levels[node]
+
+    waves = {}
+    for node in dependencies:
+        if node in present:
+            waves.setdefault(level(node), []).append(node)
+    return [waves[i] for i in sorted(waves)]
+
+
+class CorruptGameStateError(Exception):
+    """Raised when the game state is inconsistent. Unlike a failed action, this restarts the whole game."""
+
+
+def new_game_seed() -> int:
+    """Seed for a game that was not given one; drawn from the global generator so random.seed() still applies."""
+    return random.randrange(2 ** 32)
+
+
+HISTORY_POLICIES = ["full", "rolling"]
+
+
+def checkpoint_phase_label(checkpoint: dict) -> str:
+    """The phase a checkpoint (or game state) starts with, e.g. 'day2' before the second day, or 'over'."""
+    if checkpoint["next_phase"] == "over":
+        return "over"
+    count = checkpoint["night_count"] if checkpoint["next_phase"] == "night" else checkpoint["day_count"]
+    return f"{checkpoint['next_phase']}{count + 1}"
 
 
 class MafiaGame:
-    def __init__(self, llm_name: str):
+    def __init__(self, llm_name: str, agent_cls: type = Agent, seed: int = None, history_policy: str = None,
+                 event_encoding: str = None, prompt_mode: str = None):
+        # Every random decision of the game comes from its own generator, so a game can be reproduced
+        # from its seed no matter how many other games run in the same process.
+        self.seed = seed if seed is not None else new_game_seed()
+        self.rng = random.Random(self.seed)
         self.num_players = 10
         self.players = []
         self.roles = ["civilian"] * 6 + ["detective"] + ["mafia"] * 2 + ["don"]
-        random.shuffle(self.roles)
+        self.rng.shuffle(self.roles)
         self.llm_name = llm_name
         self.night_count = 0
         self.day_count = 0
-        self.game_log = "**Mafia Game Starts**\n"
-        self.opinion_log = ""
-        self.votes_log = ""
+        # How the events are written in the prompts, "prose" or "compact" (see game_events.EVENT_ENCODINGS)
+        self.event_encoding = event_encoding or config.EVENT_ENCODING
+        assert self.event_encoding in EVENT_ENCODINGS, f"Unknown event encoding '{self.event_encoding}'."
+        self.events = GameEventLog(self.event_encoding)
+        # Whether the agents send the whole history with every call or keep a session, see agent.PROMPT_MODES
+        self.prompt_mode = prompt_mode or config.PROMPT_MODE
+        assert self.prompt_mode in PROMPT_MODES, f"Unknown prompt mode '{self.prompt_mode}'."
+        self.events.append(GameEvent("game_start"))
         self.winner_log = ""
         self.alive = [True] * self.num_players
         self.is_detective = False
+        # "night", "day", or "over" once the game is finished
+        self.next_phase = "night"
+        self.checkpoint_path = None
+        # How the history is shown in the prompts, see _prompt_log
+        self.history_policy = history_policy or config.HISTORY_POLICY
+        assert self.history_policy in HISTORY_POLICIES, f"Unknown history policy '{self.history_policy}'."
+        self.history_stats = {"prompts": 0, "characters": 0, "full_characters": 0}
+        self._digest = (None, "")
+        # State of the step API (see pending_requests): the phase being stepped through and its starting
+        # checkpoint, the responses it received so far, responses of a restored checkpoint still to be
+        # replayed, and the requests waiting for a response with the action steps they belong to.
+        self._phase = None
+        self._phase_start = None
+        self.phase_responses = []
+        self.recorded_responses = {}
+        self._request = None
+        self._results = []
+        self._waiting = {}
 
         mafia_indices = [i for i, role in enumerate(self.roles) if role == "mafia"]
         don_index = next(i for i, role in enumerate(self.roles) if role == "don")
 
         for i, role in enumerate(self.roles):
             if role in ["mafia", "don"]:
-                self.players.append(Agent(
+                self.players.append(agent_cls(
                     llm_name=llm_name,
                     player_name=f"player_{i}",
                     player_role=role,
@@ -34,7 +130,7 @@ class MafiaGame:
                     don_index=don_index
                 ))
             else:
-                self.players.append(Agent(
+                self.players.append(agent_cls(
                     llm_name=llm_name,
                     player_name=f"player_{i}",
                     player_role=role,
@@ -50,24 +146,29 @@ class MafiaGame:
                 "game_outcome": {}
             }
         }
+        self.game_data["seed"] = self.seed
         self.game_data["token_details"] = {}
         self.game_data["token_prices"] = {}
         self._initialize_players()
 
     @classmethod
-    def from_llm_list(cls, llm_names: list[str], preassigned_roles: list[str] = None):
+    def from_llm_list(cls, llm_names: list[str], preassigned_roles: list[str] = None, agent_cls: type = Agent,
+                      seed: int = None, history_policy: str = None, event_encoding: str = None,
+                      prompt_mode: str = None):
         num_players = len(llm_names)
         assert num_players == 10, "This game currently supports exactly 10 players."
+        seed = seed if seed is not None else new_game_seed()
+        rng = random.Random(seed)
 
         if preassigned_roles:
             assert len(preassigned_roles) == 10, "Need 10 preassigned roles."
             roles = preassigned_roles.copy()
         else:
             roles = ["civilian"] * 6 + ["detective"] + ["mafia"] * 2 + ["don"]
-            random.shuffle(roles)
+            rng.shuffle(roles)
 
         combined = list(zip(llm_names, roles))
-        random.shuffle(combined)
+        rng.shuffle(combined)
         llm_names, roles = zip(*combined)
 
         mafia_indices = [i for i, role in enumerate(roles) if role == "mafia"]
@@ -78,7 +179,7 @@ class MafiaGame:
             role = roles[i]
             llm = llm_names[i]
             if role in ["mafia", "don"]:
-                agent = Agent(
+                agent = agent_cls(
                     llm_name=llm,
                     player_name=f"player_{i}",
                     player_role=role,
@@ -86,7 +187,7 @@ class MafiaGame:
                     don_index=don_index
                 )
             else:
-                agent = Agent(
+                agent = agent_cls(
                     llm_name=llm,
                     player_name=f"player_{i}",
                     player_role=role,
@@ -94,7 +195,9 @@ class MafiaGame:
                 )
             players.append(agent)
 
-        game = cls(llm_name="default_llm")
+        game = cls(llm_name="default_llm", agent_cls=agent_cls, seed=seed, history_policy=history_policy,
+                   event_encoding=event_encoding, prompt_mode=prompt_mode)
+        game.rng = rng
 
         game.players = players
         game.roles = roles
@@ -110,6 +213,129 @@ class MafiaGame:
 
         return game
 
+    def to_checkpoint(self) -> dict:
+        """
+        The full game and agent state between two phases, as plain JSON data. In the middle of a phase
+        of the step API, the state before the phase and the responses received since, which
+        from_checkpoint replays.
+        """
+        if self._phase_start is not None:
+            return {**self._phase_start, "responses": list(self.phase_responses)}
+        return {
+            "version": CHECKPOINT_VERSION,
+            "seed": self.seed,
+            "rng_state": self.rng.getstate(),
+            "num_players": self.num_players,
+            "roles": list(self.roles),
+            "llm_name": self.llm_name,
+            "night_count": self.night_count,
+            "day_count": self.day_count,
+            "events": self.events.to_list(),
+            "winner_log": self.winner_log,
+            "alive": self.alive,
+            "is_detective": self.is_detective,
+            "next_phase": self.next_phase,
+            "history_policy": self.history_policy,
+            "event_encoding": self.event_encoding,
+            "prompt_mode": self.prompt_mode,
+            "history_stats": self.history_stats,
+            "game_data": self.game_data,
+            "players": [player.to_state() for player in self.players],
+        }
+
+    @classmethod
+    def from_checkpoint(cls, checkpoint: dict, agent_cls: type = Agent):
+        """Rebuilds a game from to_checkpoint(), ready to run its next phase."""
+        checkpoint = json.loads(json.dumps(checkpoint))
+        game = cls(llm_name=checkpoint["llm_name"], agent_cls=agent_cls, seed=checkpoint["seed"],
+                   history_policy=checkpoint["history_policy"],
+                   event_encoding=checkpoint.get("event_encoding", "prose"),
+                   prompt_mode=checkpoint.get("prompt_mode", "stateless"))
+        game.history_stats = checkpoint["history_stats"]
+        version, internal_state, gauss_next = checkpoint["rng_state"]
+        game.rng.setstate((version, tuple(internal_state), gauss_next))
+        game.num_players = checkpoint["num_players"]
+        game.roles = checkpoint["roles"]
+        game.night_count = checkpoint["night_count"]
+        game.day_count = checkpoint["day_count"]
+        game.events = GameEventLog.from_list(checkpoint["events"], game.event_encoding)
+        game.winner_log = checkpoint["winner_log"]
+        game.alive = checkpoint["alive"]
+        game.is_detective = checkpoint["is_detective"]
+        game.next_phase = checkpoint["next_phase"]
+        game.game_data = checkpoint["game_data"]
+        game.players = [agent_cls.from_state(state) for state in checkpoint["players"]]
+        game.recorded_responses = {response["request_id"]: response for response in checkpoint.get("responses", [])}
+        game.validate_state()
+        return game
+
+    @classmethod
+    def resume(cls, checkpoint_path: str, agent_cls: type = Agent):
+        """
+        Returns the game saved at checkpoint_path, None if there is no usable checkpoint.
+        A checkpoint that fails validation is discarded, so the game starts over.
+        """
+        checkpoint = read_checkpoint(checkpoint_path)
+        if checkpoint is None:
+            return None
+        try:
+            game = cls.from_checkpoint(checkpoint, agent_cls)
+        except CorruptGameStateError as e:
+            print(f"Discarding corrupt checkpoint {checkpoint_path}: {e}")
+            return None
+        game.checkpoint_path = checkpoint_path
+        print(f"Resuming game {game.seed} from {checkpoint_path} before its {game.next_phase} phase")
+        return game
+
+    @property
+    def phase_label(self) -> str:
+        """
+        The next phase, e.g. 'day2' before the second day, or 'over'. While the step API plays a phase,
+        the phase in progress.
+        """
+        return checkpoint_phase_label(self._phase_start or self.__dict__)
+
+    @property
+    def game_id(self) -> str:
+        """
+        Identifies the game and the point it has reached, e.g. '1234_day2' before (or, with the step API,
+        during) the second day.
+        """
+        return f"{self.seed}_{self.phase_label}"
+
+    def fork(self, seed: int, branch_index: int = 0):
+        """
+        Returns an independent continuation of the game from its current phase, whose random decisions
+        come from a new generator seeded with seed. The branch keeps everything recorded so far (events,
+        agent memories, game data) but starts its token counters and call records (timings, costs,
+        invalid decisions) empty, so its costs and latencies are only those of the continuation;
+        game_data["branch"] links it to this game.
+        """
+        assert self.next_phase != "over", "Cannot fork a finished game."
+        checkpoint = self.to_checkpoint()
+        # A branch plays the phase with its own random decisions, so it cannot replay the responses
+        # this game received in its current phase.
+        checkpoint.pop("responses", None)
+        branch = type(self).from_checkpoint(checkpoint, agent_cls=type(self.players[0]))
+        branch.rng = random.Random(seed)
+        for player in branch.players:
+            for counter in USAGE_COUNTERS:
+                setattr(player, counter, 0)
+            for records in CALL_RECORDS:
+                setattr(player, records, [])
+        branch.game_data.pop("action_stats", None)
+        branch.game_data["branch"] = {
+            "parent_id": f"{checkpoint['seed']}_{checkpoint_phase_label(checkpoint)}",
+            "branch_index": branch_index,
+            "branch_seed": seed,
+            "prefix_events": len(checkpoint["events"]),
+        }
+        return branch
+
+    def save_checkpoint(self):
+        if self.checkpoint_path is not None:
+            write_checkpoint(self.checkpoint_path, self.to_checkpoint())
+
     def _initialize_players(self):
         for i, player in enumerate(self.players):
             player_data = player.get_player_info()
@@ -120,66 +346,216 @@ class MafiaGame:
         self.game_data["game_details"]["detective_player"] = next(
             (player.player_name for player in self.players if player.role == "detective"), None)
 
+    @property
+    def game_log(self) -> str:
+        return self.events.text
+
+    @property
+    def opinion_log(self) -> str:
+        return self.events.opinions_text
+
+    @property
+    def votes_log(self) -> str:
+        return self.events.votes_text
+
     def get_alive_players(self):
         return [i for i, alive in enumerate(self.alive) if alive]
 
+    def _prompt_log(self) -> str:
+        """
+        The game history for a prompt. With the "rolling" history policy, only the current day and the
+        night before it are shown verbatim; the earlier rounds are replaced by history_digest, which
+        changes once a day, so the prompts keep a stable cacheable prefix within a day. Records the
+        characters sent and those of the full history.
+        """
+        full_log = self.events.text
+        prompt_log = full_log
+        if self.history_policy == "rolling" and self.events.day_text:
+            rounds = self.game_data["game_details"]["game_log"]
+            # The current day and the night before it stay verbatim.
+            earlier_rounds = max(i for i, entry in enumerate(rounds) if "day" in entry) - 1
+            if earlier_rounds > 0:
+                if self._digest[0] != earlier_rounds:
+                    self._digest = (earlier_rounds, history_digest(rounds[:earlier_rounds]))
+                prompt_log = self.events.render(GameEvent("game_start")) + self._digest[1] + self.events.day_text
+        self.history_stats["prompts"] += 1
+        self.history_stats["characters"] += len(prompt_log)
+        self.history_stats["full_characters"] += len(full_log)
+        return prompt_log
+
+    # The phases are written as generators that yield the agent actions they need (one AgentAction,
+    # or a list of independent ones) and receive the results back, so the same game logic can be
+    # driven synchronously by run() or on an event loop by run_async().
+
+    def _perform(self, request):
+        if isinstance(request, list):
+            return [self._perform(action) for action in request]
+        action = request
+        return getattr(self.players[action.player], action.method)(*action.args, **action.kwargs)
+
+    async def _perform_async(self, request):
+        if isinstance(request, list):
+            return list(await asyncio.gather(*(self._perform_async(action) for action in request)))
+        result = self._perform(request)
+        if inspect.isawaitable(result):
+            result = await result
+        return result
+
+    def validate_state(self):
+        """Raises CorruptGameStateError if roles, alive flags and player statuses disagree."""
+        problems = []
+        if not len(self.players) == len(self.roles) == len(self.alive) == self.num_players:
+            problems.append("players, roles and alive flags differ in length")
+        for i, player in enumerate(self.players):
+            if player.role != self.roles[i]:
+                problems.append(f"player_{i} has role {player.role}, expected {self.roles[i]}")
+            if (player.status == "dead") == self.alive[i]:
+                problems.append(f"player_{i} is {player.status} but alive is {self.alive[i]}")
+        if not any(role == "don" for role in self.roles):
+            problems.append("no don in the game")
+        if problems:
+            raise CorruptGameStateError("; ".join(problems))
+
+    def _drive(self, steps):
+        try:
+            request = next(steps)
+            while True:
+                request = steps.send(self._perform(request))
+        except StopIteration as stop:
+            self.validate_state()
+            return stop.value
+
+    async def _drive_async(self, steps):
+        try:
+            request = next(steps)
+            while True:
+                request = steps.send(await self._perform_async(request))
+        except StopIteration as stop:
+            self.validate_state()
+            return stop.value
+
     def night_phase(self):
+        return self._drive(self._night_phase_steps())
+
+    async def night_phase_async(self):
+        return await self._drive_async(self._night_phase_steps())
+
+    def day_phase(self):
+        return self._drive(self._day_phase_steps())
+
+    async def day_phase_async(self):
+        return await self._drive_async(self._day_phase_steps())
+
+    def _night_phase_steps(self):
         print("night_phase")
         self.night_count += 1
         alive_players = self.get_alive_players()
         alive_mafia = [i for i in alive_players if self.roles[i] in ["mafia", "don"]]
         alive_civilians = [i for i in alive_players if self.roles[i] not in ["mafia", "don"]]
-
-        # Don's suspicion (Detective finder)
-        don_guess_info = None
         don_index = next((i for i in alive_players if self.roles[i] == "don"), None)
-        if don_index is not None and self.is_detective == False:
-            guess_index, reason = self.players[don_index].don_guess_detective(
-                self.game_log, alive_players, current_night=self.night_count
-            )
-            actual_detective_index = next((i for i, r in enumerate(self.roles) if r == "detective"), None)
-            self.is_detective = (guess_index == actual_detective_index)
-            don_guess_info = {
-                "night": self.night_count,
-                "don_id": self.players[don_index].player_name,
-                "guessed_player": f"player_{guess_index}",
-                "is_detective": self.is_detective,
-                "reason": reason if self.night_count > 1 else None
-            }
-            if "don_guesses" not in self.game_data["game_details"]:
-                self.game_data["game_details"]["don_guesses"] = []
-
-            self.game_data["game_details"]["don_guesses"].append({
-                "night": self.night_count,
-                "don_id": don_guess_info["don_id"],
-                "guessed_player": don_guess_info["guessed_player"],
-                "is_detective": don_guess_info["is_detective"],
-                "reason": don_guess_info["reason"]
-            })
+        detective_index = next((i for i in alive_players if self.roles[i] == "detective"), None)
 
-            n =  don_guess_info["night"]
-            guessedP = don_guess_info["guessed_player"]
-            is_det = don_guess_info["is_detective"]
-            for i in alive_mafia:
-                self.players[i].don_guesses.append(f"night: {n} - guessed_player_{guessedP} - is_detective? {is_det}")
+        night_actions = {"mafia_vote"}
+        if don_index is not None:
+            night_actions.add("don_kill")
+            if self.is_detective == False:
+                night_actions.add("don_guess")
+        if detective_index is not None:
+            night_actions.add("investigate")
 
-        # Mafia members vote
         mafia_votes = []
-        for i in alive_mafia:
-            if self.roles[i] != "don":
-                vote = self.players[i].decide_kill(self.game_log, alive_players)
-                mafia_votes.append((i, vote))
+        investigation_result = None
+        detective_thinking = None
+
+        def actions_for(node):
+            if node == "don_guess":
+                return [AgentAction(don_index, "don_guess_detective",
+                                    (self._prompt_log(), alive_players), {"current_night": self.night_count})]
+            if node == "investigate":
+                return [AgentAction(detective_index, "investigate",
+                                    (self._prompt_log(), alive_players), {"current_night": self.night_count})]
+            if node == "mafia_vote":
+                return [AgentAction(i, "decide_kill", (self._prompt_log(), alive_players))
+                        for i in alive_mafia if self.roles[i] != "don"]
+            if node == "don_kill":
+                return [AgentAction(don_index, "decide_kill",
+                                    (self._prompt_log(), alive_players), {"mafia_votes": list(mafia_votes)})]
+
+        def apply_result(node, action, result):
+            nonlocal investigation_result, detective_thinking
+            if node == "don_guess":
+                # Don's suspicion (Detective finder)
+                guess_index, reason = result
+                actual_detective_index = next((i for i, r in enumerate(self.roles) if r == "detective"), None)
+                self.is_detective = (guess_index == actual_detective_index)
+                don_guess_info = {
+                    "night": self.night_count,
+                    "don_id": self.players[don_index].player_name,
+                    "guessed_player": f"player_{guess_index}",
+                    "is_detective": self.is_detective,
+                    "reason": reason if self.night_count > 1 else None
+                }
+                if "don_guesses" not in self.game_data["game_details"]:
+                    self.game_data["game_details"]["don_guesses"] = []
+
+                self.game_data["game_details"]["don_guesses"].append({
+                    "night": self.night_count,
+                    "don_id": don_guess_info["don_id"],
+                    "guessed_player": don_guess_info["guessed_player"],
+                    "is_detective": don_guess_info["is_detective"],
+                    "reason": don_guess_info["reason"]
+                })
+
+                n =  don_guess_info["night"]
+                is_det = don_guess_info["is_detective"]
+                don_guess_event = GameEvent("don_guess", n, don_index, guess_index, str(is_det), visibility="mafia")
+                for i in alive_mafia:
+                    self.players[i].don_guesses.append(self.events.render(don_guess_event))
+                self.events.append(don_guess_event)
+
+            elif node in ["mafia_vote", "don_kill"]:
+                mafia_votes.append((action.player, result))
+
+            elif node == "investigate":
+                investigate_target = result
+                is_mafia = self.roles[investigate_target] in ["mafia", "don"]
+                investigation_event = GameEvent("investigation", self.night_count, detective_index,
+                                                investigate_target, str(is_mafia), visibility="detective")
+                self.players[detective_index].investigations.append(self.events.render(investigation_event))
+                self.events.append(investigation_event)
+                investigation_result = {
+                    f"player_{detective_index}": {
+                        "investigated": f"player_{investigate_target}",
+                        "result": is_mafia
+                    }
+                }
+
+                if self.players[detective_index].detective_thinking:
+                    detective_thinking = {
+                        "player_id": self.players[detective_index].player_name,
+                        "investigated_player": f"player_{investigate_target}",
+                        "internal_reason": self.players[detective_index].detective_thinking[-1]["internal_reason"]
+                    }
+                else:
+                    detective_thinking = {
+                        "player_id": self.players[detective_index].player_name,
+                        "investigated_player": f"player_{investigate_target}",
+                        "internal_reason": "No reasoning provided yet."
+                    }
+
+        # Every wave is sent as one batch of concurrent actions; results are applied in the fixed
+        # graph/player order so the logs do not depend on which call finished first.
+        for wave in dependency_waves(NIGHT_ACTION_DEPENDENCIES, night_actions):
+            scheduled = [(node, action) for node in wave for action in actions_for(node)]
+            if not scheduled:
+                continue
+            results = yield [action for _, action in scheduled]
+            for (node, action), result in zip(scheduled, results):
+                apply_result(node, action, result)
 
         # Decide final target
-        don_alive = any(self.roles[i] == "don" for i in alive_mafia)
-        if don_alive:
-            don_index = next(i for i in alive_mafia if self.roles[i] == "don")
-            final_target = self.players[don_index].decide_kill(
-                self.game_log,
-                alive_players,
-                mafia_votes=mafia_votes
-            )
-            mafia_votes.append((don_index, final_target))
+        if "don_kill" in night_actions:
+            final_target = mafia_votes[-1][1]
         else:
             vote_counts = {}
             for _, vote in mafia_votes:
@@ -187,47 +563,17 @@ class MafiaGame:
 
             max_votes = max(vote_counts.values())
             top_choices = [v for v, count in vote_counts.items() if count == max_votes]
-            final_target = random.choice(top_choices)
-
-        # Detective investigates
-        detective_index = next((i for i in alive_players if self.roles[i] == "detective"), None)
-        investigation_result = None
-        detective_thinking = None
-        if detective_index is not None:
-            investigate_target = self.players[detective_index].investigate(self.game_log, alive_players, current_night=self.night_count)
-            is_mafia = self.roles[investigate_target] in ["mafia", "don"]
-            self.players[detective_index].investigations.append(
-                f"player_{investigate_target} - Mafia: {is_mafia}"
-            )
-            investigation_result = {
-                f"player_{detective_index}": {
-                    "investigated": f"player_{investigate_target}",
-                    "result": is_mafia
-                }
-            }
-
-            if self.players[detective_index].detective_thinking:
-                detective_thinking = {
-                    "player_id": self.players[detective_index].player_name,
-                    "investigated_player": f"player_{investigate_target}",
-                    "internal_reason": self.players[detective_index].detective_thinking[-1]["internal_reason"]
-                }
-            else:
-                detective_thinking = {
-                    "player_id": self.players[detective_index].player_name,
-                    "investigated_player": f"player_{investigate_target}",
-                    "internal_reason": "No reasoning provided yet."
-                }
+            final_target = self.rng.choice(top_choices)
 
         self.alive[final_target] = False
         self.players[final_target].status = "dead"
         if self.players[final_target].role == "civilian" and self.night_count == 1:
             final_words = ""
-            self.game_log += f"\nNight {self.night_count}: Mafia killed player_{final_target}"
+            self.events.append(GameEvent("night_kill", self.night_count, target=final_target))
         else:
-            final_words = self.players[final_target].final_words(self.game_log, cause_of_death="mafia")
-            self.game_log += f"\nNight {self.night_count}: Mafia killed player_{final_target}"
-            self.game_log += f"\nFinal words from player_{final_target}: {final_words}"
+            final_words = yield AgentAction(final_target, "final_words", (self._prompt_log(),), {"cause_of_death": "mafia"})
+            self.events.append(GameEvent("night_kill", self.night_count, target=final_target))
+            self.events.append(GameEvent("final_words", self.night_count, final_target, text=final_words))
 
         if hasattr(self, "game_data"):
             mafia_reasons = []
@@ -257,26 +603,25 @@ class MafiaGame:
                 }
             })
 
-    def day_phase(self):
+    def _day_phase_steps(self):
         print("day_phase")
         self.day_count += 1
         alive_players = self.get_alive_players()
 
-        self.game_log += f"\n\nDay {self.day_count} Begins"
+        self.events.append(GameEvent("day_start", self.day_count))
         self.game_data["game_details"]["game_log"].append({
             "day": self.day_count,
             "events": []
         })
 
-        random_start_player = random.choice(alive_players)
+        random_start_player = self.rng.choice(alive_players)
         start_index = alive_players.index(random_start_player)
 
         alive_players = alive_players[start_index:] + alive_players[:start_index]
 
         for i in alive_players:
-            statement = self.players[i].speak_opinion(self.game_log)
-            self.opinion_log += f"\nplayer_{i} says: {statement}"
-            self.game_log += f"\nplayer_{i} says: {statement}"
+            statement = yield AgentAction(i, "speak_opinion", (self._prompt_log(),))
+            self.events.append(GameEvent("statement", self.day_count, i, text=statement))
             # Add the player's statement to the day's events
             self.game_data["game_details"]["game_log"][-1]["events"].append({
                 "player_id": f"player_{i}",
@@ -285,28 +630,21 @@ class MafiaGame:
 
         vote_counts = {n: 0 for n in alive_players}
         no_one_votes = 0
-        votes_and_reasons = []
 
-        random_start_player = random.choice(alive_players)
+        random_start_player = self.rng.choice(alive_players)
         start_index = alive_players.index(random_start_player)
 
         alive_players = alive_players[start_index:] + alive_players[:start_index]
 
         for i in alive_players:
-            past_votes = "\n".join([f"player_{voter} voted for player_{target}"
-                                    for voter, target in votes_and_reasons])
-            vote, reason = self.players[i].vote_day(self.game_log, alive_players, past_votes)
+            past_votes = self.events.day_votes_text
+            vote, reason = yield AgentAction(i, "vote_day", (self._prompt_log(), alive_players, past_votes))
             if vote == -1:  # Vote to 'no one'
                 no_one_votes += 1
-                vote_statement_with_reason = f"player_{i} voted to eliminate no one"
             else:
                 vote_counts[vote] += 1
-                vote_statement_with_reason = f"player_{i} voted to eliminate player_{vote}"
-
-            votes_and_reasons.append((i, vote))
 
-            self.votes_log += f"\n{vote_statement_with_reason}"
-            self.game_log += f"\n{vote_statement_with_reason}"
+            self.events.append(GameEvent("vote" if vote != -1 else "no_one_vote", self.day_count, i, vote))
 
             self.game_data["game_details"]["game_log"][-1]["events"].append({
                 "player_id": f"player_{i}",
@@ -324,14 +662,14 @@ class MafiaGame:
             most_votes_count = vote_counts[most_votes_player]
 
         if most_votes_count <= no_one_votes:  # No one should be eliminated
-            self.game_log += "\nNo elimination this round."
+            self.events.append(GameEvent("no_elimination", self.day_count))
             self.game_data["game_details"]["game_log"][-1]["elimination"] = "no elimination this round"
         else:
             self.alive[most_votes_player] = False
             self.players[most_votes_player].status = "dead"
-            final_words = self.players[most_votes_player].final_words(self.game_log, cause_of_death="vote")
-            self.game_log += f"\nDay: player_{most_votes_player} was voted out by the town/players of the game"
-            self.game_log += f"\nFinal words from player_{most_votes_player}: {final_words}"
+            final_words = yield AgentAction(most_votes_player, "final_words", (self._prompt_log(),), {"cause_of_death": "vote"})
+            self.events.append(GameEvent("voted_out", self.day_count, most_votes_player))
+            self.events.append(GameEvent("final_words", self.day_count, most_votes_player, text=final_words))
             # Log in JSON
             self.game_data["game_details"]["game_log"][-1]["elimination"] = f"player_{most_votes_player} was voted out"
             self.game_data["game_details"]["game_log"][-1]["final_words"] = {
@@ -347,7 +685,7 @@ class MafiaGame:
 
         if mafia_count == 0:
             self.winner_log = "Good players win!"
-            self.game_log += f"\n\n{self.winner_log}"
+            self.events.append(GameEvent("game_over", text=self.winner_log))
             self.game_data["game_details"]["game_outcome"] = {
                 "winner": "Good players win!",
                 "reason": "All Mafia members were eliminated."
@@ -355,7 +693,7 @@ class MafiaGame:
             return True
         elif mafia_count >= good_count:
             self.winner_log = "Mafia wins!"
-            self.game_log += f"\n\n{self.winner_log}"
+            self.events.append(GameEvent("game_over", text=self.winner_log))
             self.game_data["game_details"]["game_outcome"] = {
                 "winner": "Mafia wins!",
                 "reason": "Mafia outnumbered the good players."
@@ -363,12 +701,121 @@ class MafiaGame:
             return True
         return False
 
+    # Nights and days alternate, with a win check and a checkpoint after each phase, so a game
+    # restored from its checkpoint continues exactly where it stopped.
+
+    def _next_phase_steps(self):
+        branch = self.game_data.get("branch")
+        ledger_game = f"{self.seed}.{branch['branch_index']}" if branch else str(self.seed)
+        for player in self.players:
+            player.game_id, player.phase = ledger_game, self.phase_label
+            player.event_encoding, player.prompt_mode = self.event_encoding, self.prompt_mode
+        return self._night_phase_steps() if self.next_phase == "night" else self._day_phase_steps()
+
+    def _end_phase(self):
+        self.next_phase = "day" if self.next_phase == "night" else "night"
+        self.save_checkpoint()
+
     def run(self) -> str:
+        if self.next_phase == "over":
+            return self.game_log
         while not self.check_win_condition():
-            self.night_phase()
-            if self.check_win_condition():
-                break
-            self.day_phase()
+            self._drive(self._next_phase_steps())
+            self._end_phase()
+        return self._finish()
+
+    async def run_async(self) -> str:
+        if self.next_phase == "over":
+            return self.game_log
+        while not self.check_win_condition():
+            await self._drive_async(self._next_phase_steps())
+            self._end_phase()
+        return self._finish()
+
+    # The step API: instead of run(), a scheduler asks the game for the LLM requests it waits for and
+    # submits their responses, so one scheduler can interleave, batch and rate-limit the calls of many
+    # games. The phases are driven as by run(), with the agents' action steps (Agent.action_steps) in
+    # place of their blocking methods. to_checkpoint() can be taken between any two steps.
+
+    @property
+    def is_over(self) -> bool:
+        return self.next_phase == "over"
+
+    def pending_requests(self) -> list[LLMRequest]:
+        """
+        The requests the game waits for, to be answered in any order with submit_responses. Requests
+        stay pending until they are answered; the list is empty once the game is over.
+        """
+        self._advance()
+        return [llm_request for llm_request, _, _, _, _ in self._waiting.values()]
+
+    def submit_responses(self, responses: dict):
+        """
+        Answers pending requests and plays on until the game waits for new responses or is over.
+        A request's time from pending_requests to its response is recorded as its call time.
+        :param responses: By request_id, the response text, (text, TokenUsage) as returned by Provider.parse,
+            or (text, TokenUsage, call timing) with the call timing of Agent.accept_response. A response
+            without usage is estimated from the prompt and the text.
+        """
+        for request_id, response in responses.items():
+            llm_request, player, slot, steps, pending_since = self._waiting.pop(request_id)
+            if isinstance(response, str):
+                response = (response,)
+            output_text, usage, call_timing = (*response, None, None)[:3]
+            self._answer(llm_request, player, slot, steps, output_text, usage, time.monotonic() - pending_since,
+                         call_timing)
+        self._advance()
+
+    def _advance(self):
+        """Plays on until a request waits for a response or the game is over."""
+        while not self._waiting and not self.is_over:
+            if self._phase is None:
+                if self.check_win_condition():
+                    self._finish()
+                    return
+                self._phase_start = json.loads(json.dumps(self.to_checkpoint()))
+                self.phase_responses = []
+                self._phase = self._next_phase_steps()
+                results = None
+            else:
+                results = self._results if isinstance(self._request, list) else self._results[0]
+            try:
+                self._request = self._phase.send(results)
+            except StopIteration:
+                self.validate_state()
+                self._phase = self._phase_start = None
+                self._end_phase()
+                continue
+            actions = self._request if isinstance(self._request, list) else [self._request]
+            self._results = [None] * len(actions)
+            for slot, action in enumerate(actions):
+                steps = self.players[action.player].action_steps(action.method, *action.args, **action.kwargs)
+                self._continue_action(action.player, slot, steps, None)
+
+    def _continue_action(self, player: int, slot: int, steps, output_text: str):
+        try:
+            llm_request = steps.send(output_text)
+        except StopIteration as stop:
+            self._results[slot] = stop.value
+            return
+        recorded = self.recorded_responses.pop(llm_request.request_id, None)
+        if recorded is not None:
+            # The recorded call was paid for before the checkpoint; replayed, it costs 0 like a cache hit.
+            usage = TokenUsage(**recorded["usage"]) if recorded["usage"] else None
+            self._answer(llm_request, player, slot, steps, recorded["text"], usage, recorded["duration"],
+                         {**(recorded.get("call_timing") or {}), "replayed": True})
+        else:
+            self._waiting[llm_request.request_id] = (llm_request, player, slot, steps, time.monotonic())
+
+    def _answer(self, llm_request: LLMRequest, player: int, slot: int, steps, output_text: str, usage: TokenUsage,
+                duration: float, call_timing: dict = None):
+        self.phase_responses.append({"request_id": llm_request.request_id, "text": output_text,
+                                     "usage": dict(usage.__dict__) if usage else None, "duration": duration,
+                                     "call_timing": call_timing})
+        output_text = self.players[player].accept_response(llm_request, output_text, usage, duration, call_timing)
+        self._continue_action(player, slot, steps, output_text)
+
+    def _finish(self) -> str:
         print("\n--- Game Over ---")
         for i, player in enumerate(self.players):
             if self.alive[i]:
@@ -378,13 +825,33 @@ class MafiaGame:
             self.game_data["game_details"]["players"][i]["status"] = player.status
             self.game_data["game_details"]["players"][i]["llm_name"] = player.llm_name
             self.game_data["game_details"]["players"][i]["opinion_speech_generation_durations"] = player.opinion_speech_generation_durations
+            self.game_data["game_details"]["players"][i]["call_timings"] = player.call_timings
+            self.game_data["game_details"]["players"][i]["invalid_decisions"] = player.invalid_decisions
+            self.game_data["game_details"]["players"][i]["fallback_decisions"] = player.fallback_decisions
+            self.game_data["game_details"]["players"][i]["call_costs"] = player.call_costs
+        self.game_data["history"] = {
+            "policy": self.history_policy,
+            "encoding": self.event_encoding,
+            "prompt_mode": self.prompt_mode,
+            **self.history_stats,
+            "estimated_tokens": self.history_stats["characters"] // 4,
+            "full_estimated_tokens": self.history_stats["full_characters"] // 4,
+        }
+        print(f"History ({self.history_policy}, {self.event_encoding} events, {self.prompt_mode} prompts): ~{self.game_data['history']['estimated_tokens']} tokens of game "
+              f"history in {self.history_stats['prompts']} prompts, "
+              f"~{self.game_data['history']['full_estimated_tokens']} with the full history")
+        self.game_data["action_stats"] = self.action_stats()
         self.print_token_costs()
+        self.print_action_stats()
+        self.next_phase = "over"
+        self.save_checkpoint()
         return self.game_log
 
     def getTokenCountForLLM(self) -> dict:
         llms_used = [player.llm_name for player in self.players]
         llms_used = list(set(llms_used))
-        full_usage = {llm_name: {"input_tokens": 0, "output_tokens": 0, "thinking_tokens": 0, "full_output_tokens": 0}
+        full_usage = {llm_name: {"input_tokens": 0, "cached_input_tokens": 0, "cache_write_input_tokens": 0,
+                                 "output_tokens": 0, "thinking_tokens": 0, "full_output_tokens": 0}
                       for llm_name in llms_used}
         for player in self.players:
             llm_name = player.llm_name
@@ -393,6 +860,8 @@ class MafiaGame:
             thinking_tokens = player.thinking_tokens_used
             full_output_tokens = output_tokens + thinking_tokens
             full_usage[llm_name]["input_tokens"] += input_tokens
+            full_usage[llm_name]["cached_input_tokens"] += player.cached_input_tokens_used
+            full_usage[llm_name]["cache_write_input_tokens"] += player.cache_write_input_tokens_used
             full_usage[llm_name]["output_tokens"] += output_tokens
             full_usage[llm_name]["thinking_tokens"] += thinking_tokens
             full_usage[llm_name]["full_output_tokens"] += full_output_tokens
@@ -401,13 +870,8 @@ class MafiaGame:
 
     def calculate_token_costs(self) -> dict:
         full_usage = self.getTokenCountForLLM()
-        pricing = {
-            "gemini": {"input": 0.15/1000000, "output": 0.6/1000000, "thinking": 3.5/1000000},
-            "openai": {"input": 1.1/1000000, "output": 4.4/1000000, "thinking": 4.4/1000000},
-            "claude": {"input": 3/1000000, "output": 15/1000000, "thinking": 15/1000000},
-            "grok": {"input": 0.3/1000000, "output": 0.5/1000000, "thinking": 0.5/1000000},
-            "deepseek": {"input": 0.14/1000000, "output": 2.19/1000000, "thinking": 2.19/1000000},
-        }
+        # Prices per token from config.TOKEN_PRICES
+        pricing = {llm_name: token_prices(llm_name) for llm_name in full_usage if token_prices(llm_name)}
         llm_costs = {}
         total_input_cost = 0
         total_output_cost = 0
@@ -416,13 +880,19 @@ class MafiaGame:
         for llm_name, usage in full_usage.items():
             if llm_name in pricing:
                 price_per_token = pricing[llm_name]
-                input_cost = usage["input_tokens"] * price_per_token["input"]
+                uncached_input_cost = usage["input_tokens"] * price_per_token["input"]
+                cached_input_cost = usage["cached_input_tokens"] * price_per_token["cached_input"]
+                cache_write_input_cost = usage["cache_write_input_tokens"] * price_per_token["cache_write"]
+                input_cost = uncached_input_cost + cached_input_cost + cache_write_input_cost
                 output_cost = usage["output_tokens"] * price_per_token["output"]
                 thinking_cost = usage["thinking_tokens"] * price_per_token["thinking"]
                 full_output_cost = output_cost + thinking_cost
 
                 llm_costs[llm_name] = {
                     "input_cost": input_cost,
+                    "uncached_input_cost": uncached_input_cost,
+                    "cached_input_cost": cached_input_cost,
+                    "cache_write_input_cost": cache_write_input_cost,
                     "output_cost": output_cost,
                     "thinking_cost": thinking_cost,
                     "full_output_cost": full_output_cost,
@@ -443,6 +913,32 @@ class MafiaGame:
         self.game_data["token_prices"] = llm_costs
         return llm_costs
 
+    def action_stats(self) -> dict:
+        """
+        Calls, total latency in seconds and tokens of every LLM and action type ("opinion", "vote", ...),
+        for tuning config.ACTION_SETTINGS. Sums, so the stats of many games can be added up.
+        """
+        stats = {}
+        for player in self.players:
+            for timing, cost in zip(player.call_timings, player.call_costs):
+                action_stats = stats.setdefault(player.llm_name, {}).setdefault(
+                    timing["action"], {"calls": 0, "total_time": 0.0, **dict.fromkeys(USAGE_FIELDS, 0)})
+                action_stats["calls"] += 1
+                action_stats["total_time"] += timing["total_time"]
+                for field in USAGE_FIELDS:
+                    action_stats[field] += cost[field]
+        return stats
+
+    def print_action_stats(self):
+        print("Per action (average per call):")
+        for llm_name, llm_stats in self.game_data["action_stats"].items():
+            for action, action_stats in llm_stats.items():
+                calls = action_stats["calls"]
+                input_tokens = sum(action_stats[field] for field in USAGE_FIELDS[:3])
+                print(f"  {llm_name} {action}: {calls} calls, {action_stats['total_time'] / calls:.2f}s, "
+                      f"{input_tokens / calls:.0f} input, {action_stats['output_tokens'] / calls:.0f} output and "
+                      f"{action_stats['thinking_tokens'] / calls:.0f} thinking tokens")
+
     def print_token_costs(self):
         full_usage = self.getTokenCountForLLM()
         llm_costs = self.calculate_token_costs()
@@ -452,12 +948,15 @@ class MafiaGame:
             print(f"{'=' * 50}")
             print(f"Token Count:")
             print(f"  Input Tokens: {full_usage[llm_name]['input_tokens']}")
+            print(f"  Cached Input Tokens: {full_usage[llm_name]['cached_input_tokens']}")
+            print(f"  Cache Write Input Tokens: {full_usage[llm_name]['cache_write_input_tokens']}")
             print(f"  Output Tokens: {full_usage[llm_name]['output_tokens']}")
             print(f"  Thinking Tokens: {full_usage[llm_name]['thinking_tokens']}")
             print(f"  Full Output Tokens: {full_usage[llm_name]['full_output_tokens']}")
 
             print(f"Price:")
             print(f"  Input Cost: ${llm_costs[llm_name]['input_cost']:.6f}")
+            print(f"    of which cached: ${llm_costs[llm_name]['cached_input_cost']:.6f}")
             print(f"  Output Cost: ${llm_costs[llm_name]['output_cost']:.6f}")
             print(f"  Thinking Cost: ${llm_costs[llm_name]['thinking_cost']:.6f}")
             print(f"  Full Output Cost: ${llm_costs[llm_name]['full_output_cost']:.6f}")
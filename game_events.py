@@ -0,0 +1,169 @@
+import re
+from collections import Counter
+from dataclasses import dataclass
+
+
+@dataclass(frozen=True)
+class GameEvent:
+    """
+    One entry of the game history.
+    :param kind: One of the event keys of EVENT_FORMATS.
+    :param round: Night or day number the event belongs to.
+    :param player: Index of the acting (or dying) player, if any.
+    :param target: Index of the targeted player, -1 for a vote for no one.
+    :param text: Free text of the event (statement, final words, winner...).
+    :param visibility: "public", or the role group allowed to see the event ("mafia", "detective").
+    """
+    kind: str
+    round: int = 0
+    player: int = None
+    target: int = None
+    text: str = None
+    visibility: str = "public"
+
+
+EVENT_FORMATS = {
+    "game_start": "**Mafia Game Starts**\n",
+    "night_kill": "\nNight {round}: Mafia killed player_{target}",
+    "final_words": "\nFinal words from player_{player}: {text}",
+    "day_start": "\n\nDay {round} Begins",
+    "statement": "\nplayer_{player} says: {text}",
+    "vote": "\nplayer_{player} voted to eliminate player_{target}",
+    "no_one_vote": "\nplayer_{player} voted to eliminate no one",
+    "no_elimination": "\nNo elimination this round.",
+    "voted_out": "\nDay: player_{player} was voted out by the town/players of the game",
+    "game_over": "\n\n{text}",
+    "don_guess": "night: {round} - guessed_player_player_{target} - is_detective? {text}",
+    "investigation": "player_{target} - Mafia: {text}",
+    "day_vote": "player_{player} voted for player_{target}",
+    "day_no_one_vote": "player_{player} voted for player_{target}",
+}
+
+# Terse event codes, explained once by the legend prompts_constants.COMPACT_EVENT_LEGEND. The votes of a
+# day form one row, "D1 votes: p1>p3 p2>p3 p4>-", opened by "vote_row" before the first vote.
+COMPACT_EVENT_FORMATS = {
+    "game_start": "**Mafia Game Starts**\n",
+    "night_kill": "\nN{round} killed p{target}",
+    "final_words": "\np{player} last words: {text}",
+    "day_start": "\n\nD{round}",
+    "statement": "\np{player}: {text}",
+    "vote_row": "\nD{round} votes:",
+    "vote": " p{player}>p{target}",
+    "no_one_vote": " p{player}>-",
+    "no_elimination": "\nD{round} out: -",
+    "voted_out": "\nD{round} out: p{player}",
+    "game_over": "\n\n{text}",
+    "don_guess": "N{round} guessed p{target} detective:{text}",
+    "investigation": "N{round} p{target} mafia:{text}",
+    "day_vote": "p{player}>p{target}",
+    "day_no_one_vote": "p{player}>-",
+}
+
+EVENT_ENCODINGS = {
+    "prose": EVENT_FORMATS,
+    "compact": COMPACT_EVENT_FORMATS,
+}
+
+
+def render_event(event: GameEvent, encoding: str = "prose") -> str:
+    return EVENT_ENCODINGS[encoding][event.kind].format(**event.__dict__)
+
+
+class GameEventLog:
+    """
+    Append-only list of GameEvents. The text views read by the agents are extended as events
+    arrive, so every event is rendered exactly once and reading a view never re-renders the history.
+    :param encoding: How the events are rendered, a key of EVENT_ENCODINGS.
+    """
+
+    def __init__(self, encoding: str = "prose"):
+        assert encoding in EVENT_ENCODINGS, f"Unknown event encoding '{encoding}'."
+        self.encoding = encoding
+        self.events = []
+        self.text = ""
+        self.opinions_text = ""
+        self.votes_text = ""
+        self.day_votes_text = ""
+        # Public history since the night before the latest day (its kill and final words included),
+        # empty before the first day.
+        self.day_text = ""
+        self.night_text = None
+        self.last_public_kind = None
+
+    def render(self, event: GameEvent) -> str:
+        return render_event(event, self.encoding)
+
+    def append(self, event: GameEvent):
+        self.events.append(event)
+        # Private events (investigations, Don guesses) are kept for the record; the players who may see
+        # them hold them in their own memories (Agent.investigations, Agent.don_guesses).
+        if event.visibility != "public":
+            return
+        line = self.render(event)
+
+        voting = event.kind in ["vote", "no_one_vote"]
+        if voting and self.encoding == "compact" and self.last_public_kind not in ["vote", "no_one_vote"]:
+            line = self.render(GameEvent("vote_row", event.round)) + line
+        self.last_public_kind = event.kind
+        self.text += line
+        if event.kind == "night_kill":
+            self.night_text = line
+        elif event.kind == "final_words" and self.night_text is not None:
+            self.night_text += line
+        if event.kind == "day_start":
+            self.day_text = (self.night_text or "") + line
+            self.night_text = None
+        elif self.day_text:
+            self.day_text += line
+        if event.kind == "statement":
+            self.opinions_text += line
+        elif voting:
+            self.votes_text += line
+            # Votes as shown to the players still voting this day.
+            vote_line = self.render(GameEvent(f"day_{event.kind}", event.round, event.player, event.target))
+            separator = " " if self.encoding == "compact" else "\n"
+            self.day_votes_text += f"{separator}{vote_line}" if self.day_votes_text else vote_line
+        elif event.kind == "day_start":
+            self.day_votes_text = ""
+
+    def extend(self, events: list):
+        for event in events:
+            self.append(event)
+
+    def to_list(self) -> list:
+        return [dict(event.__dict__) for event in self.events]
+
+    @classmethod
+    def from_list(cls, events: list, encoding: str = "prose") -> "GameEventLog":
+        event_log = cls(encoding)
+        event_log.extend(GameEvent(**event) for event in events)
+        return event_log
+
+
+def _first_sentence(text: str, max_length: int = 200) -> str:
+    return re.split(r"(?<=[.!?])\s", text.strip(), maxsplit=1)[0][:max_length]
+
+
+def history_digest(rounds: list) -> str:
+    """
+    Deterministic summary of the rounds of a game_data game log: who died and how, the vote tallies
+    of every day and the first sentence of the last statement of each player. Only public events
+    are used, so it can stand in for those rounds in any player's prompt.
+    """
+    lines = ["Summary of the earlier rounds:"]
+    last_statements = {}
+    for entry in rounds:
+        if "night" in entry:
+            lines.append(f"Night {entry['night']}: {entry['mafia_kill']} was killed by the Mafia.")
+            continue
+        tally = Counter(event["vote"] for event in entry["events"] if "vote" in event)
+        votes = ", ".join(f"{target} {count}" for target, count in tally.most_common())
+        lines.append(f"Day {entry['day']}: votes {votes or 'none'}; {entry.get('elimination', 'no elimination')}.")
+        for event in entry["events"]:
+            if "statement" in event:
+                last_statements[event["player_id"]] = event["statement"]
+    if last_statements:
+        lines.append("Last stated suspicions:")
+        for player_id in sorted(last_statements, key=lambda player_id: int(player_id.split("_")[1])):
+            lines.append(f"{player_id}: {_first_sentence(last_statements[player_id])}")
+    return "\n".join(lines)
@@ -0,0 +1,147 @@
+import os
+import json
+import queue
+import threading
+
+# Games are stored one compact JSON record per line (JSONL). Appending a game costs one write no
+# matter how many games the file holds, and a crash can at most tear the last line, which the
+# manifest (rewritten atomically after every fsynced record) lets the reader ignore.
+
+
+def manifest_path_for(path: str) -> str:
+    return f"{path}.manifest"
+
+
+def read_manifest(path: str):
+    """Returns {"games", "bytes"} of the records of path known to be on disk, None without a manifest."""
+    manifest_path = manifest_path_for(path)
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path, "r") as file:
+        return json.load(file)
+
+
+def _write_manifest(path: str, games: int, size: int):
+    manifest_path = manifest_path_for(path)
+    temporary_path = f"{manifest_path}.tmp"
+    with open(temporary_path, "w") as file:
+        json.dump({"file": os.path.basename(path), "games": games, "bytes": size}, file)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temporary_path, manifest_path)
+
+
+def _scan_records(path: str) -> tuple:
+    """(games, bytes) of the complete lines at the start of path, for a store without manifest."""
+    games, size = 0, 0
+    if not os.path.exists(path):
+        return games, size
+    with open(path, "rb") as file:
+        for line in file:
+            if not line.endswith(b"\n"):
+                break
+            size += len(line)
+            if line.strip():
+                games += 1
+    return games, size
+
+
+class GameStore:
+    """
+    Append-only JSONL store of game data, written by a background thread so that neither the game
+    loop nor the event loop ever waits for the disk. Use it as a context manager, or call close(),
+    to make sure every appended game has been written.
+    :param path: The .jsonl file to write.
+    :param append: Keep the games already in path (as far as its manifest vouches for them, or every
+        complete line of a file without manifest) instead of starting a new file.
+    """
+
+    def __init__(self, path: str, append: bool = False):
+        self.path = path
+        self.games = 0
+        self.size = 0
+        self.error = None
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        if append:
+            manifest = read_manifest(path)
+            if manifest is not None:
+                self.games, self.size = manifest["games"], manifest["bytes"]
+            else:
+                self.games, self.size = _scan_records(path)
+        self.file = open(path, "ab" if append else "wb")
+        # A record torn by a crash lies beyond the manifest and is cut off.
+        self.file.truncate(self.size)
+        _write_manifest(path, self.games, self.size)
+        self.queue = queue.Queue()
+        self.writer = threading.Thread(target=self._write_records, name=f"GameStore({path})", daemon=True)
+        self.writer.start()
+
+    def append(self, game_data: dict):
+        if self.error is not None:
+            raise self.error
+        self.queue.put(json.dumps(game_data, separators=(",", ":")).encode("utf-8") + b"\n")
+
+    def _write_records(self):
+        while True:
+            record = self.queue.get()
+            if record is None:
+                return
+            if self.error is not None:
+                continue
+            try:
+                self.file.write(record)
+                self.file.flush()
+                os.fsync(self.file.fileno())
+                self.games += 1
+                self.size += len(record)
+                _write_manifest(self.path, self.games, self.size)
+            except OSError as e:
+                self.error = e
+
+    def close(self):
+        """Waits until every appended game is on disk; raises the first write error, if any."""
+        if self.file.closed:
+            return
+        self.queue.put(None)
+        self.writer.join()
+        self.file.close()
+        if self.error is not None:
+            raise self.error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def read_games(path: str):
+    """
+    Yields the games stored in path one at a time: a JSONL store (only the records its manifest
+    vouches for, or every complete line without a manifest) or a JSON array of games.
+    """
+    if not path.endswith(".jsonl"):
+        with open(path, "r") as file:
+            yield from json.load(file)
+        return
+
+    manifest = read_manifest(path)
+    remaining = manifest["bytes"] if manifest is not None else None
+    with open(path, "rb") as file:
+        for line in file:
+            if remaining is not None:
+                remaining -= len(line)
+                if remaining < 0:
+                    break
+            if not line.endswith(b"\n"):
+                break
+            if line.strip():
+                yield json.loads(line)
+
+
+def game_files(folder_name: str) -> list:
+    """The game files of a folder: JSON arrays of games and JSONL stores."""
+    return [os.path.join(folder_name, file_name) for file_name in os.listdir(folder_name)
+            if file_name.endswith(".json") or file_name.endswith(".jsonl")]
@@ -10,15 +10,6 @@ llm_name_map = {
     "deepseek": "DeepSeek Reasoner (R1)"
 }
 
-path = "analysis_data/"
-with open(path + "deception_detection_different.json") as f:
-    diff_data = json.load(f)
-with open(path + "deception_detection_same.json") as f:
-    same_data = json.load(f)
-
-llms = list(diff_data.keys())
-llms.sort()
-
 def annotate_stack(bars, values, bottoms):
     for bar, val, bottom in zip(bars, values, bottoms):
         height = bar.get_height()
@@ -153,5 +144,15 @@ def plot_mafia_detection(same_data, diff_data):
     plt.show()
 
 
-plot_civilian_votes(same_data, diff_data)
-plot_mafia_detection(same_data, diff_data)
+if __name__ == "__main__":
+    path = "analysis_data/"
+    with open(path + "deception_detection_different.json") as f:
+        diff_data = json.load(f)
+    with open(path + "deception_detection_same.json") as f:
+        same_data = json.load(f)
+
+    llms = list(diff_data.keys())
+    llms.sort()
+
+    plot_civilian_votes(same_data, diff_data)
+    plot_mafia_detection(same_data, diff_data)
@@ -10,14 +10,6 @@ llm_name_map = {
     "deepseek": "DeepSeek Reasoner (R1)"
 }
 
-path = "understandable_sentiment_readability/"
-with open(path+"compact_readability_analysis_same.json") as f:
-    same_data = json.load(f)
-with open(path+"compact_readability_analysis_different.json") as f:
-    diff_data = json.load(f)
-
-llms = list(same_data.keys())
-llms.sort()
 bar_width = 0.35
 ci_factor = 2.576  # for 99% confidence interval
 offset = 0.1
@@ -66,5 +58,15 @@ def plot_reading_ease(data, title):
     plt.show()
 
 
-plot_reading_ease(same_data, "Flesch Reading Ease by Role (Same-Model Games) with 99% CI")
-plot_reading_ease(diff_data, "Flesch Reading Ease by Role (Different-Model Games) with 99% CI")
+if __name__ == "__main__":
+    path = "understandable_sentiment_readability/"
+    with open(path+"compact_readability_analysis_same.json") as f:
+        same_data = json.load(f)
+    with open(path+"compact_readability_analysis_different.json") as f:
+        diff_data = json.load(f)
+
+    llms = list(same_data.keys())
+    llms.sort()
+
+    plot_reading_ease(same_data, "Flesch Reading Ease by Role (Same-Model Games) with 99% CI")
+    plot_reading_ease(diff_data, "Flesch Reading Ease by Role (Different-Model Games) with 99% CI")
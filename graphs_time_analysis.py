@@ -10,12 +10,6 @@ llm_name_map = {
     "deepseek": "DeepSeek Reasoner (R1)"
 }
 
-path = "analysis_data/"
-with open(path+"time_analysis_same.json") as f:
-    same_time_data = json.load(f)
-with open(path+"time_analysis_different.json") as f:
-    diff_time_data = json.load(f)
-
 bar_width = 0.35
 
 def plot_response_times_no_error_bars(data, title):
@@ -46,5 +40,12 @@ def plot_response_times_no_error_bars(data, title):
     plt.show()
 
 
-plot_response_times_no_error_bars(same_time_data, "Response Times by Role (Same-Model Games)")
-plot_response_times_no_error_bars(diff_time_data, "Response Times by Role (Different-Model Games)")
\ No newline at end of file
+if __name__ == "__main__":
+    path = "analysis_data/"
+    with open(path+"time_analysis_same.json") as f:
+        same_time_data = json.load(f)
+    with open(path+"time_analysis_different.json") as f:
+        diff_time_data = json.load(f)
+
+    plot_response_times_no_error_bars(same_time_data, "Response Times by Role (Same-Model Games)")
+    plot_response_times_no_error_bars(diff_time_data, "Response Times by Role (Different-Model Games)")
@@ -10,12 +10,6 @@ llm_name_map = {
     "deepseek": "DeepSeek Reasoner (R1)"
 }
 
-path = "analysis_data/"
-with open(path + "win_rates_different.json") as f:
-    diff_data = json.load(f)
-with open(path + "win_rates_same.json") as f:
-    same_data = json.load(f)
-
 def plot_win_ratio_by_role(diff_data):
     roles = ["mafia", "don", "detective", "civilian"]
     role_game_counts = {
@@ -199,7 +193,14 @@ def plot_civilian_win_same_vs_diff(diff_data, same_data):
     plt.show()
 
 
-plot_win_ratio_by_role(diff_data)
-plot_role_wins(diff_data)
-plot_mafia_win_same_vs_diff(diff_data, same_data)
-plot_civilian_win_same_vs_diff(diff_data, same_data)
+if __name__ == "__main__":
+    path = "analysis_data/"
+    with open(path + "win_rates_different.json") as f:
+        diff_data = json.load(f)
+    with open(path + "win_rates_same.json") as f:
+        same_data = json.load(f)
+
+    plot_win_ratio_by_role(diff_data)
+    plot_role_wins(diff_data)
+    plot_mafia_win_same_vs_diff(diff_data, same_data)
+    plot_civilian_win_same_vs_diff(diff_data, same_data)
@@ -316,12 +316,13 @@ def civilian_wrong_votes_ratio(diff_data, same_data):
         json.dump(final_results, f, indent=4)
 
 
-path = "analysis_data/"
-with open(path+"deception_detection_different.json") as f:
-    diff_data = json.load(f)
-with open(path+"deception_detection_same.json") as f:
-    same_data = json.load(f)
-
-mafia_detection_ratio(diff_data, same_data)
-civilian_correct_votes_ratio(diff_data, same_data)
-civilian_wrong_votes_ratio(diff_data, same_data)
+if __name__ == "__main__":
+    path = "analysis_data/"
+    with open(path+"deception_detection_different.json") as f:
+        diff_data = json.load(f)
+    with open(path+"deception_detection_same.json") as f:
+        same_data = json.load(f)
+
+    mafia_detection_ratio(diff_data, same_data)
+    civilian_correct_votes_ratio(diff_data, same_data)
+    civilian_wrong_votes_ratio(diff_data, same_data)
@@ -117,14 +117,15 @@ def opinion_time(diff_data, same_data):
         json.dump(filtered_output, f, indent=4)
 
 
-with open("understandable_sentiment_readability/compact_readability_analysis_different.json") as f:
-    diff_data = json.load(f)
-with open("understandable_sentiment_readability/compact_readability_analysis_same.json") as f:
-    same_data = json.load(f)
-reading_ease(diff_data, same_data)
-
-with open("analysis_data/time_analysis_different.json") as f:
-    diff_data = json.load(f)
-with open("analysis_data/time_analysis_same.json") as f:
-    same_data = json.load(f)
-opinion_time(diff_data, same_data)
+if __name__ == "__main__":
+    with open("understandable_sentiment_readability/compact_readability_analysis_different.json") as f:
+        diff_data = json.load(f)
+    with open("understandable_sentiment_readability/compact_readability_analysis_same.json") as f:
+        same_data = json.load(f)
+    reading_ease(diff_data, same_data)
+
+    with open("analysis_data/time_analysis_different.json") as f:
+        diff_data = json.load(f)
+    with open("analysis_data/time_analysis_same.json") as f:
+        same_data = json.load(f)
+    opinion_time(diff_data, same_data)
@@ -200,12 +200,13 @@ def civilian_different_same(diff_data, same_data):
         json.dump(final_results, f, indent=4)
 
 
-path = "analysis_data/"
-with open(path+"win_rates_different.json") as f:
-    diff_data = json.load(f)
-with open(path+"win_rates_same.json") as f:
-    same_data = json.load(f)
-
-roles_win_rate_different(diff_data)
-mafia_different_same(diff_data, same_data)
-civilian_different_same(diff_data, same_data)
\ No newline at end of file
+if __name__ == "__main__":
+    path = "analysis_data/"
+    with open(path+"win_rates_different.json") as f:
+        diff_data = json.load(f)
+    with open(path+"win_rates_same.json") as f:
+        same_data = json.load(f)
+
+    roles_win_rate_different(diff_data)
+    mafia_different_same(diff_data, same_data)
+    civilian_different_same(diff_data, same_data)
@@ -0,0 +1,94 @@
+import json
+import sqlite3
+import hashlib
+import threading
+
+import config
+
+CACHE_MODES = ["off", "record", "replay"]
+
+
+class ReplayMissError(LookupError):
+    """Raised in replay mode for a request that was never recorded."""
+
+
+class LLMCache:
+    """
+    Content-addressed store of LLM responses in SQLite, keyed by a hash of the provider and the full
+    request (model, parameters, system and user prompt).
+    - record: every request goes to the provider and its response is stored.
+    - replay: every request is answered from the store, a missing one raises ReplayMissError.
+    The same request can occur several times (e.g. the same opening prompt in two games), so responses
+    are stored per occurrence and replayed in the order they were recorded.
+    """
+
+    def __init__(self, path: str, mode: str):
+        assert mode in CACHE_MODES, f"Unknown LLM cache mode '{mode}', expected one of {CACHE_MODES}."
+        self.path = path
+        self.mode = mode
+        self.lock = threading.Lock()
+        self.occurrences = {}
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute(
+            """CREATE TABLE IF NOT EXISTS responses (
+                   key TEXT NOT NULL,
+                   occurrence INTEGER NOT NULL,
+                   llm_name TEXT NOT NULL,
+                   response TEXT NOT NULL,
+                   usage TEXT NOT NULL,
+                   duration REAL NOT NULL,
+                   PRIMARY KEY (key, occurrence)
+               )"""
+        )
+        self.connection.commit()
+
+    @staticmethod
+    def key(llm_name: str, request: dict) -> str:
+        payload = json.dumps({"llm_name": llm_name, "request": request}, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _next_occurrence(self, key: str) -> int:
+        occurrence = self.occurrences.get(key, 0)
+        self.occurrences[key] = occurrence + 1
+        return occurrence
+
+    def lookup(self, key: str):
+        """Returns the recorded {"response", "usage", "duration"} in replay mode, None otherwise."""
+        if self.mode != "replay":
+            return None
+        with self.lock:
+            occurrence = self._next_occurrence(key)
+            row = self.connection.execute(
+                "SELECT response, usage, duration FROM responses WHERE key = ? AND occurrence <= ? "
+                "ORDER BY occurrence DESC LIMIT 1",
+                (key, occurrence)
+            ).fetchone()
+        if row is None:
+            raise ReplayMissError(f"No recorded response for request {key[:12]}.")
+        response, usage, duration = row
+        return {"response": response, "usage": json.loads(usage), "duration": duration}
+
+    def store(self, key: str, llm_name: str, response: str, usage: dict, duration: float):
+        if self.mode != "record":
+            return
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                (key, self._next_occurrence(key), llm_name, response, json.dumps(usage), duration)
+            )
+            self.connection.commit()
+
+
+_llm_cache = None
+_llm_cache_lock = threading.Lock()
+
+
+def get_llm_cache():
+    """Returns the process-wide LLMCache configured in config.py, None when the cache is off."""
+    global _llm_cache
+    if config.LLM_CACHE_MODE == "off":
+        return None
+    with _llm_cache_lock:
+        if _llm_cache is None or _llm_cache.mode != config.LLM_CACHE_MODE:
+            _llm_cache = LLMCache(config.LLM_CACHE_PATH, config.LLM_CACHE_MODE)
+        return _llm_cache
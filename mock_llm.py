@@ -0,0 +1,183 @@
+import os
+import re
+import json
+import time
+import random
+import asyncio
+import hashlib
+import threading
+from types import SimpleNamespace
+
+# Prompt lines listing the legal targets of each decision, see the prompt builders in agent.py.
+TARGET_LINES = {
+    "vote": r"nominated for elimination: ([^\n]*)",
+    "kill": r"Candidates: ([^\n]*)",
+    "investigate": r"Alive players: ([^\n]*)",
+    "don_guess": r"not part of the Mafia: ([^\n]*)",
+}
+
+LATENCY_DATA_FOLDERS = ["generated_data_same", "generated_data_different"]
+
+
+class MockRateLimitError(Exception):
+    """Injected 429, shaped like the provider SDK errors so utils.is_transient_error recognises it."""
+    status_code = 429
+
+    def __init__(self, retry_after: float = 1.0):
+        super().__init__("Mock provider: rate limit exceeded.")
+        self.response = SimpleNamespace(headers={"retry-after": str(retry_after)})
+
+
+class MockTimeoutError(TimeoutError):
+    """Injected request timeout."""
+
+
+def load_speech_durations(llm_name: str = None) -> list:
+    """
+    Recorded opinion_speech_generation_durations from the generated games, of one LLM or of all of them.
+    """
+    root = os.path.dirname(os.path.abspath(__file__))
+    durations = []
+    for folder in LATENCY_DATA_FOLDERS:
+        folder_path = os.path.join(root, folder)
+        if not os.path.isdir(folder_path):
+            continue
+        for file_name in sorted(os.listdir(folder_path)):
+            if not file_name.endswith(".json"):
+                continue
+            with open(os.path.join(folder_path, file_name), "r") as file:
+                games = json.load(file)
+            for game in games:
+                for player in game["game_details"]["players"]:
+                    if llm_name is None or player["llm_name"] == llm_name:
+                        durations.extend(player.get("opinion_speech_generation_durations", []))
+    return durations
+
+
+class MockLLM:
+    """
+    Offline stand-in for a chat completion provider. Answers every agent action in the format its
+    prompt asks for, waits a latency sampled from the recorded speech durations, reports fake token
+    usage and injects 429s, timeouts and malformed replies at the configured rates.
+    :param latency_profile: LLM whose recorded latencies are sampled, None for all of them.
+    :param latency_scale: Factor applied to every sampled latency, 0 for no waiting at all.
+    :param fault_rates: Probabilities of "rate_limit", "timeout" and "malformed" per call.
+    :param seed: Seed of the latency and fault generator; replies only depend on the prompt.
+    """
+
+    def __init__(self, latency_profile: str = None, latency_scale: float = 1.0, fault_rates: dict = None,
+                 seed: int = None):
+        self.latency_profile = latency_profile
+        self.latency_scale = latency_scale
+        self.fault_rates = fault_rates or {}
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self._durations = None
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def _sample_latency(self) -> float:
+        if self.latency_scale <= 0:
+            return 0.0
+        if self._durations is None:
+            self._durations = load_speech_durations(self.latency_profile) or [1.0]
+        with self.lock:
+            return self.rng.choice(self._durations) * self.latency_scale
+
+    def _draw_fault(self):
+        with self.lock:
+            for fault in ["rate_limit", "timeout", "malformed"]:
+                if self.rng.random() < self.fault_rates.get(fault, 0.0):
+                    return fault
+        return None
+
+    @staticmethod
+    def reply(user_prompt: str) -> str:
+        prompt_rng = random.Random(hashlib.sha256(user_prompt.encode("utf-8")).hexdigest())
+        for action, pattern in TARGET_LINES.items():
+            match = re.search(pattern, user_prompt)
+            if not match:
+                continue
+            targets = re.findall(r"player_\d+", match.group(1))
+            if action == "vote" and prompt_rng.random() < 0.2:
+                return "no one\nThere is not enough information to eliminate anyone yet."
+            target = prompt_rng.choice(targets)
+            return f"{target}\n{target} has been acting suspiciously and their statements do not add up."
+        player = prompt_rng.choice(re.findall(r"player_\d+", user_prompt) or ["player_0"])
+        return (f"I have been watching {player} closely and their reasoning feels forced. "
+                f"Let's be careful with our votes and not hand the mafia an easy win.")
+
+    def _response(self, request: dict, malformed: bool):
+        prompt_characters = sum(len(message["content"]) for message in request["messages"])
+        user_prompt = request["messages"][-1]["content"]
+        text = "Hmm, I need to think about this a bit more." if malformed else self.reply(user_prompt)
+        if "response_format" in request and not malformed:
+            target, _, reason = text.partition("\n")
+            text = json.dumps({"target": target, "reason": reason})
+        reasoning_tokens = self.rng.randint(50, 500)
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=text))],
+            usage=SimpleNamespace(
+                prompt_tokens=prompt_characters // 4,
+                prompt_tokens_details=SimpleNamespace(cached_tokens=0),
+                completion_tokens=len(text) // 4 + reasoning_tokens,
+                completion_tokens_details=SimpleNamespace(reasoning_tokens=reasoning_tokens),
+            )
+        )
+
+    def _start(self):
+        """Returns (latency, fault) of the next call and raises an injected 429 right away."""
+        fault = self._draw_fault()
+        if fault == "rate_limit":
+            raise MockRateLimitError()
+        return self._sample_latency(), fault
+
+    @staticmethod
+    def _stream_chunks(response) -> list:
+        """Splits a response into chat completion chunks, one per word, and a last one with the usage."""
+        words = re.findall(r"\S+\s*", response.choices[0].message.content)
+        chunks = [SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=word))], usage=None)
+                  for word in words]
+        chunks.append(SimpleNamespace(choices=[], usage=response.usage))
+        return chunks
+
+    def create(self, stream: bool = False, stream_options: dict = None, **request):
+        latency, fault = self._start()
+        if stream:
+            return self._stream(request, latency, fault)
+        time.sleep(latency)
+        if fault == "timeout":
+            raise MockTimeoutError("Mock provider: request timed out.")
+        return self._response(request, malformed=fault == "malformed")
+
+    def _stream(self, request: dict, latency: float, fault: str):
+        # Half of the latency passes before the first token, the rest is spread over the chunks.
+        time.sleep(latency / 2)
+        if fault == "timeout":
+            raise MockTimeoutError("Mock provider: request timed out.")
+        chunks = self._stream_chunks(self._response(request, malformed=fault == "malformed"))
+        for chunk in chunks:
+            yield chunk
+            time.sleep(latency / 2 / len(chunks))
+
+    async def create_async(self, stream: bool = False, stream_options: dict = None, **request):
+        latency, fault = self._start()
+        if stream:
+            return self._stream_async(request, latency, fault)
+        await asyncio.sleep(latency)
+        if fault == "timeout":
+            raise MockTimeoutError("Mock provider: request timed out.")
+        return self._response(request, malformed=fault == "malformed")
+
+    async def _stream_async(self, request: dict, latency: float, fault: str):
+        await asyncio.sleep(latency / 2)
+        if fault == "timeout":
+            raise MockTimeoutError("Mock provider: request timed out.")
+        chunks = self._stream_chunks(self._response(request, malformed=fault == "malformed"))
+        for chunk in chunks:
+            yield chunk
+            await asyncio.sleep(latency / 2 / len(chunks))
+
+    @property
+    def aio(self):
+        """Async view with the same interface as the async SDK clients."""
+        return SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=self.create_async)))
@@ -95,4 +95,15 @@ SYSTEM_PROMPTS = {
     - Stay alive and help vote out the mafia.
     - You win when all mafia are eliminated.
     """
-}
\ No newline at end of file
+}
+# Explains the codes of game_events.COMPACT_EVENT_FORMATS, added to the system prompt of games that use them.
+COMPACT_EVENT_LEGEND = """
+    ## Game log notation:
+    - pN is player_N. Always answer with the full name player_N.
+    - "Nk killed pN": the Mafia killed player_N in night k. "pN last words: ...": final words of a dead player.
+    - "Dk": day k begins. "pN: ...": statement of player_N.
+    - "Dk votes: pA>pB pC>-": player_A voted to eliminate player_B, player_C voted for no one.
+    - "Dk out: pN": player_N was voted out on day k. "Dk out: -": no elimination that day.
+    - "Nk pN mafia:True/False": result of an investigation in night k.
+    - "Nk guessed pN detective:True/False": the Don's guess in night k of who is the Detective.
+"""
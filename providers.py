@@ -0,0 +1,482 @@
+import json
+import threading
+from dataclasses import dataclass
+
+import config
+
+
+@dataclass
+class TokenUsage:
+    """Token usage of one response, normalized over providers. input_tokens excludes cached input."""
+    input_tokens: int = 0
+    cached_input_tokens: int = 0
+    cache_write_input_tokens: int = 0
+    output_tokens: int = 0
+    thinking_tokens: int = 0
+
+
+class Provider:
+    """
+    Adapter between the agents and one LLM backend. The SDK clients are built on first use, so only
+    the providers a run actually calls are imported and constructed.
+
+    Requests are laid out with the stable part first: the system prompt, then the game history, which
+    only ever grows at its end, then the action instructions. history is that cacheable prefix of the
+    user prompt; providers with explicit caching mark it, the others cache matching prefixes on their own.
+
+    schema is the JSON schema of a decision (see agent.decision_schema). Providers with structured
+    outputs constrain the reply to it and return it as JSON text, the others get the plain prompt.
+
+    messages are the earlier turns of an agent session, {"role": "user" or "assistant", "content"} dicts
+    sent between the system prompt and user_prompt. They never change once sent, so they are the
+    cacheable prefix of the request; providers with explicit caching mark their end.
+    """
+
+    def __init__(self):
+        self._client = None
+        self._async_client = None
+        self._lock = threading.RLock()
+
+    @property
+    def client(self):
+        with self._lock:
+            if self._client is None:
+                self._client = self.build_client()
+            return self._client
+
+    @property
+    def async_client(self):
+        with self._lock:
+            if self._async_client is None:
+                self._async_client = self.build_async_client()
+            return self._async_client
+
+    def build_client(self):
+        raise NotImplementedError
+
+    def build_async_client(self):
+        raise NotImplementedError
+
+    def build_request(self, system_prompt: str, user_prompt: str, history: str = "", schema: dict = None,
+                      messages: list = None) -> dict:
+        raise NotImplementedError
+
+    def apply_settings(self, request: dict, settings: dict) -> dict:
+        """Maps the generation settings of an action (see config.ACTION_SETTINGS) onto a request."""
+        return request
+
+    def create(self, request: dict):
+        raise NotImplementedError
+
+    async def create_async(self, request: dict):
+        raise NotImplementedError
+
+    def parse(self, response) -> tuple[str, TokenUsage]:
+        raise NotImplementedError
+
+    def stream(self, request: dict):
+        """Streams the response as (text delta, TokenUsage or None) tuples, the usage arriving last."""
+        raise NotImplementedError
+
+    def stream_async(self, request: dict):
+        """Async generator version of stream."""
+        raise NotImplementedError
+
+
+def _close(stream):
+    close = getattr(stream, "close", None)
+    if close is not None:
+        close()
+
+
+async def _aclose(stream):
+    close = getattr(stream, "aclose", None) or getattr(stream, "close", None)
+    if close is not None:
+        await close()
+
+
+class OpenAICompatibleProvider(Provider):
+    """Chat completions API, used by OpenAI itself and by DeepSeek and Grok through their base_url."""
+    model = None
+    api_key = None
+    base_url = None
+    temperature = None
+    # Grok reports completion_tokens without the reasoning tokens, the others include them.
+    reasoning_in_completion_tokens = True
+    supports_json_schema = True
+    # reasoning_effort values for the settings' low/medium/high, None for models without the parameter.
+    reasoning_efforts = {"low": "low", "medium": "medium", "high": "high"}
+    # The completion token cap, which includes the reasoning tokens; None to send no cap.
+    max_tokens_parameter = "max_completion_tokens"
+    # The reasoning models reject stop sequences.
+    supports_stop = False
+
+    def build_client(self):
+        from openai import OpenAI
+        return OpenAI(api_key=self.api_key, base_url=self.base_url)
+
+    def build_async_client(self):
+        from openai import AsyncOpenAI
+        return AsyncOpenAI(api_key=self.api_key, base_url=self.base_url)
+
+    def build_request(self, system_prompt: str, user_prompt: str, history: str = "", schema: dict = None,
+                      messages: list = None) -> dict:
+        request = dict(
+            model=self.model,
+            messages=[
+                {"role": "system", "content": system_prompt},
+                *(messages or []),
+                {"role": "user", "content": user_prompt}
+            ],
+        )
+        if self.temperature is not None:
+            request["temperature"] = self.temperature
+        if schema is not None and self.supports_json_schema:
+            request["response_format"] = {
+                "type": "json_schema",
+                "json_schema": {"name": "decision", "schema": schema, "strict": True}
+            }
+        return request
+
+    def apply_settings(self, request: dict, settings: dict) -> dict:
+        if settings.get("reasoning_effort") and self.reasoning_efforts:
+            request["reasoning_effort"] = self.reasoning_efforts[settings["reasoning_effort"]]
+        if settings.get("max_output_tokens") and self.max_tokens_parameter:
+            request[self.max_tokens_parameter] = settings["max_output_tokens"] + (settings.get("thinking_budget") or 0)
+        if settings.get("stop") and self.supports_stop:
+            request["stop"] = settings["stop"]
+        return request
+
+    def create(self, request: dict):
+        return self.client.chat.completions.create(**request)
+
+    async def create_async(self, request: dict):
+        return await self.async_client.chat.completions.create(**request)
+
+    def stream(self, request: dict):
+        stream = self.client.chat.completions.create(**request, stream=True, stream_options={"include_usage": True})
+        try:
+            for chunk in stream:
+                yield self._stream_chunk(chunk)
+        finally:
+            _close(stream)
+
+    async def stream_async(self, request: dict):
+        stream = await self.async_client.chat.completions.create(
+            **request, stream=True, stream_options={"include_usage": True})
+        try:
+            async for chunk in stream:
+                yield self._stream_chunk(chunk)
+        finally:
+            await _aclose(stream)
+
+    def cached_tokens(self, usage) -> int:
+        return getattr(getattr(usage, "prompt_tokens_details", None), "cached_tokens", 0) or 0
+
+    def token_usage(self, usage) -> TokenUsage:
+        cached_tokens = self.cached_tokens(usage)
+        reasoning_tokens = getattr(usage.completion_tokens_details, "reasoning_tokens", 0) or 0
+        output_tokens = usage.completion_tokens
+        if self.reasoning_in_completion_tokens:
+            output_tokens -= reasoning_tokens
+        return TokenUsage(
+            input_tokens=usage.prompt_tokens - cached_tokens,
+            cached_input_tokens=cached_tokens,
+            output_tokens=output_tokens,
+            thinking_tokens=reasoning_tokens,
+        )
+
+    def parse(self, response) -> tuple[str, TokenUsage]:
+        return response.choices[0].message.content.strip(), self.token_usage(response.usage)
+
+    def _stream_chunk(self, chunk) -> tuple:
+        # The usage comes in a last chunk without choices.
+        text = (chunk.choices[0].delta.content or "") if chunk.choices else ""
+        usage = self.token_usage(chunk.usage) if getattr(chunk, "usage", None) else None
+        return text, usage
+
+
+class OpenAIProvider(OpenAICompatibleProvider):
+    model = config.OPENAI_MODEL
+    api_key = config.OPENAI_API_KEY
+
+
+class DeepSeekProvider(OpenAICompatibleProvider):
+    model = config.DEEPSEEK_MODEL
+    api_key = config.DEEPSEEK_API_KEY
+    base_url = "https://api.deepseek.com"
+    temperature = 0.3
+    # deepseek-reasoner has neither JSON output nor tool calls, nor a way to bound its reasoning, which
+    # counts against max_tokens: a cap would cut off answers after long reasoning.
+    supports_json_schema = False
+    reasoning_efforts = None
+    max_tokens_parameter = None
+
+    def cached_tokens(self, usage) -> int:
+        return getattr(usage, "prompt_cache_hit_tokens", 0) or 0
+
+
+class GrokProvider(OpenAICompatibleProvider):
+    model = config.GROK_MODEL
+    api_key = config.GROK_API_KEY
+    base_url = "https://api.x.ai/v1"
+    temperature = 0.3
+    reasoning_in_completion_tokens = False
+    # grok-3-mini only knows low and high.
+    reasoning_efforts = {"low": "low", "medium": "high", "high": "high"}
+
+
+class GeminiProvider(Provider):
+    def build_client(self):
+        from google import genai
+        return genai.Client(api_key=config.GEMINI_API_KEY)
+
+    def build_async_client(self):
+        return self.client.aio
+
+    def build_request(self, system_prompt: str, user_prompt: str, history: str = "", schema: dict = None,
+                      messages: list = None) -> dict:
+        generation_config = {"system_instruction": system_prompt}
+        if schema is not None:
+            generation_config["response_mime_type"] = "application/json"
+            generation_config["response_schema"] = self.gemini_schema(schema)
+        contents = user_prompt
+        if messages:
+            contents = [{"role": "model" if message["role"] == "assistant" else "user",
+                         "parts": [{"text": message["content"]}]}
+                        for message in [*messages, {"role": "user", "content": user_prompt}]]
+        return dict(
+            model=config.GEMINI_MODEL,
+            contents=contents,
+            config=generation_config,
+        )
+
+    def apply_settings(self, request: dict, settings: dict) -> dict:
+        # Thinking tokens count against max_output_tokens.
+        generation_config = request["config"]
+        if settings.get("thinking_budget") is not None:
+            generation_config["thinking_config"] = {"thinking_budget": settings["thinking_budget"]}
+        if settings.get("max_output_tokens"):
+            generation_config["max_output_tokens"] = settings["max_output_tokens"] + (settings.get("thinking_budget") or 0)
+        if settings.get("stop"):
+            generation_config["stop_sequences"] = settings["stop"]
+        return request
+
+    @classmethod
+    def gemini_schema(cls, schema: dict) -> dict:
+        """Gemini takes an OpenAPI subset: upper case types and no additionalProperties."""
+        if not isinstance(schema, dict):
+            return schema
+        converted = {}
+        for key, value in schema.items():
+            if key == "additionalProperties":
+                continue
+            if key == "type":
+                converted[key] = value.upper()
+            elif key == "properties":
+                converted[key] = {name: cls.gemini_schema(prop) for name, prop in value.items()}
+            else:
+                converted[key] = cls.gemini_schema(value)
+        return converted
+
+    def create(self, request: dict):
+        return self.client.models.generate_content(**request)
+
+    async def create_async(self, request: dict):
+        return await self.async_client.models.generate_content(**request)
+
+    def stream(self, request: dict):
+        stream = self.client.models.generate_content_stream(**request)
+        try:
+            for chunk in stream:
+                yield self._stream_chunk(chunk)
+        finally:
+            _close(stream)
+
+    async def stream_async(self, request: dict):
+        stream = await self.async_client.models.generate_content_stream(**request)
+        try:
+            async for chunk in stream:
+                yield self._stream_chunk(chunk)
+        finally:
+            await _aclose(stream)
+
+    @staticmethod
+    def token_usage(usage) -> TokenUsage:
+        cached_tokens = usage.cached_content_token_count or 0
+        return TokenUsage(
+            input_tokens=(usage.prompt_token_count or 0) - cached_tokens,
+            cached_input_tokens=cached_tokens,
+            output_tokens=usage.candidates_token_count or 0,
+            thinking_tokens=usage.thoughts_token_count or 0,
+        )
+
+    def parse(self, response) -> tuple[str, TokenUsage]:
+        text = response.text.strip() if hasattr(response, "text") else ""
+        return text, self.token_usage(response.usage_metadata)
+
+    def _stream_chunk(self, chunk) -> tuple:
+        # Every chunk carries the usage so far, the last one the complete usage.
+        usage = chunk.usage_metadata
+        return chunk.text or "", self.token_usage(usage) if usage is not None else None
+
+
+class ClaudeProvider(Provider):
+    def build_client(self):
+        import anthropic
+        return anthropic.Anthropic(api_key=config.CLAUDE_API_KEY)
+
+    def build_async_client(self):
+        import anthropic
+        return anthropic.AsyncAnthropic(api_key=config.CLAUDE_API_KEY)
+
+    def build_request(self, system_prompt: str, user_prompt: str, history: str = "", schema: dict = None,
+                      messages: list = None) -> dict:
+        # Cache breakpoints after the system prompt, after the earlier session turns and after the game history.
+        if history and user_prompt.startswith(history) and len(user_prompt) > len(history):
+            user_content = [
+                {"type": "text", "text": history, "cache_control": {"type": "ephemeral"}},
+                {"type": "text", "text": user_prompt[len(history):]}
+            ]
+        else:
+            user_content = user_prompt
+        earlier_turns = [dict(message) for message in messages or []]
+        if earlier_turns:
+            earlier_turns[-1]["content"] = [{"type": "text", "text": earlier_turns[-1]["content"],
+                                             "cache_control": {"type": "ephemeral"}}]
+        request = dict(
+            model=config.CLAUDE_MODEL,
+            system=[{"type": "text", "text": system_prompt, "cache_control": {"type": "ephemeral"}}],
+            messages=[
+                *earlier_turns,
+                {"role": "user", "content": user_content}
+            ],
+            max_tokens=6000,
+            thinking={
+                "type": "enabled",
+                "budget_tokens": 5000
+            }
+        )
+        if schema is not None:
+            # Extended thinking does not allow forcing a tool, so the decision tool is offered and a
+            # plain text answer goes through the fallback parser.
+            request["tools"] = [{"name": "submit_decision", "description": "Submit your decision.",
+                                 "input_schema": schema}]
+        return request
+
+    # Extended thinking takes at least this many tokens; a smaller thinking_budget turns thinking off.
+    MIN_THINKING_BUDGET = 1024
+
+    def apply_settings(self, request: dict, settings: dict) -> dict:
+        thinking_budget = settings.get("thinking_budget")
+        if thinking_budget is not None:
+            if thinking_budget >= self.MIN_THINKING_BUDGET:
+                request["thinking"] = {"type": "enabled", "budget_tokens": thinking_budget}
+            else:
+                request.pop("thinking", None)
+        if settings.get("max_output_tokens"):
+            # max_tokens includes the thinking tokens.
+            request["max_tokens"] = settings["max_output_tokens"] + \
+                (request["thinking"]["budget_tokens"] if "thinking" in request else 0)
+        if settings.get("stop"):
+            request["stop_sequences"] = settings["stop"]
+        return request
+
+    def create(self, request: dict):
+        return self.client.messages.create(**request)
+
+    async def create_async(self, request: dict):
+        return await self.async_client.messages.create(**request)
+
+    def stream(self, request: dict):
+        stream = self.client.messages.create(**request, stream=True)
+        usage = TokenUsage()
+        try:
+            for event in stream:
+                yield self._stream_event(event, usage)
+        finally:
+            _close(stream)
+
+    async def stream_async(self, request: dict):
+        stream = await self.async_client.messages.create(**request, stream=True)
+        usage = TokenUsage()
+        try:
+            async for event in stream:
+                yield self._stream_event(event, usage)
+        finally:
+            await _aclose(stream)
+
+    @staticmethod
+    def token_usage(usage) -> TokenUsage:
+        return TokenUsage(
+            input_tokens=usage.input_tokens,
+            cached_input_tokens=getattr(usage, "cache_read_input_tokens", 0) or 0,
+            cache_write_input_tokens=getattr(usage, "cache_creation_input_tokens", 0) or 0,
+            output_tokens=usage.output_tokens,
+        )
+
+    def parse(self, response) -> tuple[str, TokenUsage]:
+        content = getattr(response, "content", [])
+        decision = next((block.input for block in content if block.type == "tool_use"), None)
+        if decision is not None:
+            text = json.dumps(decision)
+        else:
+            text = "".join(block.text for block in content if block.type == "text").strip()
+        return text, self.token_usage(response.usage)
+
+    def _stream_event(self, event, usage: TokenUsage) -> tuple:
+        """Input usage arrives with message_start, the final output usage with message_delta."""
+        if event.type == "message_start":
+            message_usage = self.token_usage(event.message.usage)
+            usage.input_tokens = message_usage.input_tokens
+            usage.cached_input_tokens = message_usage.cached_input_tokens
+            usage.cache_write_input_tokens = message_usage.cache_write_input_tokens
+        elif event.type == "message_delta":
+            usage.output_tokens = event.usage.output_tokens
+            return "", usage
+        elif event.type == "content_block_delta" and event.delta.type == "text_delta":
+            return event.delta.text, None
+        elif event.type == "content_block_delta" and event.delta.type == "input_json_delta":
+            return event.delta.partial_json, None
+        return "", None
+
+
+class MockProvider(OpenAICompatibleProvider):
+    """Offline provider from mock_llm.py, see the mock settings in config.py."""
+    model = config.MOCK_MODEL
+
+    def build_client(self):
+        from mock_llm import MockLLM
+        return MockLLM(config.MOCK_LATENCY_PROFILE, config.MOCK_LATENCY_SCALE, config.MOCK_FAULT_RATES)
+
+    def build_async_client(self):
+        return self.client.aio
+
+
+PROVIDER_CLASSES = {
+    "openai": OpenAIProvider,
+    "gemini": GeminiProvider,
+    "deepseek": DeepSeekProvider,
+    "claude": ClaudeProvider,
+    "grok": GrokProvider,
+    "mock": MockProvider,
+}
+
+_providers = {}
+_providers_lock = threading.Lock()
+
+
+def register_provider(llm_name: str, provider_cls: type):
+    """Makes a new backend available to the agents under llm_name."""
+    with _providers_lock:
+        PROVIDER_CLASSES[llm_name] = provider_cls
+        _providers.pop(llm_name, None)
+
+
+def get_provider(llm_name: str) -> Provider:
+    with _providers_lock:
+        if llm_name not in _providers:
+            if llm_name not in PROVIDER_CLASSES:
+                raise KeyError(f"Unknown LLM provider '{llm_name}', registered: {sorted(PROVIDER_CLASSES)}.")
+            _providers[llm_name] = PROVIDER_CLASSES[llm_name]()
+        return _providers[llm_name]
@@ -0,0 +1,161 @@
+import time
+import asyncio
+import threading
+from collections import deque
+from contextlib import contextmanager, asynccontextmanager
+
+import config
+
+
+def estimate_input_tokens(*prompts: str) -> int:
+    """Rough input size used to reserve token budget before the provider reports the real usage."""
+    return sum(len(prompt) for prompt in prompts) // 4 + 1
+
+
+class TokenBucket:
+    """
+    Bucket refilled continuously at capacity_per_minute. Reservations may drive it negative,
+    which makes later callers wait their turn instead of failing.
+    """
+
+    def __init__(self, capacity_per_minute: float):
+        self.capacity = capacity_per_minute
+        self.refill_per_second = capacity_per_minute / 60
+        self.tokens = capacity_per_minute
+        self.updated_at = time.monotonic()
+
+    def reserve(self, amount: float) -> float:
+        """Takes amount from the bucket and returns how many seconds the caller has to wait for it."""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.refill_per_second)
+        self.updated_at = now
+        self.tokens -= min(amount, self.capacity)
+        if self.tokens >= 0:
+            return 0.0
+        return -self.tokens / self.refill_per_second
+
+    def refund(self, amount: float):
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class ProviderRateLimiter:
+    """
+    Requests/min, input tokens/min and max in-flight limits of one provider, shared by every
+    agent of the process, whether it calls from a thread or from an event loop.
+    """
+
+    def __init__(self, requests_per_minute: int = None, input_tokens_per_minute: int = None,
+                 max_in_flight: int = None):
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.input_tokens = TokenBucket(input_tokens_per_minute) if input_tokens_per_minute else None
+        self.max_in_flight = max_in_flight
+        self.in_flight = 0
+        self.waiters = deque()
+        self.lock = threading.Lock()
+
+    def _reserve(self, input_tokens: int) -> float:
+        with self.lock:
+            wait = 0.0
+            if self.requests:
+                wait = max(wait, self.requests.reserve(1))
+            if self.input_tokens:
+                wait = max(wait, self.input_tokens.reserve(input_tokens))
+            return wait
+
+    def _take_slot(self, waiter) -> bool:
+        with self.lock:
+            if self.max_in_flight is None or (self.in_flight < self.max_in_flight and not self.waiters):
+                self.in_flight += 1
+                return True
+            self.waiters.append(waiter)
+            return False
+
+    def _release_slot(self):
+        with self.lock:
+            if not self.waiters:
+                self.in_flight -= 1
+                return
+            # The slot is handed over directly, so in_flight stays the same.
+            waiter = self.waiters.popleft()
+        if isinstance(waiter, threading.Event):
+            waiter.set()
+        else:
+            loop, future = waiter
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(None))
+
+    def settle(self, estimated_input_tokens: int, actual_input_tokens: int):
+        """Corrects the input token bucket once the provider reported the real prompt size."""
+        if self.input_tokens:
+            with self.lock:
+                self.input_tokens.refund(estimated_input_tokens - actual_input_tokens)
+
+    @contextmanager
+    def limit(self, input_tokens: int):
+        wait = self._reserve(input_tokens)
+        if wait > 0:
+            time.sleep(wait)
+        event = threading.Event()
+        if not self._take_slot(event):
+            event.wait()
+        try:
+            yield
+        finally:
+            self._release_slot()
+
+    @asynccontextmanager
+    async def limit_async(self, input_tokens: int):
+        wait = self._reserve(input_tokens)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        waiter = (loop, future)
+        if not self._take_slot(waiter):
+            try:
+                await future
+            except asyncio.CancelledError:
+                with self.lock:
+                    handed_over = waiter not in self.waiters
+                    if not handed_over:
+                        self.waiters.remove(waiter)
+                if handed_over:
+                    self._release_slot()
+                raise
+        try:
+            yield
+        finally:
+            self._release_slot()
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+# Number of processes sharing config.RATE_LIMITS, see share_rate_limits.
+_processes = 1
+
+
+def share_rate_limits(processes: int):
+    """
+    Pool initializer of worker processes: each of the processes gets 1/processes of every limit of
+    config.RATE_LIMITS (at least one request in flight), so together they stay within the provider limits.
+    """
+    global _processes
+    with _limiters_lock:
+        _processes = processes
+        _limiters.clear()
+
+
+def scaled_limits(limits: dict, processes: int) -> dict:
+    return {name: (max(1, limit // processes) if name == "max_in_flight" else limit / processes)
+            for name, limit in limits.items() if limit}
+
+
+def limiter_for(llm_name: str) -> ProviderRateLimiter:
+    """
+    Returns the process-wide limiter of a provider, unlimited if it has no entry in config.RATE_LIMITS,
+    with this process's share of the limits (see share_rate_limits).
+    """
+    with _limiters_lock:
+        if llm_name not in _limiters:
+            _limiters[llm_name] = ProviderRateLimiter(**scaled_limits(config.RATE_LIMITS.get(llm_name, {}),
+                                                                      _processes))
+        return _limiters[llm_name]
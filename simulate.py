@@ -1,160 +1,167 @@
-from game import MafiaGame
-import json
+from game import MafiaGame, CorruptGameStateError
+from agent import AsyncAgent
+import math
 import random
-from pprint import pprint
 from collections import Counter
 from utils import retry
+from game_store import GameStore
 
 
 def validate_llms_and_roles(llms_lists, roles_tuples, number_of_games):
-    target_detective = number_of_games // 5
-    target_don = number_of_games // 5
-    target_mafia = (2 * number_of_games) // 5
-    target_civilian = (6 * number_of_games) // 5
-
-    llm_role_counts = {llm: {"detective": 0, "don": 0, "mafia": 0, "civilian": 0} for llm in
-                       set([llm for sublist in llms_lists for llm in sublist])}
+    """
+    Checks that every LLM plays its share of every game (len(roles) / number of LLMs seats, exactly
+    2 for 5 LLMs and 10 players) and that each role went to every LLM equally often over all games.
+    """
+    llms_used = sorted(set(llm for sublist in llms_lists for llm in sublist))
+    role_totals = Counter(role for game_idx in range(number_of_games) for role in roles_tuples[game_idx])
+    llm_role_counts = {llm: {role: 0 for role in role_totals} for llm in llms_used}
 
     for game_idx in range(number_of_games):
         llms = llms_lists[game_idx]
         roles = roles_tuples[game_idx]
+        seats_per_llm = len(roles) / len(llms_used)
 
         llm_counter = Counter(llms)
-        for llm, count in llm_counter.items():
-            assert count == 2, f"LLM '{llm}' is not used exactly twice in game {game_idx + 1}!"
-
-        role_counter = Counter(zip(llms, roles))
-        for (llm, role), count in role_counter.items():
-            if role == 'detective':
-                llm_role_counts[llm]["detective"] += count
-            elif role == 'don':
-                llm_role_counts[llm]["don"] += count
-            elif role == 'mafia':
-                llm_role_counts[llm]["mafia"] += count
-            elif role == 'civilian':
-                llm_role_counts[llm]["civilian"] += count
+        for llm in llms_used:
+            count = llm_counter[llm]
+            assert math.floor(seats_per_llm) <= count <= math.ceil(seats_per_llm), \
+                f"LLM '{llm}' is used {count} times in game {game_idx + 1}, expected {seats_per_llm:g}!"
+
+        for llm, role in zip(llms, roles):
+            llm_role_counts[llm][role] += 1
 
     for llm, counts in llm_role_counts.items():
-        assert counts[
-                   "detective"] == target_detective, f"LLM '{llm}' was assigned detective role {counts['detective']} times, expected {target_detective}!"
-        assert counts[
-                   "don"] == target_don, f"LLM '{llm}' was assigned don role {counts['don']} times, expected {target_don}!"
-        assert counts[
-                   "mafia"] == target_mafia, f"LLM '{llm}' was assigned mafia role {counts['mafia']} times, expected {target_mafia}!"
-        assert counts[
-                   "civilian"] == target_civilian, f"LLM '{llm}' was assigned civilian role {counts['civilian']} times, expected {target_civilian}!"
+        for role, total in role_totals.items():
+            target = total / len(llms_used)
+            assert counts[role] == target, \
+                f"LLM '{llm}' was assigned {role} role {counts[role]} times, expected {target:g}!"
     return True
 
 
-@retry()
-def run_single_mafia_same(llm_name: str):
-    game = MafiaGame(llm_name)
+# Failed actions are handled inside the game (provider retries, re-asked decisions), so a game is only
+# restarted when its state is corrupt; any other error is raised to the caller. With a checkpoint_path,
+# the game is saved after every phase and a rerun continues from its last checkpoint (a corrupt state
+# is detected before it is saved, so a restart resumes from the last good phase).
+game_restart_retry = retry(retry_on=lambda exception: isinstance(exception, CorruptGameStateError))
+
+
+@game_restart_retry
+def run_single_mafia_same(llm_name: str, seed: int = None, checkpoint_path: str = None):
+    game = MafiaGame.resume(checkpoint_path) or MafiaGame(llm_name, seed=seed)
+    game.checkpoint_path = checkpoint_path
+    game.run()
+    return game.game_data
+
+
+@game_restart_retry
+def run_single_mafia_different(llm_names: list, preassigned_roles: list, seed: int = None,
+                               checkpoint_path: str = None):
+    game = MafiaGame.resume(checkpoint_path) or MafiaGame.from_llm_list(llm_names, preassigned_roles, seed=seed)
+    game.checkpoint_path = checkpoint_path
     game.run()
     return game.game_data
 
 
-@retry()
-def run_single_mafia_different(llm_names: list, preassigned_roles: list):
-    game = MafiaGame.from_llm_list(llm_names, preassigned_roles)
+@game_restart_retry
+async def run_single_mafia_same_async(llm_name: str, seed: int = None, checkpoint_path: str = None):
+    game = MafiaGame.resume(checkpoint_path, AsyncAgent) or MafiaGame(llm_name, agent_cls=AsyncAgent, seed=seed)
+    game.checkpoint_path = checkpoint_path
+    await game.run_async()
+    return game.game_data
+
+
+@game_restart_retry
+async def run_single_mafia_different_async(llm_names: list, preassigned_roles: list, seed: int = None,
+                                           checkpoint_path: str = None):
+    game = (MafiaGame.resume(checkpoint_path, AsyncAgent)
+            or MafiaGame.from_llm_list(llm_names, preassigned_roles, agent_cls=AsyncAgent, seed=seed))
+    game.checkpoint_path = checkpoint_path
+    await game.run_async()
+    return game.game_data
+
+
+@game_restart_retry
+def run_branch(parent_checkpoint: dict, branch_seed: int, branch_index: int = 0, checkpoint_path: str = None):
+    game = MafiaGame.resume(checkpoint_path) or MafiaGame.from_checkpoint(parent_checkpoint).fork(branch_seed,
+                                                                                                  branch_index)
+    game.checkpoint_path = checkpoint_path
     game.run()
     return game.game_data
 
 
-def run_games_same_llm(llm_name: str, number_of_games: int, json_name: str):
+@game_restart_retry
+async def run_branch_async(parent_checkpoint: dict, branch_seed: int, branch_index: int = 0,
+                           checkpoint_path: str = None):
+    game = (MafiaGame.resume(checkpoint_path, AsyncAgent)
+            or MafiaGame.from_checkpoint(parent_checkpoint, AsyncAgent).fork(branch_seed, branch_index))
+    game.checkpoint_path = checkpoint_path
+    await game.run_async()
+    return game.game_data
+
+
+def run_games_same_llm(llm_name: str, number_of_games: int, json_name: str, seed: int = None):
+    """:param json_name: The JSONL game store the games are appended to as they finish."""
+    tournament_rng = random.Random(seed)
     games_total_record = []
-    for i in range(number_of_games):
-        game_data = run_single_mafia_same(llm_name)
-        if i != 0:
-            with open(json_name, "r") as file:
-                games_total_record = json.load(file)
-        games_total_record.append(game_data)
-        with open(json_name, "w") as file:
-            json.dump(games_total_record, file, indent=4)
+    with GameStore(json_name) as store:
+        for i in range(number_of_games):
+            game_data = run_single_mafia_same(llm_name, seed=tournament_rng.randrange(2 ** 32))
+            games_total_record.append(game_data)
+            store.append(game_data)
     return games_total_record
 
 
 all_roles = []
 all_llms = []
 
-
-def run_games_different_llms(number_of_games: int, json_name: str):
-    llms = ["openai", "gemini", "grok", "claude", "deepseek"]
-
-    target_detective = number_of_games // 5
-    target_don = number_of_games // 5
-    target_mafia = (2 * number_of_games) // 5
-    target_civilian = (6 * number_of_games) // 5
-
-    role_counts = {
-        llm: {"detective": target_detective, "don": target_don, "mafia": target_mafia, "civilian": target_civilian} for
-        llm in llms}
+DIFFERENT_LLMS = ["openai", "gemini", "grok", "claude", "deepseek"]
+GAME_ROLES = ["detective", "don", "mafia", "mafia", "civilian", "civilian", "civilian", "civilian", "civilian",
+              "civilian"]
+
+
+def assign_llms_to_roles(number_of_games: int, rng: random.Random = random, llms: list = None,
+                         roles: list = None) -> list:
+    """
+    Builds a balanced LLM x role design directly, without any trial and error: games are planned in
+    blocks of len(llms) games, and in game g of a block the LLM in seat s is llms[(s + g) % len(llms)],
+    a cyclic Latin square in which every seat, and so every role, goes to every LLM exactly once per block.
+    Each block relabels the LLMs, reorders the seats and shuffles its games with rng, so the design is
+    seeded but not predictable.
+    :param llms: The LLMs, DIFFERENT_LLMS by default. Each plays len(roles) / len(llms) seats per game,
+        rounded up or down when that is not a whole number.
+    :param roles: The roles of a game, GAME_ROLES by default.
+    :return: For every game, the LLM of each role of roles.
+    """
+    llms = llms or DIFFERENT_LLMS
+    roles = roles or GAME_ROLES
+    assert number_of_games % len(llms) == 0, \
+        f"Balancing the roles over {len(llms)} LLMs needs a multiple of {len(llms)} games, got {number_of_games}."
 
     all_assigned_llms = []
+    for _ in range(number_of_games // len(llms)):
+        labels = rng.sample(llms, len(llms))
+        seats = rng.sample(range(len(roles)), len(roles))
+        block = [[labels[(seat + game_idx) % len(llms)] for seat in seats] for game_idx in range(len(llms))]
+        rng.shuffle(block)
+        all_assigned_llms.extend(block)
+    return all_assigned_llms
+
+
+def run_games_different_llms(number_of_games: int, json_name: str, seed: int = None):
+    tournament_rng = random.Random(seed)
+    all_assigned_llms = assign_llms_to_roles(number_of_games, tournament_rng)
+    validate_llms_and_roles(all_assigned_llms, [GAME_ROLES] * number_of_games, number_of_games)
     games_total_record = []
 
-    for game_idx in range(number_of_games):
-        while True:
-            try:
-                temp_role_counts = {llm: role_counts[llm].copy() for llm in llms}
-                players = []
-                for llm in llms:
-                    players.append(llm)
-                    players.append(llm)
-
-                random.shuffle(players)
-
-                assigned_llms = []
-
-                def pick_player(role, candidates):
-                    for idx, llm in enumerate(candidates):
-                        if temp_role_counts[llm][role] > 0:
-                            return idx, llm
-                    return None, None
-
-                candidates = players.copy()
-
-                idx, llm = pick_player("detective", candidates)
-                assert llm is not None, "No available LLM for Detective!"
-                assigned_llms.append(llm)
-                temp_role_counts[llm]["detective"] -= 1
-                candidates.pop(idx)
-
-                idx, llm = pick_player("don", candidates)
-                assert llm is not None, "No available LLM for Don!"
-                assigned_llms.append(llm)
-                temp_role_counts[llm]["don"] -= 1
-                candidates.pop(idx)
-
-                for _ in range(2):
-                    idx, llm = pick_player("mafia", candidates)
-                    assert llm is not None, "No available LLM for Mafia!"
-                    assigned_llms.append(llm)
-                    temp_role_counts[llm]["mafia"] -= 1
-                    candidates.pop(idx)
-
-                for _ in range(6):
-                    idx, llm = pick_player("civilian", candidates)
-                    assert llm is not None, "No available LLM for Civilian!"
-                    assigned_llms.append(llm)
-                    temp_role_counts[llm]["civilian"] -= 1
-                    candidates.pop(idx)
-
-                role_counts = temp_role_counts
-                all_assigned_llms.append(assigned_llms)
-                print(assigned_llms)
-                break
-            except AssertionError as e:
-                print(f"⚠️ Retry because of game {game_idx + 1} due to assignment issue: {e}")
-    pprint(role_counts)
-
-    for llms_row in all_assigned_llms:
-        roles = ["detective", "don", "mafia", "mafia", "civilian", "civilian", "civilian", "civilian", "civilian",
-                 "civilian"]
-        game_data = run_single_mafia_different(llm_names=llms_row, preassigned_roles=roles)
-        games_total_record.append(game_data)
-        with open(json_name, "w") as file:
-            json.dump(games_total_record, file, indent=4)
-
-
-run_games_different_llms(10, "different_4.json")
-run_games_same_llm(llm_name="openai", number_of_games=1, json_name="mafia_same_10s_1.json")
\ No newline at end of file
+    with GameStore(json_name) as store:
+        for llms_row in all_assigned_llms:
+            game_data = run_single_mafia_different(llm_names=llms_row, preassigned_roles=GAME_ROLES,
+                                                   seed=tournament_rng.randrange(2 ** 32))
+            games_total_record.append(game_data)
+            store.append(game_data)
+    return games_total_record
+
+
+if __name__ == "__main__":
+    run_games_different_llms(10, "different_4.jsonl")
+    run_games_same_llm(llm_name="openai", number_of_games=1, json_name="mafia_same_10s_1.jsonl")
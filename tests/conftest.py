@@ -0,0 +1,15 @@
+import os
+import sys
+
+import pytest
+
+# The modules live at the top of the repository.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def offline(monkeypatch):
+    """Games against the mock provider without its recorded latencies or the LLM response cache."""
+    import config
+    monkeypatch.setattr(config, "MOCK_LATENCY_SCALE", 0.0)
+    monkeypatch.setattr(config, "LLM_CACHE_MODE", "off")
@@ -0,0 +1,76 @@
+import json
+
+import config
+from agent import Agent
+from budget import CostLedger, TournamentBudget, game_costs, get_cost_ledger
+from game import MafiaGame
+from providers import get_provider
+
+
+def record_call(agent, replayed):
+    usage_before = agent._usage_snapshot()
+    agent.input_tokens_used += 100000
+    agent.output_tokens_used += 10000
+    agent.last_call_timing = {"streamed": False, "replayed": replayed, "stopped_early": False,
+                              "time_to_first_token": None, "total_time": 0.0}
+    agent._record_call_cost("vote", usage_before, 100000)
+    return agent.call_costs[-1]
+
+
+def test_replayed_calls_cost_nothing():
+    agent = Agent("openai", "player_0", "civilian", [])
+    spent = get_cost_ledger().cost("openai")
+
+    replayed = record_call(agent, replayed=True)
+    assert replayed["cost"] == 0.0
+    assert replayed["input_tokens"] == 100000
+    assert get_cost_ledger().cost("openai") == spent
+
+    live = record_call(agent, replayed=False)
+    assert live["cost"] > 0.0
+    assert get_cost_ledger().cost("openai") == spent + live["cost"]
+
+
+def test_replay_run_does_not_stop_the_tournament():
+    budget = TournamentBudget(limit=0.01)
+    agent = Agent("openai", "player_0", "civilian", [])
+    assert budget.admit({"openai"})
+    for _ in range(10):
+        record_call(agent, replayed=True)
+    game_data = {"game_details": {"players": [{"call_costs": agent.call_costs}]}}
+    assert game_costs(game_data) == {"openai": 0.0}
+    budget.finished({"openai"}, game_data)
+    assert budget.admit({"openai"})
+
+
+def test_calls_in_flight_count_against_the_budget(monkeypatch):
+    ledger = CostLedger()
+    monkeypatch.setattr("budget._COST_LEDGER", ledger)
+    budget = TournamentBudget(limit=1.0)
+    ledger.reserve("openai", 2.0)
+    assert not budget.admit({"openai"})
+    ledger.release("openai", 2.0)
+    assert budget.admit({"openai"})
+
+
+def test_responses_replayed_from_a_checkpoint_cost_nothing(offline, monkeypatch):
+    ledger = CostLedger()
+    monkeypatch.setattr("budget._COST_LEDGER", ledger)
+    monkeypatch.setitem(config.TOKEN_PRICES, "mock", {"input": 1, "cached_input": 1, "cache_write": 1,
+                                                      "output": 1, "thinking": 1})
+    provider = get_provider("mock")
+    game = MafiaGame("mock", seed=1)
+    game.submit_responses({request.request_id: provider.parse(provider.create(request.request))
+                           for request in game.pending_requests()[:2]})
+    checkpoint = json.loads(json.dumps(game.to_checkpoint()))
+    assert len(checkpoint["responses"]) == 2
+    spent = ledger.cost("mock")
+    assert spent > 0.0
+
+    resumed = MafiaGame.from_checkpoint(checkpoint)
+    resumed.pending_requests()
+
+    replayed = [cost for player in resumed.players for cost in player.call_costs]
+    assert len(replayed) == 2
+    assert all(cost["replayed"] and cost["cost"] == 0.0 for cost in replayed)
+    assert ledger.cost("mock") == spent
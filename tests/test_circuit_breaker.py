@@ -0,0 +1,43 @@
+import asyncio
+
+import pytest
+
+from utils import CircuitBreaker, CircuitOpenError, retry
+
+
+def test_cancelled_trial_call_does_not_block_the_breaker():
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=0)
+    breaker.record_failure()
+
+    @retry(retries=1, breaker=lambda: breaker)
+    async def hanging_call():
+        await asyncio.sleep(10)
+
+    async def cancel_trial():
+        task = asyncio.ensure_future(hanging_call())
+        await asyncio.sleep(0)
+        assert breaker.trial_running
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(cancel_trial())
+    assert not breaker.trial_running
+
+    @retry(retries=1, breaker=lambda: breaker)
+    def working_call():
+        return "ok"
+
+    assert working_call() == "ok"
+    assert breaker.opened_at is None
+
+
+def test_failed_trial_reopens_the_breaker():
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=0)
+    breaker.record_failure()
+    trial = breaker.before_call()
+    breaker.record_failure()
+    breaker.end_trial(trial)
+    breaker.reset_timeout = 60
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
@@ -0,0 +1,48 @@
+from agent import CALL_RECORDS, USAGE_COUNTERS
+from game import MafiaGame
+from providers import get_provider
+
+
+def play_phases(game, phases):
+    for _ in range(phases):
+        game._drive(game._next_phase_steps())
+        game._end_phase()
+
+
+def test_fresh_branch_reports_no_prefix_spend(offline):
+    parent = MafiaGame("mock", seed=1)
+    play_phases(parent, 2)
+    assert any(player.call_costs for player in parent.players)
+
+    branch = parent.fork(seed=2)
+
+    for player in branch.players:
+        assert all(getattr(player, counter) == 0 for counter in USAGE_COUNTERS)
+        assert all(getattr(player, records) == [] for records in CALL_RECORDS)
+    play_phases(branch, 1)
+    calls = sum(len(player.call_costs) for player in branch.players)
+    assert calls == sum(len(player.call_timings) for player in branch.players) > 0
+    assert all(cost["phase"] == "night2" for player in branch.players for cost in player.call_costs)
+
+
+def answer_pending(game, requests):
+    provider = get_provider("mock")
+    game.submit_responses({request.request_id: provider.parse(provider.create(request.request))
+                           for request in requests})
+
+
+def test_fork_during_a_phase_links_to_the_state_it_restarts_from(offline):
+    parent = MafiaGame("mock", seed=3)
+    while parent.phase_label != "day1":
+        assert not parent.is_over
+        answer_pending(parent, parent.pending_requests())
+    day_start_events = len(parent.to_checkpoint()["events"])
+    answer_pending(parent, parent.pending_requests()[:1])
+    assert parent.game_id == "3_day1"
+    assert len(parent.events.events) > day_start_events
+
+    branch = parent.fork(seed=4)
+
+    assert branch.game_data["branch"]["parent_id"] == "3_day1"
+    assert branch.game_data["branch"]["prefix_events"] == day_start_events == len(branch.events.events)
+    assert branch.game_id == "3_day1"
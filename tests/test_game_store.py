@@ -0,0 +1,30 @@
+import json
+
+from game_store import GameStore, read_games, read_manifest
+
+
+def test_append_without_manifest_keeps_complete_records(tmp_path):
+    path = str(tmp_path / "games.jsonl")
+    with open(path, "w") as file:
+        file.write('{"seed":1}\n{"seed":2}\n{"seed":')
+
+    with GameStore(path, append=True) as store:
+        store.append({"seed": 3})
+
+    assert [game["seed"] for game in read_games(path)] == [1, 2, 3]
+    with open(path, "rb") as file:
+        size = len(file.read())
+    assert read_manifest(path) == {"file": "games.jsonl", "games": 3, "bytes": size}
+
+
+def test_append_with_manifest_cuts_torn_record(tmp_path):
+    path = str(tmp_path / "games.jsonl")
+    with GameStore(path) as store:
+        store.append({"seed": 1})
+    with open(path, "a") as file:
+        file.write(json.dumps({"seed": 2})[:5])
+
+    with GameStore(path, append=True) as store:
+        store.append({"seed": 3})
+
+    assert [game["seed"] for game in read_games(path)] == [1, 3]
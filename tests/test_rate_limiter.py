@@ -0,0 +1,23 @@
+import rate_limiter
+from rate_limiter import limiter_for, scaled_limits, share_rate_limits
+
+
+def test_scaled_limits_divide_every_limit():
+    limits = {"requests_per_minute": 500, "input_tokens_per_minute": 200000, "max_in_flight": 50}
+    assert scaled_limits(limits, 10) == {"requests_per_minute": 50, "input_tokens_per_minute": 20000,
+                                         "max_in_flight": 5}
+    assert scaled_limits({"max_in_flight": 3}, 10) == {"max_in_flight": 1}
+
+
+def test_worker_limiter_gets_its_share(monkeypatch):
+    monkeypatch.setattr(rate_limiter.config, "RATE_LIMITS",
+                        {"openai": {"requests_per_minute": 600, "input_tokens_per_minute": 60000,
+                                    "max_in_flight": 40}})
+    share_rate_limits(4)
+    try:
+        limiter = limiter_for("openai")
+        assert limiter.requests.capacity == 150
+        assert limiter.input_tokens.capacity == 15000
+        assert limiter.max_in_flight == 10
+    finally:
+        share_rate_limits(1)
@@ -0,0 +1,5 @@
+from analysis_generator import check_startup, STARTUP_BUDGET_SECONDS
+
+
+def test_analysis_generator_starts_within_budget():
+    assert check_startup() < STARTUP_BUDGET_SECONDS
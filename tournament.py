@@ -0,0 +1,383 @@
+import os
+import time
+import shutil
+import random
+import asyncio
+import logging
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from simulate import run_single_mafia_same, run_single_mafia_different
+from simulate import run_single_mafia_same_async, run_single_mafia_different_async
+from simulate import run_branch, run_branch_async
+from simulate import assign_llms_to_roles, validate_llms_and_roles, GAME_ROLES
+from game import MafiaGame
+from agent import LLMRequest, provider_retry, call_provider_async
+from providers import get_provider
+from rate_limiter import limiter_for, share_rate_limits
+from checkpoint import write_checkpoint
+from game_store import GameStore
+from budget import TournamentBudget
+import config
+
+EXECUTORS = {
+    "process": ProcessPoolExecutor,
+    "thread": ThreadPoolExecutor,
+}
+
+
+def same_llm_schedule(llm_name: str, number_of_games: int, seed: int = None) -> list:
+    tournament_rng = random.Random(seed)
+    return [{"llm_name": llm_name, "seed": tournament_rng.randrange(2 ** 32)} for _ in range(number_of_games)]
+
+
+def different_llms_schedule(number_of_games: int, seed: int = None) -> list:
+    """
+    Builds the role-balanced LLM assignment for all games up front, so the games can then
+    finish in any order without affecting how often each LLM played each role.
+    Every game gets its own seed drawn from the tournament seed, so a tournament run on a pool
+    plays exactly the same games as the same tournament run serially.
+    """
+    tournament_rng = random.Random(seed)
+    all_assigned_llms = assign_llms_to_roles(number_of_games, tournament_rng)
+    validate_llms_and_roles(all_assigned_llms, [GAME_ROLES] * number_of_games, number_of_games)
+    return [{"llm_names": llms_row, "preassigned_roles": GAME_ROLES, "seed": tournament_rng.randrange(2 ** 32)}
+            for llms_row in all_assigned_llms]
+
+
+def branch_schedule(parent, number_of_branches: int, seed: int = None) -> list:
+    """
+    Forks a game into number_of_branches continuations of its current phase, each with its own seed
+    drawn from seed. The branches replay nothing: they all start from the parent's checkpoint, and as
+    their prompts begin with the same recorded history, the provider prompt caches serve that prefix.
+    :param parent: A MafiaGame between two phases, e.g. restored with MafiaGame.resume.
+    """
+    branch_rng = random.Random(seed)
+    parent_checkpoint = parent.to_checkpoint()
+    return [{"parent_checkpoint": parent_checkpoint, "branch_seed": branch_rng.randrange(2 ** 32),
+             "branch_index": branch_index}
+            for branch_index in range(number_of_branches)]
+
+
+def checkpoint_dir_for(json_name: str) -> str:
+    return os.path.splitext(json_name)[0] + "_checkpoints"
+
+
+def with_checkpoints(game_specs: list, checkpoint_dir: str) -> list:
+    """
+    Gives every game a checkpoint file named after its place in the schedule, so a restarted tournament
+    resumes each unfinished game from its last phase and takes finished games from their final checkpoint.
+    """
+    return [dict(game_spec, checkpoint_path=os.path.join(checkpoint_dir, f"game_{game_idx:04d}.json.gz"))
+            for game_idx, game_spec in enumerate(game_specs)]
+
+
+def _remove_checkpoints(results: list, checkpoint_dir: str):
+    """Removes the checkpoints once every game finished; otherwise keeps them for the next run."""
+    if all(game_data is not None for game_data in results):
+        shutil.rmtree(checkpoint_dir, ignore_errors=True)
+    else:
+        print(f"Kept the checkpoints in {checkpoint_dir}, rerun the tournament to resume the failed or skipped games.")
+
+
+def game_llms(game_spec: dict) -> set:
+    """The providers a game of the schedule calls."""
+    if "parent_checkpoint" in game_spec:
+        return {player["llm_name"] for player in game_spec["parent_checkpoint"]["players"]}
+    if "llm_names" in game_spec:
+        return set(game_spec["llm_names"])
+    return {game_spec["llm_name"]}
+
+
+def run_game(game_spec: dict) -> dict:
+    if "parent_checkpoint" in game_spec:
+        return run_branch(**game_spec)
+    if "llm_names" in game_spec:
+        return run_single_mafia_different(**game_spec)
+    return run_single_mafia_same(**game_spec)
+
+
+async def run_game_async(game_spec: dict) -> dict:
+    if "parent_checkpoint" in game_spec:
+        return await run_branch_async(**game_spec)
+    if "llm_names" in game_spec:
+        return await run_single_mafia_different_async(**game_spec)
+    return await run_single_mafia_same_async(**game_spec)
+
+
+def build_game(game_spec: dict) -> MafiaGame:
+    """The game of a schedule entry, resumed from its checkpoint if it has one, for the step API."""
+    checkpoint_path = game_spec.get("checkpoint_path")
+    game = MafiaGame.resume(checkpoint_path)
+    if game is None and "parent_checkpoint" in game_spec:
+        game = MafiaGame.from_checkpoint(game_spec["parent_checkpoint"]).fork(game_spec["branch_seed"],
+                                                                               game_spec.get("branch_index", 0))
+    elif game is None and "llm_names" in game_spec:
+        game = MafiaGame.from_llm_list(game_spec["llm_names"], game_spec["preassigned_roles"], seed=game_spec.get("seed"))
+    elif game is None:
+        game = MafiaGame(game_spec["llm_name"], seed=game_spec.get("seed"))
+    game.checkpoint_path = checkpoint_path
+    return game
+
+
+@provider_retry(lambda llm_request: llm_request.llm_name)
+async def send_request(llm_request: LLMRequest) -> tuple:
+    """
+    Makes the provider call of a step API request under the provider's rate limiter, streamed and stopped
+    early like the calls of the agents (config.STREAM_RESPONSES, LLMRequest.stop_condition). Returns
+    (text, TokenUsage, call timing) for MafiaGame.submit_responses.
+    """
+    limiter = limiter_for(llm_request.llm_name)
+    async with limiter.limit_async(llm_request.estimated_tokens):
+        start_time = time.monotonic()
+        output_text, usage, first_token_time, stopped_early = await call_provider_async(
+            get_provider(llm_request.llm_name), llm_request.request, llm_request.stop_condition)
+    if usage is not None:
+        limiter.settle(llm_request.estimated_tokens,
+                       usage.input_tokens + usage.cached_input_tokens + usage.cache_write_input_tokens)
+    call_timing = {
+        "streamed": config.STREAM_RESPONSES,
+        "stopped_early": stopped_early,
+        "time_to_first_token": first_token_time - start_time if first_token_time is not None else None,
+    }
+    return output_text, usage, call_timing
+
+
+def games_per_hour(games_finished: int, start_time: float) -> float:
+    elapsed = time.monotonic() - start_time
+    return games_finished / elapsed * 3600 if elapsed > 0 else 0.0
+
+
+def _record_finished_game(game_data: dict, game_idx: int, finished: list, number_of_games: int, start_time: float,
+                          store: GameStore):
+    finished.append(game_data)
+    store.append(game_data)
+    print(f"Game {game_idx + 1} finished ({len(finished)}/{number_of_games}) - "
+          f"{games_per_hour(len(finished), start_time):.2f} games/hour")
+
+
+def _print_tournament_summary(finished: list, number_of_games: int, start_time: float, budget: TournamentBudget):
+    skipped = f", skipped {budget.skipped} over budget" if budget.skipped else ""
+    print(f"Tournament finished: {len(finished)}/{number_of_games} games{skipped}, "
+          f"{games_per_hour(len(finished), start_time):.2f} games/hour, ${budget.spent():.4f} spent")
+
+
+def run_tournament(game_specs: list, json_name: str, executor: str = "process", max_workers: int = 4,
+                   checkpoint_dir: str = None, budget: float = None, provider_budgets: dict = None) -> list:
+    """
+    Runs independent games on a process or thread pool and appends them to the JSONL game store
+    json_name as they complete.
+    :param game_specs: Games from same_llm_schedule or different_llms_schedule. To resume an interrupted
+        tournament, rerun it with the same schedule (i.e. the same seed).
+    :param executor: "process" or "thread". The rate limiters of config.RATE_LIMITS are per process,
+        so with "process" every worker is limited to 1/max_workers of them (see share_rate_limits).
+    :param max_workers: Number of games played at the same time.
+    :param checkpoint_dir: Where the games are checkpointed after every phase, next to json_name by default.
+        It is removed when all games finished.
+    :param budget: Spend cap of the tournament in USD, config.TOURNAMENT_BUDGET by default.
+    :param provider_budgets: Spend caps per provider in USD, config.PROVIDER_BUDGETS by default.
+        Games are only started while their projected spend fits the caps (see budget.TournamentBudget);
+        the others are skipped, and their checkpoints kept for a rerun with a larger budget.
+    :return: The game data of every game in schedule order, None for games that failed or were skipped.
+    """
+    checkpoint_dir = checkpoint_dir or checkpoint_dir_for(json_name)
+    game_specs = with_checkpoints(game_specs, checkpoint_dir)
+    budget = TournamentBudget(budget if budget is not None else config.TOURNAMENT_BUDGET,
+                              provider_budgets if provider_budgets is not None else config.PROVIDER_BUDGETS)
+    results = [None] * len(game_specs)
+    finished = []
+    start_time = time.monotonic()
+
+    pool_options = {"initializer": share_rate_limits, "initargs": (max_workers,)} if executor == "process" else {}
+    with GameStore(json_name) as store, EXECUTORS[executor](max_workers=max_workers, **pool_options) as pool:
+        # Games are submitted one at a time as workers free up, so the budget is checked before each one.
+        scheduled = iter(enumerate(game_specs))
+        running = {}
+        while True:
+            for game_idx, game_spec in scheduled:
+                if budget.admit(game_llms(game_spec)):
+                    running[pool.submit(run_game, game_spec)] = game_idx
+                    if len(running) >= max_workers:
+                        break
+            if not running:
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                game_idx = running.pop(future)
+                try:
+                    results[game_idx] = future.result()
+                except Exception:
+                    logging.exception(f"Game {game_idx + 1} failed after all retries.")
+                budget.finished(game_llms(game_specs[game_idx]), results[game_idx])
+                if results[game_idx] is not None:
+                    _record_finished_game(results[game_idx], game_idx, finished, len(game_specs), start_time, store)
+
+    _print_tournament_summary(finished, len(game_specs), start_time, budget)
+    _remove_checkpoints(results, checkpoint_dir)
+    return results
+
+
+async def run_tournament_async(game_specs: list, json_name: str, max_concurrent_games: int = 100,
+                               checkpoint_dir: str = None, budget: float = None, provider_budgets: dict = None) -> list:
+    """
+    Same as run_tournament, but plays the games with AsyncAgent players on one event loop.
+    """
+    checkpoint_dir = checkpoint_dir or checkpoint_dir_for(json_name)
+    game_specs = with_checkpoints(game_specs, checkpoint_dir)
+    budget = TournamentBudget(budget if budget is not None else config.TOURNAMENT_BUDGET,
+                              provider_budgets if provider_budgets is not None else config.PROVIDER_BUDGETS)
+    results = [None] * len(game_specs)
+    finished = []
+    start_time = time.monotonic()
+    semaphore = asyncio.Semaphore(max_concurrent_games)
+
+    async def play(game_idx, game_spec):
+        async with semaphore:
+            llm_names = game_llms(game_spec)
+            if not budget.admit(llm_names):
+                return game_idx, None
+            game_data = None
+            try:
+                game_data = await run_game_async(game_spec)
+            except Exception:
+                logging.exception(f"Game {game_idx + 1} failed after all retries.")
+            budget.finished(llm_names, game_data)
+            return game_idx, game_data
+
+    with GameStore(json_name) as store:
+        for next_finished in asyncio.as_completed([play(game_idx, spec) for game_idx, spec in enumerate(game_specs)]):
+            game_idx, game_data = await next_finished
+            if game_data is None:
+                continue
+            results[game_idx] = game_data
+            _record_finished_game(game_data, game_idx, finished, len(game_specs), start_time, store)
+
+    _print_tournament_summary(finished, len(game_specs), start_time, budget)
+    _remove_checkpoints(results, checkpoint_dir)
+    return results
+
+
+async def run_tournament_stepwise(game_specs: list, json_name: str, max_concurrent_games: int = 1000,
+                                  max_requests_in_flight: int = 200, checkpoint_dir: str = None, budget: float = None,
+                                  provider_budgets: dict = None) -> list:
+    """
+    Same as run_tournament_async, but one scheduler drives all games through their step API
+    (MafiaGame.pending_requests): the pending requests of every game are sent together, at most
+    max_requests_in_flight at a time, and a game is checkpointed whenever it received responses, so a
+    restarted tournament loses no answered call. A game whose call fails after all retries is dropped
+    and resumed from its checkpoint by the next run.
+    """
+    checkpoint_dir = checkpoint_dir or checkpoint_dir_for(json_name)
+    game_specs = with_checkpoints(game_specs, checkpoint_dir)
+    budget = TournamentBudget(budget if budget is not None else config.TOURNAMENT_BUDGET,
+                              provider_budgets if provider_budgets is not None else config.PROVIDER_BUDGETS)
+    results = [None] * len(game_specs)
+    finished = []
+    start_time = time.monotonic()
+    semaphore = asyncio.Semaphore(max_requests_in_flight)
+    queued = list(enumerate(game_specs))
+    games = {}
+    sent = {}
+    in_flight = set()
+
+    async def answer(game_idx, llm_request):
+        async with semaphore:
+            try:
+                return game_idx, llm_request.request_id, await send_request(llm_request)
+            except Exception as error:
+                return game_idx, llm_request.request_id, error
+
+    with GameStore(json_name) as store:
+        def end_game(game_idx, game_data):
+            del games[game_idx], sent[game_idx]
+            budget.finished(game_llms(game_specs[game_idx]), game_data)
+            if game_data is not None:
+                results[game_idx] = game_data
+                _record_finished_game(game_data, game_idx, finished, len(game_specs), start_time, store)
+
+        def send_pending(game_idx):
+            game = games[game_idx]
+            try:
+                pending = game.pending_requests()
+            except Exception:
+                logging.exception(f"Game {game_idx + 1} failed.")
+                end_game(game_idx, None)
+                return
+            if game.is_over:
+                end_game(game_idx, game.game_data)
+                return
+            for llm_request in pending:
+                if llm_request.request_id not in sent[game_idx]:
+                    sent[game_idx].add(llm_request.request_id)
+                    in_flight.add(asyncio.ensure_future(answer(game_idx, llm_request)))
+
+        def start_games():
+            while queued and len(games) < max_concurrent_games:
+                game_idx, game_spec = queued.pop(0)
+                if not budget.admit(game_llms(game_spec)):
+                    continue
+                games[game_idx], sent[game_idx] = build_game(game_spec), set()
+                send_pending(game_idx)
+
+        start_games()
+        while in_flight:
+            done, in_flight = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+            responses = {}
+            for task in done:
+                game_idx, request_id, response = task.result()
+                if game_idx not in games:
+                    continue
+                if isinstance(response, Exception):
+                    logging.error(f"Game {game_idx + 1} failed after all retries: {response!r}")
+                    end_game(game_idx, None)
+                    continue
+                responses.setdefault(game_idx, {})[request_id] = response
+            for game_idx, game_responses in responses.items():
+                if game_idx not in games:
+                    continue
+                sent[game_idx].difference_update(game_responses)
+                try:
+                    games[game_idx].submit_responses(game_responses)
+                    games[game_idx].save_checkpoint()
+                except Exception:
+                    logging.exception(f"Game {game_idx + 1} failed.")
+                    end_game(game_idx, None)
+                    continue
+                send_pending(game_idx)
+            start_games()
+
+    _print_tournament_summary(finished, len(game_specs), start_time, budget)
+    _remove_checkpoints(results, checkpoint_dir)
+    return results
+
+
+def _save_parent(parent, json_name: str) -> str:
+    parent_path = os.path.splitext(json_name)[0] + "_parent.json.gz"
+    write_checkpoint(parent_path, parent.to_checkpoint())
+    return parent_path
+
+
+def run_branches(parent, number_of_branches: int, json_name: str, seed: int = None, executor: str = "thread",
+                 max_workers: int = 4) -> list:
+    """
+    Plays number_of_branches continuations of parent concurrently (see branch_schedule) and stores their
+    game data in json_name. Every branch links to the parent through game_data["branch"]["parent_id"],
+    and the parent itself is checkpointed next to json_name, so the shared prefix is stored only once.
+    """
+    print(f"Forking {parent.game_id} into {number_of_branches} branches, parent saved to "
+          f"{_save_parent(parent, json_name)}")
+    return run_tournament(branch_schedule(parent, number_of_branches, seed), json_name, executor, max_workers)
+
+
+async def run_branches_async(parent, number_of_branches: int, json_name: str, seed: int = None,
+                             max_concurrent_games: int = 100) -> list:
+    """
+    Same as run_branches, but plays the branches with AsyncAgent players on one event loop.
+    """
+    print(f"Forking {parent.game_id} into {number_of_branches} branches, parent saved to "
+          f"{_save_parent(parent, json_name)}")
+    return await run_tournament_async(branch_schedule(parent, number_of_branches, seed), json_name,
+                                      max_concurrent_games)
+
+
+if __name__ == "__main__":
+    run_tournament(different_llms_schedule(50), "different_tournament.jsonl", executor="process", max_workers=10)
@@ -1,57 +1,222 @@
 import time
+import random
 import asyncio
+import inspect
 import logging
 import functools
+import threading
 
+# Separate generator so retry jitter never consumes the random state of a running game.
+_jitter_random = random.Random()
 
-def retry(retries=3, delay=1):
+TRANSIENT_STATUS_CODES = {408, 409, 429}
+TRANSIENT_ERROR_NAMES = ("Timeout", "Connection", "RateLimit", "Overloaded", "InternalServer", "ServiceUnavailable")
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a provider whose circuit breaker is open."""
+
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"Circuit breaker '{name}' is open, retry in {retry_after:.1f} seconds.")
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    Opens after failure_threshold consecutive transient failures and rejects calls for reset_timeout
+    seconds. After that a single trial call is let through: success closes it, failure opens it again,
+    and a trial cancelled before either (see end_trial) lets the next call through as a new trial.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 60):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+        self.trials = 0
+        self.lock = threading.Lock()
+
+    def before_call(self):
+        """Raises CircuitOpenError while open. Returns the number of the trial it lets through, if any."""
+        with self.lock:
+            if self.opened_at is None:
+                return None
+            remaining = self.opened_at + self.reset_timeout - time.monotonic()
+            if remaining > 0 or self.trial_running:
+                raise CircuitOpenError(self.name, max(remaining, 1.0))
+            self.trial_running = True
+            self.trials += 1
+            return self.trials
+
+    def end_trial(self, trial: int):
+        """Called once a trial call is over, however it ended, so a cancelled trial does not block the breaker."""
+        with self.lock:
+            if trial == self.trials:
+                self.trial_running = False
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_running = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.trial_running or self.failures >= self.failure_threshold:
+                if self.opened_at is None or self.trial_running:
+                    logging.warning(f"Circuit breaker '{self.name}' opened after {self.failures} failures.")
+                self.opened_at = time.monotonic()
+            self.trial_running = False
+
+
+_circuit_breakers = {}
+_circuit_breakers_lock = threading.Lock()
+
+
+def circuit_breaker_for(name: str) -> CircuitBreaker:
+    """Returns the process-wide circuit breaker with the given name, usually a provider name."""
+    with _circuit_breakers_lock:
+        if name not in _circuit_breakers:
+            _circuit_breakers[name] = CircuitBreaker(name)
+        return _circuit_breakers[name]
+
+
+def _status_code(exception: Exception):
+    for attribute in ("status_code", "status", "code"):
+        value = getattr(exception, attribute, None)
+        if isinstance(value, int):
+            return value
+    return None
+
+
+def is_transient_error(exception: Exception) -> bool:
+    """
+    True for errors that may go away on their own: rate limits, 5xx, timeouts, dropped connections
+    and open circuit breakers. Anything else, e.g. a bad request or a parsing bug, is permanent.
+    """
+    if isinstance(exception, (CircuitOpenError, TimeoutError, ConnectionError, asyncio.TimeoutError)):
+        return True
+    status_code = _status_code(exception)
+    if status_code is not None:
+        return status_code in TRANSIENT_STATUS_CODES or status_code >= 500
+    return any(name in cls.__name__ for cls in type(exception).__mro__ for name in TRANSIENT_ERROR_NAMES)
+
+
+def retry_after_seconds(exception: Exception):
+    """Reads the Retry-After (or retry-after-ms) header of a provider error, None if there is none."""
+    if isinstance(exception, CircuitOpenError):
+        return exception.retry_after
+    headers = getattr(getattr(exception, "response", None), "headers", None)
+    if not headers:
+        return None
+    try:
+        if headers.get("retry-after-ms") is not None:
+            return float(headers.get("retry-after-ms")) / 1000
+        if headers.get("retry-after") is not None:
+            return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        pass
+    return None
+
+
+def retry(retries=3, delay=1, backoff=1, max_delay=None, jitter=False, retry_on=None, breaker=None):
     """
     Decorator that retries a function or method until it succeeds or reaches a specified number of attempts.
     :param retries: Number of times to retry the function.
     :param delay: Delay between retries in seconds.
+    :param backoff: Factor the delay is multiplied with after every failed attempt.
+    :param max_delay: Upper bound for the delay, None for no bound.
+    :param jitter: Randomize every delay between half and all of its value, so callers failing together
+        do not retry together.
+    :param retry_on: Predicate deciding if an exception is worth retrying, None retries every exception.
+    :param breaker: Function receiving the call arguments and returning the CircuitBreaker guarding the call.
+    A Retry-After header on the exception is honored if it asks for a longer delay.
     """
 
+    def next_delay(exception, attempts):
+        wait = delay * backoff ** (attempts - 1)
+        if max_delay is not None:
+            wait = min(wait, max_delay)
+        if jitter:
+            wait = _jitter_random.uniform(wait / 2, wait)
+        server_wait = retry_after_seconds(exception)
+        if server_wait is not None:
+            wait = max(wait, server_wait)
+        return wait
+
     def decorator(func):
+        def handle_failure(exception, attempts, circuit_breaker):
+            """Returns the delay before the next attempt, or None if the exception should be raised."""
+            if circuit_breaker is not None and not isinstance(exception, CircuitOpenError):
+                if is_transient_error(exception):
+                    circuit_breaker.record_failure()
+                else:
+                    circuit_breaker.record_success()
+            if retry_on is not None and not retry_on(exception):
+                return None
+            if attempts == retries:
+                return None
+            wait = next_delay(exception, attempts)
+            logging.warning(
+                f"""
+                Called function {func} FAILED.
+                Retrying in {wait:.1f} seconds.
+                Current Attempt: attempts: {attempts}
+                """
+            )
+            return wait
+
         @functools.wraps(func)
         async def async_wrapper(*args, **kwargs):
+            circuit_breaker = breaker(*args, **kwargs) if breaker else None
             attempts = 0
             while attempts < retries:
+                trial = None
                 try:
-                    return await func(*args, **kwargs)
-                except Exception:
-                    logging.warning(
-                        f"""
-                        Called function {func} FAILED.
-                        Retrying in {delay} seconds.
-                        Current Attempt: attempts: {attempts}
-                        """
-                    )
+                    if circuit_breaker is not None:
+                        trial = circuit_breaker.before_call()
+                    result = await func(*args, **kwargs)
+                    if circuit_breaker is not None:
+                        circuit_breaker.record_success()
+                    return result
+                except Exception as exception:
                     attempts += 1
-                    if attempts == retries:
+                    wait = handle_failure(exception, attempts, circuit_breaker)
+                    if wait is None:
                         raise
-                    await asyncio.sleep(delay)
+                    await asyncio.sleep(wait)
+                finally:
+                    if trial is not None:
+                        circuit_breaker.end_trial(trial)
 
         @functools.wraps(func)
         def sync_wrapper(*args, **kwargs):
+            circuit_breaker = breaker(*args, **kwargs) if breaker else None
             attempts = 0
             while attempts < retries:
+                trial = None
                 try:
-                    return func(*args, **kwargs)
-                except Exception:
-                    logging.warning(
-                        f"""
-                        Called function {func} FAILED.
-                        Retrying in {delay} seconds.
-                        Current Attempt: attempts: {attempts}
-                        """
-                    )
+                    if circuit_breaker is not None:
+                        trial = circuit_breaker.before_call()
+                    result = func(*args, **kwargs)
+                    if circuit_breaker is not None:
+                        circuit_breaker.record_success()
+                    return result
+                except Exception as exception:
                     attempts += 1
-                    if attempts == retries:
+                    wait = handle_failure(exception, attempts, circuit_breaker)
+                    if wait is None:
                         raise
-                    time.sleep(delay)
+                    time.sleep(wait)
+                finally:
+                    if trial is not None:
+                        circuit_breaker.end_trial(trial)
 
         # Check if the function is async
-        if asyncio.iscoroutinefunction(func):
+        if inspect.iscoroutinefunction(func):
             return async_wrapper
         else:
             return sync_wrapper